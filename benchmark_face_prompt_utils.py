@@ -0,0 +1,192 @@
+#%% Imports
+
+import os
+import sys
+import json
+import time
+import random
+import timeit
+import platform
+import statistics
+import tracemalloc
+import numpy as np
+
+import face_prompt_utils as fpu
+
+#%% Benchmark cases
+
+ATTRIBUTE_FUNCTION_NAMES = [
+    'get_prompt_start', 'get_random_glasses', 'get_random_gaze_direction', 'ger_facial_hair_description',
+    'get_makeup_description', 'get_location_setting_background', 'get_skin_description', 'get_hats_and_headwear',
+    'get_random_jewelry', 'get_weight_description', 'get_random_time_of_day', 'get_random_weather_condition',
+    'get_eye_description', 'get_clothing_description', 'get_random_modifier_string', 'get_random_ethnicity',
+    'get_age_sex_ethnicity', 'get_random_expression', 'get_lighting_atmosphere', 'get_hair_description',
+    'get_random_face_pose',
+]
+
+def get_benchmark_cases(batch_size=10000):
+    # case name -> (function, number of prompts produced by one call)
+    conditions_dict = {
+        'ethnicity_group': fpu.FacePromptSampler.ethnicity_groups[0],
+        'sex_group': 'female',
+        'age_group': 'elderly',
+        'lighting_category': fpu.FacePromptSampler.lighting_categories[0],
+    }
+
+    benchmark_cases = {name: (getattr(fpu, name), 1) for name in ATTRIBUTE_FUNCTION_NAMES}
+    benchmark_cases.update({
+        'generate_face_prompt': (lambda: fpu.generate_face_prompt(), 1),
+        'generate_face_prompt (conditioned)': (lambda: fpu.generate_face_prompt(**conditions_dict), 1),
+        'generate_face_prompt (attributes)': (lambda: fpu.generate_face_prompt(return_attributes=True), 1),
+        'generate_face_prompts': (lambda: fpu.generate_face_prompts(batch_size), batch_size),
+        'generate_face_prompts (conditioned)': (lambda: fpu.generate_face_prompts(batch_size, **conditions_dict), batch_size),
+        'generate_face_prompts (attributes)': (lambda: fpu.generate_face_prompts(batch_size, return_attributes=True), batch_size),
+    })
+    return benchmark_cases
+
+def reference_workload():
+    # fixed pure python workload (random draws, indexing and string joins, like the prompt generator)
+    # its latency is measured in every run to normalize away the speed of the machine at that moment
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+    return ', '.join([words[int(random.random() * len(words))] for _ in range(20)])
+
+#%% Helper functions
+
+def measure_latency(function, num_repeats=9, min_time_sec=0.1):
+    # median of num_repeats timings, each long enough to hide the timer resolution. the median is steadier than the best
+    # timing from run to run, a single lucky repeat does not set it
+    timer = timeit.Timer(function)
+    num_calls = 1
+    while timer.timeit(number=num_calls) < min_time_sec / 4:
+        num_calls *= 4
+    return statistics.median(timer.repeat(repeat=num_repeats, number=num_calls)) / num_calls
+
+def measure_peak_allocation(function, num_calls=100):
+    function()  # warm up caches (e.g. the batch tables) so they are not counted
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start_size, _ = tracemalloc.get_traced_memory()
+        for _ in range(num_calls):
+            function()
+        _, peak_size = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak_size - start_size
+
+def measure_relative_latency(function, prompts_per_call, num_repeats=9, min_time_sec=0.1):
+    # (latency per prompt in seconds, the same relative to the reference workload measured right before it)
+    reference_latency_sec = measure_latency(reference_workload, num_repeats, min_time_sec)
+    latency_sec = measure_latency(function, num_repeats, min_time_sec) / prompts_per_call
+    return latency_sec, latency_sec / reference_latency_sec
+
+def run_benchmarks(benchmark_cases, num_repeats=9, min_time_sec=0.1):
+    results = {}
+    for case_name, (function, prompts_per_call) in benchmark_cases.items():
+        latency_sec, relative_latency = measure_relative_latency(function, prompts_per_call, num_repeats, min_time_sec)
+        peak_allocation_bytes = measure_peak_allocation(function, num_calls=1 if prompts_per_call > 1 else 100)
+        results[case_name] = {
+            'latency_usec': 1e6 * latency_sec,
+            'relative_latency': relative_latency,
+            'calls_per_sec': 1 / latency_sec,
+            'peak_allocation_kb': peak_allocation_bytes / 1024,
+        }
+        print(f"{case_name:>40}: {results[case_name]['latency_usec']:9.3f} usec per prompt, "
+              f"{results[case_name]['calls_per_sec']:12,.0f} per sec, peak allocation {results[case_name]['peak_allocation_kb']:10.1f} KB")
+    return results
+
+def find_regressions(results, baseline_results, latency_threshold=0.25, allocation_threshold=0.5, min_latency_increase_usec=0.2,
+                     latency_case_names=None):
+    # list of (case name, metric, baseline value, new value) for every metric that got worse than its threshold. a latency
+    # must also grow by more than min_latency_increase_usec per prompt, and only the latencies of latency_case_names (all
+    # cases when None) are compared, the timer and scheduler jitter dominates those of the sub-microsecond attribute functions
+    regressions = []
+    for case_name, case_results in results.items():
+        if case_name not in baseline_results:
+            continue
+        baseline_case_results = baseline_results[case_name]
+        # latency is compared relative to the reference workload, to tolerate a machine that is faster or slower than usual
+        baseline_value, value = baseline_case_results['relative_latency'], case_results['relative_latency']
+        latency_increase_usec = case_results['latency_usec'] * (1 - baseline_value / value)
+        latency_gated = latency_case_names is None or case_name in latency_case_names
+        if latency_gated and value > baseline_value * (1 + latency_threshold) and latency_increase_usec > min_latency_increase_usec:
+            regressions.append((case_name, 'relative_latency', baseline_value, value))
+        baseline_value, value = baseline_case_results['peak_allocation_kb'], case_results['peak_allocation_kb']
+        if value > baseline_value * (1 + allocation_threshold) and value - baseline_value > 1e-2:
+            regressions.append((case_name, 'peak_allocation_kb', baseline_value, value))
+    return regressions
+
+def confirm_regressions(regressions, benchmark_cases, results, baseline_results, latency_threshold=0.25, min_latency_increase_usec=0.2,
+                        num_confirm_runs=2, num_repeats=9, min_time_sec=0.1):
+    # measures the latency of every flagged case num_confirm_runs more times and keeps its fastest measurement, a case is
+    # only a regression when it is too slow every time (e.g. not when another process ran during one of the measurements)
+    confirmed_regressions = []
+    for case_name, metric, baseline_value, value in regressions:
+        if metric == 'relative_latency':
+            function, prompts_per_call = benchmark_cases[case_name]
+            for _ in range(num_confirm_runs):
+                latency_sec, relative_latency = measure_relative_latency(function, prompts_per_call, num_repeats, min_time_sec)
+                if relative_latency < results[case_name]['relative_latency']:
+                    results[case_name].update({'latency_usec': 1e6 * latency_sec, 'relative_latency': relative_latency, 'calls_per_sec': 1 / latency_sec})
+            if not find_regressions({case_name: results[case_name]}, baseline_results, latency_threshold, float('inf'), min_latency_increase_usec):
+                print(f"{case_name}: not slower than its baseline when measured again")
+                continue
+            value = results[case_name]['relative_latency']
+        confirmed_regressions.append((case_name, metric, baseline_value, value))
+    return confirmed_regressions
+
+def save_baseline(results, baseline_path):
+    baseline = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python_version': platform.python_version(),
+        'numpy_version': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'results': results,
+    }
+    with open(baseline_path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+    print(f"\nBaseline saved to '{baseline_path}'")
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    # baselines are machine specific, create one on the machine that runs the benchmark with update_baseline = True
+    baseline_path = r"benchmark_face_prompt_utils_baseline.json"
+    update_baseline = False
+    latency_regression_threshold = 0.25     # fail when a case is more than 25% slower than its baseline
+    allocation_regression_threshold = 0.5   # fail when a case allocates more than 50% more memory than its baseline
+    min_latency_increase_usec = 0.2         # and is slower by more than this per prompt (timer and scheduler jitter)
+    gate_attribute_latency = False          # the sub-microsecond get_* functions are reported, only their allocations are gated
+    num_confirm_runs = 2                    # flagged cases are measured again this many times before failing
+    num_repeats = 9
+    min_time_sec = 0.1
+    batch_size = 10000
+
+    benchmark_cases = get_benchmark_cases(batch_size)
+    results = run_benchmarks(benchmark_cases, num_repeats=num_repeats, min_time_sec=min_time_sec)
+
+    if update_baseline or not os.path.exists(baseline_path):
+        save_baseline(results, baseline_path)
+        sys.exit(0)
+
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    latency_case_names = None if gate_attribute_latency else [name for name in benchmark_cases if name not in ATTRIBUTE_FUNCTION_NAMES]
+    regressions = find_regressions(results, baseline['results'], latency_regression_threshold, allocation_regression_threshold,
+                                   min_latency_increase_usec, latency_case_names)
+    if regressions:
+        print(f"\nMeasuring {len(regressions)} flagged cases again...")
+        regressions = confirm_regressions(regressions, benchmark_cases, results, baseline['results'], latency_regression_threshold,
+                                          min_latency_increase_usec, num_confirm_runs, num_repeats, min_time_sec)
+    if regressions:
+        print(f"\n{len(regressions)} regressions compared to the baseline from {baseline['created']}:")
+        for case_name, metric, baseline_value, value in regressions:
+            print(f"- {case_name}: {metric} {baseline_value:.3f} -> {value:.3f} ({100 * (value / baseline_value - 1):+.0f}%)")
+        sys.exit(1)
+
+    print(f"\nNo regressions compared to the baseline from {baseline['created']}")
+
+#%%
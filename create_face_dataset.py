@@ -5,22 +5,34 @@ import re
 import io
 import time
 import json
+import uuid
 import base64
 import random
+import itertools
 import requests
+import httpx
 import numpy as np
 import pandas as pd
 from PIL import Image
 from tqdm import tqdm
 from dotenv import load_dotenv
 import asyncio
-from tqdm.asyncio import tqdm as async_tqdm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import fal_client
-from openai import OpenAI
-from stability_sdk import client as sd_client
+import grpc
+from openai import OpenAI, AsyncOpenAI
+from google.protobuf.struct_pb2 import Struct
 import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
+import stability_sdk.interfaces.gooseai.generation.generation_pb2_grpc as generation_grpc
 
-from face_prompt_utils import generate_face_prompt
+from face_prompt_utils import generate_face_prompt, FacePromptSampler, CoverageQuotaSampler
+from create_prompt_corpus import PromptCorpus
+from provider_rate_control import (ProviderRateController, CircuitBreaker, DeadLetterFile, read_dead_letters, call_with_rate_control,
+                                   call_with_retries)
+from generation_telemetry import GenerationTelemetry, format_stage_timings
+from image_shards import ShardWriter, ShardReader
+from image_number_allocator import ImageNumberAllocator
 
 #%% API Key Configurations
 
@@ -32,6 +44,9 @@ def save_env_file():
     """Create a .env file with API keys if it doesn't exist."""
 
     env_file = '.env'
+    # nothing to create when the keys are already in the environment (e.g. set by a script that imports this module)
+    if all(os.getenv(key) for key in ['STABILITY_API_KEY', 'OPENAI_API_KEY', 'FAL_KEY']):
+        return
     if not os.path.exists(env_file):
         print("Creating .env file...")
         with open(env_file, 'w') as f:
@@ -68,6 +83,59 @@ for key_name in key_name_list:
 #%% API clients
 
 openai_client = OpenAI(api_key = os.getenv('OPENAI_API_KEY'))
+async_openai_client = AsyncOpenAI(api_key = os.getenv('OPENAI_API_KEY'))
+
+#%% HTTP sessions
+
+# result images are downloaded over shared keep-alive connection pools instead of a new connection per image
+# (see configure_http_sessions, the pool size should be at least max_concurrent_calls)
+http_max_connections = 20
+http_timeout_sec = 60
+http_session = None
+async_http_client = None
+
+def configure_http_sessions(max_connections=20, timeout_sec=60):
+    global http_max_connections, http_timeout_sec, http_session, async_http_client
+
+    http_max_connections = max_connections
+    http_timeout_sec = timeout_sec
+
+    http_session = requests.Session()
+    http_adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+    http_session.mount('http://', http_adapter)
+    http_session.mount('https://', http_adapter)
+
+    # the async client is created on first use, inside the event loop that uses it
+    async_http_client = None
+
+def get_async_http_client():
+    # httpx connections belong to the event loop that opened them, so a new loop gets a new client
+    global async_http_client
+
+    loop = asyncio.get_running_loop()
+    if async_http_client is None or async_http_client[0] is not loop:
+        limits = httpx.Limits(max_connections=http_max_connections, max_keepalive_connections=http_max_connections)
+        async_http_client = (loop, httpx.AsyncClient(limits=limits, timeout=http_timeout_sec))
+    return async_http_client[1]
+
+async def close_async_http_client():
+    global async_http_client
+
+    if async_http_client is not None and async_http_client[0] is asyncio.get_running_loop():
+        await async_http_client[1].aclose()
+    async_http_client = None
+
+def download_image(image_url):
+    response = http_session.get(image_url, timeout=http_timeout_sec)
+    response.raise_for_status()
+    return Image.open(io.BytesIO(response.content))
+
+async def download_image_async(image_url):
+    response = await get_async_http_client().get(image_url)
+    response.raise_for_status()
+    return Image.open(io.BytesIO(response.content))
+
+configure_http_sessions()
 
 #%% Constants
 
@@ -81,38 +149,219 @@ SDXL_STYLES = ["analog-film", "cinematic", "photographic", "enhance"]
 DALLE3_IMAGE_SIZES = ["1024x1024", "1024x1792", "1792x1024"]
 DALLE3_STYLES = ["vivid", "natural"]
 DALLE3_QUALITIES = ["standard", "hd"]
+STABILITY_GRPC_HOST = "grpc.stability.ai:443"
+STABILITY_MAX_MESSAGE_SIZE = 10 * 1024 * 1024  # same as stability_sdk, to fit 1024x1024 images
+
 FLUX_IMAGE_SIZES = ["square_hd", "square", "portrait_4_3", "portrait_16_9", "landscape_4_3", "landscape_16_9"]
 
+PROMPT_ATTRIBUTE_VOCABULARIES_FILENAME = "prompt_attribute_vocabularies.json"
+
 FLUX_API_MODEL_NAME_DICT = {
     'FLUX1_pro': 'fal-ai/flux-pro',
     'FLUX1_dev': 'fal-ai/flux/dev',
     'FLUX1_schnell': 'fal-ai/flux/schnell'
 }
 
-#%% Helper functions
+MODEL_PROVIDERS = {
+    'FLUX1_pro': 'fal',
+    'FLUX1_dev': 'fal',
+    'FLUX1_schnell': 'fal',
+    'SDXL': 'stability',
+    'DALLE3': 'openai'
+}
 
-def generate_image_SDXL(prompt, engine_id, cfg_scale, steps, seed, style_preset):
-    stability_api = sd_client.StabilityInference(key=os.getenv('STABILITY_API_KEY'), engine=engine_id)
+# approximate price of one image with the default configs of __main__, for the running cost estimate of the telemetry
+MODEL_COST_PER_IMAGE_USD = {
+    'FLUX1_pro': 0.05,
+    'FLUX1_dev': 0.025,
+    'FLUX1_schnell': 0.003,
+    'SDXL': 0.0036,
+    'DALLE3': 0.04
+}
 
-    params = {
-        "prompt": prompt,
-        "cfg_scale": cfg_scale,
-        "steps": steps,
-        "seed": seed,
-        "style_preset": style_preset
-    }
+#%% Stability gRPC channels
+
+# the SDXL calls share a small pool of long lived gRPC channels instead of paying a channel setup and TLS handshake per image
+# (see configure_SDXL_channels). a channel is replaced when its connection breaks
+stability_grpc_host = STABILITY_GRPC_HOST
+stability_channel_pool_size = 2
+stability_call_timeout_sec = 300
+stability_channels = []
+stability_async_channels = None
+stability_next_channel_index = 0
+# calls in progress per pooled channel, and the broken channels dropped from their pool that still have calls in progress
+stability_channel_num_calls = {}
+stability_dropped_channels = []
+stability_dropped_async_channels = []
+
+def configure_SDXL_channels(host=STABILITY_GRPC_HOST, pool_size=2, call_timeout_sec=300):
+    global stability_grpc_host, stability_channel_pool_size, stability_call_timeout_sec, stability_async_channels
+
+    close_SDXL_channels()
+    stability_grpc_host = host
+    stability_channel_pool_size = pool_size
+    stability_call_timeout_sec = call_timeout_sec
+    stability_async_channels = None
+
+def get_SDXL_channel_options():
+    return [
+        ("grpc.max_send_message_length", STABILITY_MAX_MESSAGE_SIZE),
+        ("grpc.max_receive_message_length", STABILITY_MAX_MESSAGE_SIZE),
+        ("grpc.use_local_subchannel_pool", 1),  # a connection per channel of the pool, gRPC shares them by default
+        ("grpc.keepalive_time_ms", 60000),  # notice a dead connection between calls
+    ]
+
+def get_SDXL_channel_credentials():
+    return grpc.composite_channel_credentials(
+        grpc.ssl_channel_credentials(), grpc.access_token_call_credentials(os.getenv('STABILITY_API_KEY'))
+    )
+
+def open_SDXL_channel(host=None):
+    host = host or stability_grpc_host
+    if not host.endswith("443"):
+        return grpc.insecure_channel(host, options=get_SDXL_channel_options())
+    return grpc.secure_channel(host, get_SDXL_channel_credentials(), options=get_SDXL_channel_options())
+
+def open_SDXL_async_channel(host=None):
+    # non-blocking gRPC channel, concurrent requests are multiplexed over its single HTTP/2 connection
+    host = host or stability_grpc_host
+    if not host.endswith("443"):
+        return grpc.aio.insecure_channel(host, options=get_SDXL_channel_options())
+    return grpc.aio.secure_channel(host, get_SDXL_channel_credentials(), options=get_SDXL_channel_options())
+
+def get_SDXL_channel():
+    # round robin over the pool, channels are opened on first use
+    global stability_next_channel_index
+
+    if len(stability_channels) < stability_channel_pool_size:
+        stability_channels.append(open_SDXL_channel())
+        return stability_channels[-1]
+    stability_next_channel_index = (stability_next_channel_index + 1) % len(stability_channels)
+    return stability_channels[stability_next_channel_index]
+
+def get_SDXL_async_channel():
+    # grpc.aio channels belong to the event loop that opened them, so a new loop gets a new pool
+    global stability_async_channels, stability_next_channel_index
+
+    loop = asyncio.get_running_loop()
+    if stability_async_channels is None or stability_async_channels[0] is not loop:
+        stability_async_channels = (loop, [])
+        stability_dropped_async_channels.clear()
+    channels = stability_async_channels[1]
+    if len(channels) < stability_channel_pool_size:
+        channels.append(open_SDXL_async_channel())
+        return channels[-1]
+    stability_next_channel_index = (stability_next_channel_index + 1) % len(channels)
+    return channels[stability_next_channel_index]
+
+def start_SDXL_channel_call(channel):
+    stability_channel_num_calls[channel] = stability_channel_num_calls.get(channel, 0) + 1
+
+def end_SDXL_channel_call(channel):
+    # True when the channel was dropped from its pool and this was its last call in progress, the caller closes it
+    stability_channel_num_calls[channel] -= 1
+    if stability_channel_num_calls[channel] > 0:
+        return False
+    del stability_channel_num_calls[channel]
+    for dropped_channels in [stability_dropped_channels, stability_dropped_async_channels]:
+        if channel in dropped_channels:
+            dropped_channels.remove(channel)
+            return True
+    return False
+
+def replace_SDXL_channel(channel):
+    # drops a broken channel from its pool, the next call opens a new one in its place. it is not closed here, that
+    # would cancel the other calls still in progress on it, the last of them closes it (see end_SDXL_channel_call)
+    if channel in stability_channels:
+        stability_channels.remove(channel)
+        stability_dropped_channels.append(channel)
+    elif stability_async_channels is not None and channel in stability_async_channels[1]:
+        stability_async_channels[1].remove(channel)
+        stability_dropped_async_channels.append(channel)
+
+def close_SDXL_channels():
+    # closes the pooled and the dropped synchronous channels
+    for channel in stability_channels + stability_dropped_channels:
+        channel.close()
+    stability_channels.clear()
+    stability_dropped_channels.clear()
+
+async def close_SDXL_async_channels():
+    global stability_async_channels
+
+    if stability_async_channels is not None and stability_async_channels[0] is asyncio.get_running_loop():
+        for channel in stability_async_channels[1] + stability_dropped_async_channels:
+            await channel.close()
+    stability_async_channels = None
+    stability_dropped_async_channels.clear()
+
+def is_broken_channel_error(exception):
+    return isinstance(exception, grpc.RpcError) and exception.code() == grpc.StatusCode.UNAVAILABLE
+
+def get_SDXL_request(prompt, engine_id, cfg_scale, steps, seed, style_preset):
+    # the same request that stability_sdk's StabilityInference.generate() sends for these arguments
+    image_parameters = generation.ImageParameters(
+        height=1024,
+        width=1024,
+        seed=[seed],
+        steps=steps,
+        samples=1,
+        adapter=generation.T2IAdapterParameter(adapter_strength=0.4, adapter_init_type=generation.T2IADAPTERINIT_IMAGE),
+        parameters=[generation.StepParameter(scaled_step=0, sampler=generation.SamplerParameters(cfg_scale=cfg_scale))]
+    )
 
-    response = stability_api.generate(**params)
+    extras = None
+    if style_preset and style_preset.lower() != 'none':
+        extras = Struct()
+        extras.update({'$IPC': {'preset': style_preset}})
+
+    return generation.Request(
+        engine_id=engine_id,
+        request_id=str(uuid.uuid4()),
+        prompt=[generation.Prompt(text=prompt)],
+        image=image_parameters,
+        extras=extras
+    )
+
+#%% Helper functions
 
-    for resp in response:
-        for artifact in resp.artifacts:
-            if artifact.type == generation.ARTIFACT_IMAGE:
-                return Image.open(io.BytesIO(artifact.binary))
+def generate_image_SDXL(prompt, engine_id, cfg_scale, steps, seed, style_preset, channel=None, stage_timings=None):
+    # uses a pooled channel (see get_SDXL_channel) unless a channel is given. a pooled channel whose connection broke is
+    # replaced and the call is sent again once. the adapters add the duration of their stages to the stage_timings dict
+    # when one is given (see generation_telemetry.py)
+    if channel is None:
+        for attempt in range(2):
+            channel = get_SDXL_channel()
+            start_SDXL_channel_call(channel)
+            try:
+                return generate_image_SDXL(prompt, engine_id, cfg_scale, steps, seed, style_preset, channel=channel, stage_timings=stage_timings)
+            except grpc.RpcError as e:
+                if attempt > 0 or not is_broken_channel_error(e):
+                    raise
+                replace_SDXL_channel(channel)
+            finally:
+                if end_SDXL_channel_call(channel):
+                    channel.close()
+
+    start_time = time.monotonic()
+    stub = generation_grpc.GenerationServiceStub(channel)
+    call = stub.Generate(get_SDXL_request(prompt, engine_id, cfg_scale, steps, seed, style_preset),
+                         wait_for_ready=True, timeout=stability_call_timeout_sec)
+    try:
+        for resp in call:
+            for artifact in resp.artifacts:
+                if artifact.type == generation.ARTIFACT_IMAGE:
+                    if stage_timings is not None:
+                        stage_timings['api'] = time.monotonic() - start_time
+                    return Image.open(io.BytesIO(artifact.binary))
+    finally:
+        call.cancel()
 
     return None
 
-def generate_image_DALLE3(prompt, size='1024x1024', quality='standard', style='vivid', response_format='url'):
+def generate_image_DALLE3(prompt, size='1024x1024', quality='standard', style='vivid', response_format='url', stage_timings=None):
     
+    start_time = time.monotonic()
     response = openai_client.images.generate(
         model="dall-e-3",
         prompt=prompt,
@@ -121,20 +370,22 @@ def generate_image_DALLE3(prompt, size='1024x1024', quality='standard', style='v
         style=style,
         response_format=response_format
     )
+    api_end_time = time.monotonic()
     
     if response_format == "b64_json":
         image_data = base64.b64decode(response.data[0].b64_json)
         image_PIL = Image.open(io.BytesIO(image_data))
     elif response_format == "url":
-        image_url = response.data[0].url
-        image_data = io.BytesIO(requests.get(image_url).content)
-        image_PIL = Image.open(image_data)
+        image_PIL = download_image(response.data[0].url)
+    if stage_timings is not None:
+        stage_timings['api'] = api_end_time - start_time
+        stage_timings['download'] = time.monotonic() - api_end_time
 
     revised_prompt = response.data[0].revised_prompt
 
     return image_PIL, revised_prompt
 
-def generate_image_FLUX(prompt, api_model_name, seed, num_inference_steps, image_size='square_hd', guidance_scale=3.5):
+def generate_image_FLUX(prompt, api_model_name, seed, num_inference_steps, image_size='square_hd', guidance_scale=3.5, stage_timings=None):
     
     if api_model_name == 'fal-ai/flux-pro':
         arguments = {
@@ -166,20 +417,24 @@ def generate_image_FLUX(prompt, api_model_name, seed, num_inference_steps, image
             "sync_mode": True
         }
 
+    start_time = time.monotonic()
     handler = fal_client.submit(api_model_name, arguments=arguments)
     result = handler.get()
+    api_end_time = time.monotonic()
 
     image_url = result['images'][0]['url']
     if image_url.startswith('data:image/jpeg;base64,'):
-        image_data = io.BytesIO(base64.b64decode(image_url.split(',')[1]))
+        image_PIL = Image.open(io.BytesIO(base64.b64decode(image_url.split(',')[1])))
     else:
-        image_data = io.BytesIO(requests.get(image_url).content)
-
-    image_PIL = Image.open(image_data)
+        image_PIL = download_image(image_url)
+    if stage_timings is not None:
+        stage_timings['api'] = api_end_time - start_time
+        stage_timings['download'] = time.monotonic() - api_end_time
 
     return image_PIL
 
-async def generate_image_FLUX_async(prompt, api_model_name, seed, num_inference_steps=50, image_size='square_hd', guidance_scale=3.5):
+async def generate_image_FLUX_async(prompt, api_model_name, seed, num_inference_steps=50, image_size='square_hd', guidance_scale=3.5,
+                                    stage_timings=None):
     if api_model_name == 'fal-ai/flux-pro':
         arguments = {
             "prompt": prompt,
@@ -210,39 +465,191 @@ async def generate_image_FLUX_async(prompt, api_model_name, seed, num_inference_
             "sync_mode": False
         }
 
+    start_time = time.monotonic()
     handler = await fal_client.submit_async(api_model_name, arguments=arguments)
     result = await handler.get()
+    api_end_time = time.monotonic()
 
     image_url = result['images'][0]['url']
     if image_url.startswith('data:image/jpeg;base64,'):
-        image_data = io.BytesIO(base64.b64decode(image_url.split(',')[1]))
+        image_PIL = Image.open(io.BytesIO(base64.b64decode(image_url.split(',')[1])))
     else:
-        image_data = io.BytesIO(requests.get(image_url).content)
-
-    image_PIL = Image.open(image_data)
+        image_PIL = await download_image_async(image_url)
+    if stage_timings is not None:
+        stage_timings['api'] = api_end_time - start_time
+        stage_timings['download'] = time.monotonic() - api_end_time
 
     return image_PIL
 
-def generate_image_with_retry(generate_func, max_retries=2, **kwargs):
-    for attempt in range(max_retries):
-        try:
-            return generate_func(**kwargs)
-        except Exception as e:
-            print(f"Error occurred: {e}")
-            if attempt < max_retries - 1:
-                wait_time = random.uniform(0.5, 2)
-                print(f"Retrying in {wait_time:.2f} seconds...")
-                time.sleep(wait_time)
-            else:
-                print("Max retries reached. Skipping this generation.")
-                return None
+async def generate_image_SDXL_async(prompt, engine_id, cfg_scale, steps, seed, style_preset, channel=None, stage_timings=None):
+    # same as generate_image_SDXL, with the pooled channels of the running event loop (see get_SDXL_async_channel)
+    if channel is None:
+        for attempt in range(2):
+            channel = get_SDXL_async_channel()
+            start_SDXL_channel_call(channel)
+            try:
+                return await generate_image_SDXL_async(prompt, engine_id, cfg_scale, steps, seed, style_preset, channel=channel,
+                                                       stage_timings=stage_timings)
+            except grpc.RpcError as e:
+                if attempt > 0 or not is_broken_channel_error(e):
+                    raise
+                replace_SDXL_channel(channel)
+            finally:
+                if end_SDXL_channel_call(channel):
+                    await channel.close()
+
+    start_time = time.monotonic()
+    stub = generation_grpc.GenerationServiceStub(channel)
+    call = stub.Generate(get_SDXL_request(prompt, engine_id, cfg_scale, steps, seed, style_preset),
+                         wait_for_ready=True, timeout=stability_call_timeout_sec)
+    try:
+        async for resp in call:
+            for artifact in resp.artifacts:
+                if artifact.type == generation.ARTIFACT_IMAGE:
+                    if stage_timings is not None:
+                        stage_timings['api'] = time.monotonic() - start_time
+                    return Image.open(io.BytesIO(artifact.binary))
+    finally:
+        call.cancel()
+
+    return None
+
+async def generate_image_DALLE3_async(prompt, size='1024x1024', quality='standard', style='vivid', response_format='url', stage_timings=None):
+
+    start_time = time.monotonic()
+    response = await async_openai_client.images.generate(
+        model="dall-e-3",
+        prompt=prompt,
+        size=size,
+        quality=quality,
+        style=style,
+        response_format=response_format
+    )
+    api_end_time = time.monotonic()
+
+    if response_format == "b64_json":
+        image_data = base64.b64decode(response.data[0].b64_json)
+        image_PIL = Image.open(io.BytesIO(image_data))
+    elif response_format == "url":
+        image_PIL = await download_image_async(response.data[0].url)
+    if stage_timings is not None:
+        stage_timings['api'] = api_end_time - start_time
+        stage_timings['download'] = time.monotonic() - api_end_time
+
+    revised_prompt = response.data[0].revised_prompt
+
+    return image_PIL, revised_prompt
+
+# JPEG results of the providers (e.g. FLUX on fal) are saved with their original bytes instead of being decoded and
+# re-encoded at jpeg_quality, which saves most of the CPU time per image and a second generation of compression loss
+jpeg_pass_through = True
+
+def get_jpeg_payload(image):
+    # the JPEG bytes an image returned by the adapters was lazily opened from, when they can be saved as they are
+    # (a complete RGB or grayscale JPEG, checked from the header Pillow already parsed and the end of image marker)
+    if image.format != 'JPEG' or image.mode not in ['RGB', 'L'] or not isinstance(getattr(image, 'fp', None), io.BytesIO):
+        return None
+    jpeg_payload = image.fp.getvalue()
+    if not jpeg_payload.startswith(b'\xff\xd8') or not jpeg_payload.rstrip(b'\x00\r\n').endswith(b'\xff\xd9'):
+        return None
+    return jpeg_payload
+
+# optional sharded output (a ShardWriter, see image_shards.py): the images are appended with their metadata rows to tar
+# shards instead of being saved as files in the image folder. the writer then has to receive the metadata rows too,
+# e.g. with result_sink=chain_result_sinks(image_shard_writer, journal)
+image_shard_writer = None
+
+def image_exists(image_folder, image_filename):
+    if image_shard_writer is not None and image_filename in image_shard_writer:
+        return True
+    return os.path.exists(os.path.join(image_folder, image_filename))
+
+def save_image_as_jpeg(image, image_path, jpeg_quality=90, stage_timings=None):
+    # images returned by the adapters are decoded lazily, so other images are decoded, encoded and written here (timed separately)
+    start_time = time.monotonic()
+    jpeg_payload = get_jpeg_payload(image) if jpeg_pass_through else None
+    if jpeg_payload is None:
+        image.load()
+        decode_end_time = time.monotonic()
+        jpeg_buffer = io.BytesIO()
+        image.save(jpeg_buffer, "JPEG", quality=jpeg_quality)
+        jpeg_payload = jpeg_buffer.getbuffer()
+        if stage_timings is not None:
+            stage_timings['decode'] = decode_end_time - start_time
+            stage_timings['encode'] = time.monotonic() - decode_end_time
+
+    write_start_time = time.monotonic()
+    if image_shard_writer is not None:
+        image_shard_writer.add_image(os.path.basename(image_path), jpeg_payload)
+    else:
+        with open(image_path, 'wb') as f:
+            f.write(jpeg_payload)
+    if stage_timings is not None:
+        stage_timings['write'] = time.monotonic() - write_start_time
+
+async def save_image_as_jpeg_async(image, image_path, jpeg_quality=90, executor=None, stage_timings=None):
+    # Pillow releases the GIL while it decodes and encodes, so a thread pool keeps the event loop free for network I/O
+    await asyncio.get_running_loop().run_in_executor(executor, save_image_as_jpeg, image, image_path, jpeg_quality, stage_timings)
+
+async def add_image_shard_metadata_async(metadata_row, executor=None):
+    # the shard writer writes a sample to its tar shard once it has both its image and its metadata row. the rows reach the
+    # result sink on the event loop, so the async paths pass them to the writer in the image executor first, the result
+    # sink then finds the sample already written
+    if image_shard_writer is not None:
+        await asyncio.get_running_loop().run_in_executor(executor, image_shard_writer.add_metadata, metadata_row)
+
+# attempts per sample on transient errors, one circuit breaker per provider (see CircuitBreaker in provider_rate_control.py)
+# shared by its models and by the sync and async paths, and the DeadLetterFile that gets the samples which failed after all
+# their attempts (None to drop them)
+generation_max_retries = 5
+circuit_breaker_failure_threshold = 5
+circuit_breaker_reset_timeout_sec = 30.0
+circuit_breakers = {}
+dead_letter_file = None
+
+def get_circuit_breaker(model_used):
+    provider = MODEL_PROVIDERS.get(model_used, model_used)
+    if provider not in circuit_breakers:
+        circuit_breakers[provider] = CircuitBreaker(provider, failure_threshold=circuit_breaker_failure_threshold,
+                                                    reset_timeout_sec=circuit_breaker_reset_timeout_sec)
+    return circuit_breakers[provider]
+
+def get_dead_letter_record(model_used, prompt_attributes, generate_kwargs):
+    # everything needed to generate the sample again: the model, the prompt with its attributes and the generation settings
+    generation_settings = {key: value for key, value in generate_kwargs.items() if key not in ['prompt', 'stage_timings', 'channel']}
+    return {
+        "model_used": model_used,
+        "text_prompt": generate_kwargs.get('prompt'),
+        "prompt_attributes": prompt_attributes,
+        "generation_settings": generation_settings,
+    }
+
+def generate_image_with_retry(generate_func, max_retries=None, model_used=None, prompt_attributes=None, **kwargs):
+    # transient errors are retried with exponential backoff and throttling responses after the pause they ask for, invalid
+    # requests (e.g. a prompt rejected by the content policy) are not retried (see classify_error in provider_rate_control.py)
+    return call_with_retries(generate_func, max_retries=max_retries or generation_max_retries,
+                             circuit_breaker=get_circuit_breaker(model_used) if model_used is not None else None,
+                             dead_letter=dead_letter_file, dead_letter_record=get_dead_letter_record(model_used, prompt_attributes, kwargs),
+                             **kwargs)
+
+async def generate_image_with_retry_async(generate_func, max_retries=None, rate_controller=None, model_used=None, prompt_attributes=None, **kwargs):
+    # same retries as generate_image_with_retry, without blocking the event loop. with a rate_controller (see
+    # provider_rate_control.py) the calls are paced by it, and throttling responses wait for it instead of counting as errors
+    return await call_with_rate_control(rate_controller, generate_func, max_retries=max_retries or generation_max_retries,
+                                        circuit_breaker=get_circuit_breaker(model_used) if model_used is not None else None,
+                                        dead_letter=dead_letter_file,
+                                        dead_letter_record=get_dead_letter_record(model_used, prompt_attributes, kwargs), **kwargs)
 
 def get_existing_image_count(image_folder, model_prefix):
     # Regular expression to match the number at the end of the filename
     pattern = re.compile(rf"{re.escape(model_prefix)}_image_(\d+)\.jpg")
     
+    filenames = os.listdir(image_folder)
+    if image_shard_writer is not None:
+        filenames += image_shard_writer.image_filenames
+
     max_number = 0
-    for filename in os.listdir(image_folder):
+    for filename in filenames:
         match = pattern.match(filename)
         if match:
             number = int(match.group(1))
@@ -250,21 +657,41 @@ def get_existing_image_count(image_folder, model_prefix):
     
     return max_number
 
-def create_dataset_SDXL(num_samples, image_folder, engine_id, steps, jpeg_quality=90):
+# optional persistent image number allocator (an ImageNumberAllocator, see image_number_allocator.py) shared by all the
+# generator processes of a dataset, without it the numbers continue after the highest one found in the image folder
+image_number_allocator = None
+
+def get_image_number_allocator(image_folder, model_prefix):
+    # returns a function that hands out the next free image number of model_prefix, called once per saved image
+    if image_number_allocator is not None:
+        return lambda: image_number_allocator.allocate(model_prefix)
+    next_numbers = itertools.count(get_existing_image_count(image_folder, model_prefix) + 1)
+    return lambda: next(next_numbers)
+
+def create_dataset_SDXL(num_samples, image_folder, engine_id, steps, jpeg_quality=90, result_sink=None, telemetry=None):
+    # same outputs as create_dataset_FLUX_parallel
     metadata = []
+    add_metadata_row = result_sink or metadata.append
+    num_images = 0
     total_time = 0
-    start_index = get_existing_image_count(image_folder, "SDXL")
+    get_next_image_number = get_image_number_allocator(image_folder, "SDXL")
+    if telemetry is not None:
+        telemetry.start_run("SDXL")
     
     with tqdm(total=num_samples, desc="Generating SDXL images") as pbar:
         for i in range(num_samples):
-            prompt = get_random_prompt()
+            prompt, prompt_attributes = get_random_prompt_with_attributes("SDXL")
             style_preset = random.choice(SDXL_STYLES)
             seed = random.randint(0, 2**32 - 1)
             cfg_scale = random.randint(5, 8)
             
+            stage_timings = {}
             start_time = time.time()
             image = generate_image_with_retry(
                 generate_image_SDXL,
+                model_used="SDXL",
+                prompt_attributes=prompt_attributes,
+                stage_timings=stage_timings,
                 prompt=prompt,
                 engine_id=engine_id,
                 cfg_scale=cfg_scale,
@@ -273,12 +700,13 @@ def create_dataset_SDXL(num_samples, image_folder, engine_id, steps, jpeg_qualit
                 style_preset=style_preset
             )
             end_time = time.time()
+            stage_timings['generate'] = end_time - start_time
             
             if image:
-                image_filename = f"SDXL_image_{start_index + i + 1:07d}.jpg"
+                image_filename = f"SDXL_image_{get_next_image_number():07d}.jpg"
                 image_path = os.path.join(image_folder, image_filename)
                 
-                image.save(image_path, "JPEG", quality=jpeg_quality)
+                save_image_as_jpeg(image, image_path, jpeg_quality, stage_timings=stage_timings)
                 
                 configs = {
                     "engine_id": engine_id,
@@ -288,45 +716,66 @@ def create_dataset_SDXL(num_samples, image_folder, engine_id, steps, jpeg_qualit
                     "style_preset": style_preset
                 }
                 
-                metadata.append({
+                add_metadata_row({
                     "image_filename": image_filename,
                     "model_used": "SDXL",
                     "text_prompt": prompt,
                     "configs": json.dumps(configs),
+                    "stage_timings": format_stage_timings(stage_timings),
+                    **prompt_attributes,
                 })
                 
+                if telemetry is not None:
+                    telemetry.record_image("SDXL", stage_timings)
+                num_images += 1
                 total_time += (end_time - start_time)
                 pbar.update(1)
+            else:
+                release_random_prompt(prompt_attributes)
+                if telemetry is not None:
+                    telemetry.record_failure("SDXL")
     
-    print(f"SDXL: Generated {num_samples} images in {total_time/60:.2f} minutes (avg: {total_time/num_samples:.2f} seconds per image)")
-    return pd.DataFrame(metadata)
+    print(f"SDXL: Generated {num_images} images in {total_time/60:.2f} minutes (avg: {total_time/max(num_images, 1):.2f} seconds per image)")
+    if telemetry is not None:
+        print(telemetry.get_summary("SDXL"))
+    return pd.DataFrame(metadata) if result_sink is None else num_images
 
-def create_dataset_DALLE3(num_samples, image_folder, size, quality, jpeg_quality=90):
+def create_dataset_DALLE3(num_samples, image_folder, size, quality, jpeg_quality=90, result_sink=None, telemetry=None):
+    # same outputs as create_dataset_FLUX_parallel
     metadata = []
+    add_metadata_row = result_sink or metadata.append
+    num_images = 0
     total_time = 0
-    start_index = get_existing_image_count(image_folder, "DALLE3")
+    get_next_image_number = get_image_number_allocator(image_folder, "DALLE3")
+    if telemetry is not None:
+        telemetry.start_run("DALLE3")
     
     with tqdm(total=num_samples, desc="Generating DALL-E 3 images") as pbar:
         for i in range(num_samples):
-            prompt = get_random_prompt()
+            prompt, prompt_attributes = get_random_prompt_with_attributes("DALLE3")
             style = random.choice(DALLE3_STYLES)
             
+            stage_timings = {}
             start_time = time.time()
             result = generate_image_with_retry(
                 generate_image_DALLE3,
+                model_used="DALLE3",
+                prompt_attributes=prompt_attributes,
+                stage_timings=stage_timings,
                 prompt=prompt,
                 size=size,
                 quality=quality,
                 style=style
             )
             end_time = time.time()
+            stage_timings['generate'] = end_time - start_time
             
             if result:
                 image, revised_prompt = result
-                image_filename = f"DALLE3_image_{start_index + i + 1:07d}.jpg"
+                image_filename = f"DALLE3_image_{get_next_image_number():07d}.jpg"
                 image_path = os.path.join(image_folder, image_filename)
                 
-                image.save(image_path, "JPEG", quality=jpeg_quality)
+                save_image_as_jpeg(image, image_path, jpeg_quality, stage_timings=stage_timings)
                 
                 configs = {
                     "size": size,
@@ -335,35 +784,55 @@ def create_dataset_DALLE3(num_samples, image_folder, size, quality, jpeg_quality
                     "orig_prompt": prompt
                 }
                 
-                metadata.append({
+                add_metadata_row({
                     "image_filename": image_filename,
                     "model_used": "DALLE3",
                     "text_prompt": revised_prompt,
                     "configs": json.dumps(configs),
+                    "stage_timings": format_stage_timings(stage_timings),
+                    **prompt_attributes,
                 })
                 
+                if telemetry is not None:
+                    telemetry.record_image("DALLE3", stage_timings)
+                num_images += 1
                 total_time += (end_time - start_time)
                 pbar.update(1)
+            else:
+                release_random_prompt(prompt_attributes)
+                if telemetry is not None:
+                    telemetry.record_failure("DALLE3")
     
-    print(f"DALL-E 3: Generated {len(metadata)} images in {total_time/60:.2f} minutes (avg: {total_time/len(metadata):.2f} seconds per image)")
-    return pd.DataFrame(metadata)
+    print(f"DALL-E 3: Generated {num_images} images in {total_time/60:.2f} minutes (avg: {total_time/max(num_images, 1):.2f} seconds per image)")
+    if telemetry is not None:
+        print(telemetry.get_summary("DALLE3"))
+    return pd.DataFrame(metadata) if result_sink is None else num_images
 
-def create_dataset_FLUX(num_samples, flux_model, image_folder, num_inference_steps, image_size, jpeg_quality=90):
+def create_dataset_FLUX(num_samples, flux_model, image_folder, num_inference_steps, image_size, jpeg_quality=90, result_sink=None, telemetry=None):
+    # same outputs as create_dataset_FLUX_parallel
     metadata = []
+    add_metadata_row = result_sink or metadata.append
+    num_images = 0
     total_time = 0
-    start_index = get_existing_image_count(image_folder, flux_model)
+    get_next_image_number = get_image_number_allocator(image_folder, flux_model)
+    if telemetry is not None:
+        telemetry.start_run(flux_model)
     
     flux_api_model_name = FLUX_API_MODEL_NAME_DICT[flux_model]
 
     with tqdm(total=num_samples, desc=f"Generating {flux_model} images") as pbar:
         for i in range(num_samples):
-            prompt = get_random_prompt()
+            prompt, prompt_attributes = get_random_prompt_with_attributes(flux_model)
             seed = random.randint(0, 2**32 - 1)
             guidance_scale = random.uniform(2.5, 4.0) if random.random() < 0.5 else 3.5
             
+            stage_timings = {}
             start_time = time.time()
             image = generate_image_with_retry(
                 generate_image_FLUX,
+                model_used=flux_model,
+                prompt_attributes=prompt_attributes,
+                stage_timings=stage_timings,
                 prompt=prompt,
                 api_model_name=flux_api_model_name,
                 seed=seed,
@@ -372,12 +841,13 @@ def create_dataset_FLUX(num_samples, flux_model, image_folder, num_inference_ste
                 guidance_scale=guidance_scale
             )
             end_time = time.time()
+            stage_timings['generate'] = end_time - start_time
             
             if image:
-                image_filename = f"{flux_model}_image_{start_index + i + 1:07d}.jpg"
+                image_filename = f"{flux_model}_image_{get_next_image_number():07d}.jpg"
                 image_path = os.path.join(image_folder, image_filename)
                 
-                image.save(image_path, "JPEG", quality=jpeg_quality)
+                save_image_as_jpeg(image, image_path, jpeg_quality, stage_timings=stage_timings)
                 
                 if flux_model == 'FLUX1_pro':
                     configs = {
@@ -403,81 +873,310 @@ def create_dataset_FLUX(num_samples, flux_model, image_folder, num_inference_ste
                         "enable_safety_checker": False,
                     }
 
-                metadata.append({
+                add_metadata_row({
                     "image_filename": image_filename,
                     "model_used": flux_model,
                     "text_prompt": prompt,
                     "configs": json.dumps(configs),
+                    "stage_timings": format_stage_timings(stage_timings),
+                    **prompt_attributes,
                 })
                 
+                if telemetry is not None:
+                    telemetry.record_image(flux_model, stage_timings)
+                num_images += 1
                 total_time += (end_time - start_time)
                 pbar.update(1)
+            else:
+                release_random_prompt(prompt_attributes)
+                if telemetry is not None:
+                    telemetry.record_failure(flux_model)
     
-    print(f"{flux_model}: Generated {len(metadata)} images in {total_time/60:.2f} minutes (avg: {total_time/len(metadata):.2f} seconds per image)")
-    return pd.DataFrame(metadata)
-
-async def create_dataset_FLUX_parallel(num_samples, flux_model, image_folder, num_inference_steps, image_size, jpeg_quality=90, max_concurrent_calls=5):
+    print(f"{flux_model}: Generated {num_images} images in {total_time/60:.2f} minutes (avg: {total_time/max(num_images, 1):.2f} seconds per image)")
+    if telemetry is not None:
+        print(telemetry.get_summary(flux_model))
+    return pd.DataFrame(metadata) if result_sink is None else num_images
+
+async def run_generation_queue(process_sample, result_sink, num_samples=None, num_workers=5, queue_size=None, stop_condition=None, desc=None):
+    # feeds sample indices through a bounded queue to num_workers worker coroutines that await process_sample(sample_index, queue_wait_sec),
+    # and passes every result that is not None to result_sink as soon as it completes, so memory does not grow with num_samples.
+    # with num_samples=None the run is open ended and stops once stop_condition() returns True (e.g. a target number of
+    # images or a budget is reached), samples already in progress at that point still complete. returns the number of results
+    if num_samples is None and stop_condition is None:
+        raise ValueError("an open ended run (num_samples=None) needs a stop_condition")
+
+    queue = asyncio.Queue(maxsize=queue_size or 2 * num_workers)
+    num_results = 0
+
+    def should_stop():
+        return stop_condition is not None and stop_condition()
+
+    async def produce_samples():
+        sample_index = 0
+        while (num_samples is None or sample_index < num_samples) and not should_stop():
+            await queue.put((sample_index, time.monotonic()))
+            sample_index += 1
+        for _ in range(num_workers):
+            await queue.put(None)
+
+    async def process_samples():
+        nonlocal num_results
+        while True:
+            queue_item = await queue.get()
+            if queue_item is None:
+                return
+            if should_stop():
+                continue
+
+            sample_index, enqueue_time = queue_item
+            result = await process_sample(sample_index, time.monotonic() - enqueue_time)
+            pbar.update(1)
+            if result is not None:
+                result_sink(result)
+                num_results += 1
+
+    with tqdm(total=num_samples, desc=desc) as pbar:
+        tasks = [asyncio.ensure_future(produce_samples())] + [asyncio.ensure_future(process_samples()) for _ in range(num_workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    return num_results
+
+async def create_dataset_FLUX_parallel(num_samples, flux_model, image_folder, num_inference_steps, image_size, jpeg_quality=90, max_concurrent_calls=5,
+                                       num_image_workers=None, result_sink=None, stop_condition=None, rate_controller=None, telemetry=None):
+    # with a result_sink (e.g. MetadataJournal) each metadata row is passed to it as soon as its image is saved and the number
+    # of images is returned, otherwise the rows are returned as a DataFrame (see run_generation_queue for stop_condition).
+    # with a rate_controller (a ProviderRateController) the number of calls in progress adapts between its min_concurrency
+    # and max_concurrent_calls to the rate limits of the provider. the stage timings of each image are saved in its metadata
+    # row, and recorded in the telemetry (a GenerationTelemetry) when one is given
     dataset_start_time = time.time()
 
     metadata = []
-    start_index = get_existing_image_count(image_folder, flux_model)    
+    get_next_image_number = get_image_number_allocator(image_folder, flux_model)
+    if telemetry is not None:
+        telemetry.start_run(flux_model)
     flux_api_model_name = FLUX_API_MODEL_NAME_DICT[flux_model]
-    semaphore = asyncio.Semaphore(max_concurrent_calls)
 
-    async def process_single_image(i):
-        async with semaphore:
-            prompt = get_random_prompt()
-            seed = random.randint(0, 2**32 - 1)
-            guidance_scale = random.uniform(2.5, 4.0) if random.random() < 0.5 else 3.5
+    async def process_single_image(i, queue_wait_sec):
+        stage_timings = {'queue_wait': queue_wait_sec}
+        prompt, prompt_attributes = get_random_prompt_with_attributes(flux_model)
+        seed = random.randint(0, 2**32 - 1)
+        guidance_scale = random.uniform(2.5, 4.0) if random.random() < 0.5 else 3.5
+        
+        generate_start_time = time.monotonic()
+        image = await generate_image_with_retry_async(
+            generate_image_FLUX_async,
+            rate_controller=rate_controller,
+            model_used=flux_model,
+            prompt_attributes=prompt_attributes,
+            stage_timings=stage_timings,
+            prompt=prompt,
+            api_model_name=flux_api_model_name,
+            seed=seed,
+            num_inference_steps=num_inference_steps,
+            image_size=image_size,
+            guidance_scale=guidance_scale
+        )
+        stage_timings['generate'] = time.monotonic() - generate_start_time
+
+        if image:
+            image_filename = f"{flux_model}_image_{get_next_image_number():07d}.jpg"
+            image_path = os.path.join(image_folder, image_filename)
             
-            sample_start_time = time.time()
-            try:
-                image = await generate_image_FLUX_async(
-                    prompt=prompt,
-                    api_model_name=flux_api_model_name,
-                    seed=seed,
-                    num_inference_steps=num_inference_steps,
-                    image_size=image_size,
-                    guidance_scale=guidance_scale
-                )
-            except Exception as e:
-                print(f"Error generating image for {flux_model}: {e}")
-                return None
-            sample_end_time = time.time()
+            await save_image_as_jpeg_async(image, image_path, jpeg_quality, executor=image_executor, stage_timings=stage_timings)
             
-            if image:
-                image_filename = f"{flux_model}_image_{start_index + i + 1:07d}.jpg"
-                image_path = os.path.join(image_folder, image_filename)
-                
-                image.save(image_path, "JPEG", quality=jpeg_quality)
-                
-                configs = {
-                    "image_size": image_size,
-                    "num_inference_steps": num_inference_steps,
-                    "seed": seed,
-                    "guidance_scale": guidance_scale,
-                }
-                if flux_model == 'FLUX1_pro':
-                    configs["safety_tolerance"] = "5"
-                elif flux_model in ['FLUX1_dev', 'FLUX1_schnell']:
-                    configs["enable_safety_checker"] = False
+            configs = {
+                "image_size": image_size,
+                "num_inference_steps": num_inference_steps,
+                "seed": seed,
+                "guidance_scale": guidance_scale,
+            }
+            if flux_model == 'FLUX1_pro':
+                configs["safety_tolerance"] = "5"
+            elif flux_model in ['FLUX1_dev', 'FLUX1_schnell']:
+                configs["enable_safety_checker"] = False
+
+            if telemetry is not None:
+                telemetry.record_image(flux_model, stage_timings)
+            metadata_row = {
+                "image_filename": image_filename,
+                "model_used": flux_model,
+                "text_prompt": prompt,
+                "configs": json.dumps(configs),
+                "stage_timings": format_stage_timings(stage_timings),
+                **prompt_attributes,
+            }
+            await add_image_shard_metadata_async(metadata_row, image_executor)
+            return metadata_row
+        release_random_prompt(prompt_attributes)
+        if telemetry is not None:
+            telemetry.record_failure(flux_model)
+        return None
+
+    with ThreadPoolExecutor(max_workers=num_image_workers) as image_executor:
+        num_images = await run_generation_queue(process_single_image, result_sink or metadata.append, num_samples, max_concurrent_calls,
+                                                stop_condition=stop_condition, desc=f"Generating {flux_model} images")
+    total_time = time.time() - dataset_start_time
+    print(f"{flux_model}: Generated {num_images} images in {total_time/60:.2f} minutes (avg: {total_time/max(num_images, 1):.2f} seconds per image)")
+    if rate_controller is not None:
+        print(rate_controller.get_summary())
+    if telemetry is not None:
+        print(telemetry.get_summary(flux_model))
 
-                sample_durations_sec = sample_end_time - sample_start_time
-                return {
-                    "image_filename": image_filename,
-                    "model_used": flux_model,
-                    "text_prompt": prompt,
-                    "configs": json.dumps(configs),
-                }
-            return None
+    return pd.DataFrame(metadata) if result_sink is None else num_images
+
+async def create_dataset_SDXL_parallel(num_samples, image_folder, engine_id, steps, jpeg_quality=90, max_concurrent_calls=5, num_image_workers=None,
+                                       result_sink=None, stop_condition=None, rate_controller=None, telemetry=None):
+    # same arguments and outputs as create_dataset_FLUX_parallel
+    dataset_start_time = time.time()
 
-    tasks = [process_single_image(i) for i in range(num_samples)]    
-    results = await async_tqdm.gather(*tasks, desc=f"Generating {flux_model} images")
-    metadata = [result for result in results if result is not None]
+    metadata = []
+    get_next_image_number = get_image_number_allocator(image_folder, "SDXL")
+    if telemetry is not None:
+        telemetry.start_run("SDXL")
+
+    async def process_single_image(i, queue_wait_sec):
+        stage_timings = {'queue_wait': queue_wait_sec}
+        prompt, prompt_attributes = get_random_prompt_with_attributes("SDXL")
+        style_preset = random.choice(SDXL_STYLES)
+        seed = random.randint(0, 2**32 - 1)
+        cfg_scale = random.randint(5, 8)
+
+        generate_start_time = time.monotonic()
+        image = await generate_image_with_retry_async(
+            generate_image_SDXL_async,
+            rate_controller=rate_controller,
+            model_used="SDXL",
+            prompt_attributes=prompt_attributes,
+            stage_timings=stage_timings,
+            prompt=prompt,
+            engine_id=engine_id,
+            cfg_scale=cfg_scale,
+            steps=steps,
+            seed=seed,
+            style_preset=style_preset
+        )
+        stage_timings['generate'] = time.monotonic() - generate_start_time
+
+        if image:
+            image_filename = f"SDXL_image_{get_next_image_number():07d}.jpg"
+            image_path = os.path.join(image_folder, image_filename)
+
+            await save_image_as_jpeg_async(image, image_path, jpeg_quality, executor=image_executor, stage_timings=stage_timings)
+
+            configs = {
+                "engine_id": engine_id,
+                "cfg_scale": cfg_scale,
+                "steps": steps,
+                "seed": seed,
+                "style_preset": style_preset
+            }
+
+            if telemetry is not None:
+                telemetry.record_image("SDXL", stage_timings)
+            metadata_row = {
+                "image_filename": image_filename,
+                "model_used": "SDXL",
+                "text_prompt": prompt,
+                "configs": json.dumps(configs),
+                "stage_timings": format_stage_timings(stage_timings),
+                **prompt_attributes,
+            }
+            await add_image_shard_metadata_async(metadata_row, image_executor)
+            return metadata_row
+        release_random_prompt(prompt_attributes)
+        if telemetry is not None:
+            telemetry.record_failure("SDXL")
+        return None
+
+    with ThreadPoolExecutor(max_workers=num_image_workers) as image_executor:
+        num_images = await run_generation_queue(process_single_image, result_sink or metadata.append, num_samples, max_concurrent_calls,
+                                                stop_condition=stop_condition, desc="Generating SDXL images")
     total_time = time.time() - dataset_start_time
-    print(f"{flux_model}: Generated {len(metadata)} images in {total_time/60:.2f} minutes (avg: {total_time/len(metadata):.2f} seconds per image)")
-    
-    return pd.DataFrame(metadata)
+    print(f"SDXL: Generated {num_images} images in {total_time/60:.2f} minutes (avg: {total_time/max(num_images, 1):.2f} seconds per image)")
+    if rate_controller is not None:
+        print(rate_controller.get_summary())
+    if telemetry is not None:
+        print(telemetry.get_summary("SDXL"))
+
+    return pd.DataFrame(metadata) if result_sink is None else num_images
+
+async def create_dataset_DALLE3_parallel(num_samples, image_folder, size, quality, jpeg_quality=90, max_concurrent_calls=5, num_image_workers=None,
+                                         result_sink=None, stop_condition=None, rate_controller=None, telemetry=None):
+    # same arguments and outputs as create_dataset_FLUX_parallel
+    dataset_start_time = time.time()
+
+    metadata = []
+    get_next_image_number = get_image_number_allocator(image_folder, "DALLE3")
+    if telemetry is not None:
+        telemetry.start_run("DALLE3")
+
+    async def process_single_image(i, queue_wait_sec):
+        stage_timings = {'queue_wait': queue_wait_sec}
+        prompt, prompt_attributes = get_random_prompt_with_attributes("DALLE3")
+        style = random.choice(DALLE3_STYLES)
+
+        generate_start_time = time.monotonic()
+        result = await generate_image_with_retry_async(
+            generate_image_DALLE3_async,
+            rate_controller=rate_controller,
+            model_used="DALLE3",
+            prompt_attributes=prompt_attributes,
+            stage_timings=stage_timings,
+            prompt=prompt,
+            size=size,
+            quality=quality,
+            style=style
+        )
+        stage_timings['generate'] = time.monotonic() - generate_start_time
+
+        if result:
+            image, revised_prompt = result
+            image_filename = f"DALLE3_image_{get_next_image_number():07d}.jpg"
+            image_path = os.path.join(image_folder, image_filename)
+
+            await save_image_as_jpeg_async(image, image_path, jpeg_quality, executor=image_executor, stage_timings=stage_timings)
+
+            configs = {
+                "size": size,
+                "quality": quality,
+                "style": style,
+                "orig_prompt": prompt
+            }
+
+            if telemetry is not None:
+                telemetry.record_image("DALLE3", stage_timings)
+            metadata_row = {
+                "image_filename": image_filename,
+                "model_used": "DALLE3",
+                "text_prompt": revised_prompt,
+                "configs": json.dumps(configs),
+                "stage_timings": format_stage_timings(stage_timings),
+                **prompt_attributes,
+            }
+            await add_image_shard_metadata_async(metadata_row, image_executor)
+            return metadata_row
+        release_random_prompt(prompt_attributes)
+        if telemetry is not None:
+            telemetry.record_failure("DALLE3")
+        return None
+
+    with ThreadPoolExecutor(max_workers=num_image_workers) as image_executor:
+        num_images = await run_generation_queue(process_single_image, result_sink or metadata.append, num_samples, max_concurrent_calls,
+                                                stop_condition=stop_condition, desc="Generating DALL-E 3 images")
+    total_time = time.time() - dataset_start_time
+    print(f"DALL-E 3: Generated {num_images} images in {total_time/60:.2f} minutes (avg: {total_time/max(num_images, 1):.2f} seconds per image)")
+    if rate_controller is not None:
+        print(rate_controller.get_summary())
+    if telemetry is not None:
+        print(telemetry.get_summary("DALLE3"))
+
+    return pd.DataFrame(metadata) if result_sink is None else num_images
 
 def update_csv(new_df, csv_path):
     if os.path.exists(csv_path):
@@ -489,10 +1188,262 @@ def update_csv(new_df, csv_path):
     combined_df.to_csv(csv_path, index=False)
     return combined_df
 
+def append_csv(new_df, csv_path):
+    # appends the rows without reading the existing ones, unless new_df has columns that the file does not have yet
+    if not os.path.exists(csv_path):
+        new_df.to_csv(csv_path, index=False)
+        return
+
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    if set(new_df.columns) - set(columns):
+        update_csv(new_df, csv_path)
+    else:
+        new_df.reindex(columns=columns).to_csv(csv_path, mode='a', header=False, index=False)
+
+def chain_result_sinks(*result_sinks):
+    # a result sink that passes every metadata row to each of result_sinks in order
+    def result_sink(row):
+        for sink in result_sinks:
+            sink(row)
+    return result_sink
+
+class CSVResultSink:
+    # result sink of the parallel dataset functions, appends the metadata rows to the dataset CSV in batches while a run
+    # is in progress (rows that are not flushed yet are written when the `with` block exits, also on errors)
+    def __init__(self, csv_path, flush_every=100):
+        self.csv_path = csv_path
+        self.flush_every = flush_every
+        self.rows = []
+        self.num_rows = 0
+
+    def __call__(self, row):
+        self.rows.append(row)
+        self.num_rows += 1
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            append_csv(pd.DataFrame(self.rows), self.csv_path)
+            self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+class MetadataJournal:
+    # append only JSON lines journal of the metadata rows, usable as the result sink of any create_dataset_* function.
+    # every row is written as soon as its image is saved, so a crash loses no generated image, and the file is fsynced
+    # every fsync_every rows or fsync_interval_sec seconds. compact_journal moves the rows into the dataset CSV
+    def __init__(self, journal_path, fsync_every=20, fsync_interval_sec=5.0):
+        self.journal_path = journal_path
+        self.fsync_every = fsync_every
+        self.fsync_interval_sec = fsync_interval_sec
+        self.file = open(journal_path, 'a', encoding='utf-8')
+        self.num_rows = 0
+        self.num_unsynced_rows = 0
+        self.last_sync_time = time.time()
+
+    def __call__(self, row):
+        self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+        self.num_rows += 1
+        self.num_unsynced_rows += 1
+        if self.num_unsynced_rows >= self.fsync_every or time.time() - self.last_sync_time >= self.fsync_interval_sec:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.num_unsynced_rows = 0
+        self.last_sync_time = time.time()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def read_journal(journal_path):
+    # a last line that was cut off by a crash is skipped
+    rows = []
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line_index, line in enumerate(f):
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipping the incomplete line {line_index + 1} of the journal '{journal_path}'")
+    return rows
+
+def fsync_file(file_path):
+    with open(file_path, 'rb') as f:
+        os.fsync(f.fileno())
+
+def compact_journal(journal_path, csv_path, image_folder=None):
+    # moves the journal rows into the dataset CSV and removes the journal. rows already in the CSV (from a compaction that
+    # crashed before removing the journal) are skipped, and so are rows whose image is missing when image_folder is given
+    if not os.path.exists(journal_path):
+        return 0
+
+    journal_df = pd.DataFrame(read_journal(journal_path))
+    if len(journal_df) > 0:
+        journal_df = journal_df.drop_duplicates('image_filename', keep='last')
+        if image_folder is not None:
+            journal_df = journal_df[[image_exists(image_folder, filename) for filename in journal_df['image_filename']]]
+        if os.path.exists(csv_path):
+            existing_filenames = set(pd.read_csv(csv_path, usecols=['image_filename'])['image_filename'])
+            journal_df = journal_df[~journal_df['image_filename'].isin(existing_filenames)]
+        if len(journal_df) > 0:
+            append_csv(journal_df, csv_path)
+            fsync_file(csv_path)
+
+    os.remove(journal_path)
+    return len(journal_df)
+
+def resume_dataset(csv_path, journal_path, image_folder, remove_orphan_images=False):
+    # reconciles a dataset folder after a crash: the rows left in the journal are moved into the CSV, and images on disk
+    # that have no metadata row (the run stopped between saving the image and journaling its row) are listed or removed
+    num_recovered_rows = compact_journal(journal_path, csv_path, image_folder)
+    if num_recovered_rows > 0:
+        print(f"Resume: recovered {num_recovered_rows} metadata rows from the journal '{journal_path}'")
+
+    listed_filenames = set(pd.read_csv(csv_path, usecols=['image_filename'])['image_filename']) if os.path.exists(csv_path) else set()
+    orphan_filenames = sorted(filename for filename in os.listdir(image_folder)
+                              if filename.endswith('.jpg') and filename not in listed_filenames)
+    if orphan_filenames:
+        print(f"Resume: {len(orphan_filenames)} images have no metadata" + (", removing them" if remove_orphan_images else f", e.g. '{orphan_filenames[0]}'"))
+        if remove_orphan_images:
+            for filename in orphan_filenames:
+                os.remove(os.path.join(image_folder, filename))
+
+    # images of the tar shards carry their metadata row, so rows missing from the CSV are recovered from the shards
+    if image_shard_writer is not None:
+        shard_orphan_filenames = [filename for filename in image_shard_writer.image_filenames if filename not in listed_filenames]
+        if shard_orphan_filenames:
+            with ShardReader(image_shard_writer.shard_folder, image_shard_writer.shard_prefix) as shard_reader:
+                append_csv(pd.DataFrame([shard_reader.read_metadata(filename) for filename in shard_orphan_filenames]), csv_path)
+            print(f"Resume: recovered {len(shard_orphan_filenames)} metadata rows from the image shards")
+
+    return orphan_filenames
+
+# pre-generated prompt corpus that get_random_prompt() consumes in order (see create_prompt_corpus.py)
+prompt_corpus = None
+prompt_corpus_next_index = 0
+prompt_corpus_stop_index = 0
+
+def set_prompt_corpus(corpus_folder, start_index=0, stop_index=None):
+    global prompt_corpus, prompt_corpus_next_index, prompt_corpus_stop_index
+
+    if corpus_folder is None:
+        prompt_corpus = None
+        return
+
+    prompt_corpus = PromptCorpus(corpus_folder)
+    prompt_corpus_next_index = start_index
+    prompt_corpus_stop_index = len(prompt_corpus) if stop_index is None else min(stop_index, len(prompt_corpus))
+    print(f"Using prompts {start_index} to {prompt_corpus_stop_index} of the prompt corpus '{corpus_folder}'")
+
+# optional coverage balanced prompt sampler (see CoverageQuotaSampler in face_prompt_utils.py)
+prompt_quota_sampler = None
+
+# optional token budget of generated prompts (CLIP text encoders truncate at 77 tokens), None to disable
+max_prompt_tokens = None
+
+def set_prompt_quota_sampler(quota_sampler, csv_path=None):
+    # prompts already in the metadata CSV are counted toward the quotas
+    global prompt_quota_sampler
+
+    prompt_quota_sampler = quota_sampler
+    if quota_sampler is not None and csv_path is not None and os.path.exists(csv_path):
+        existing_df = pd.read_csv(csv_path)
+        if all(name in existing_df.columns for name in quota_sampler.cell_attributes):
+            quota_sampler.add_existing_prompts(existing_df[list(quota_sampler.cell_attributes)].fillna(-1).astype(int))
+    if quota_sampler is not None:
+        print(f"Prompt quotas: {quota_sampler.num_missing_prompts} prompts missing in {len(quota_sampler.open_cells)} open cells")
+
+def get_random_prompt_with_attributes(model_used=None):
+    # the prompt and its integer coded attribute record (see FacePromptSampler.prompt_attribute_vocabularies), the
+    # prompts dead lettered by earlier runs for model_used come first (see load_replay_prompts)
+    global prompt_corpus_next_index
+
+    if replay_prompts.get(model_used):
+        record = replay_prompts[model_used].popleft()
+        if prompt_quota_sampler is not None:
+            prompt_quota_sampler.add_prompt(record['prompt_attributes'])
+        return record['text_prompt'], record['prompt_attributes']
+
+    if prompt_quota_sampler is not None:
+        return prompt_quota_sampler.generate_face_prompt(max_prompt_tokens=max_prompt_tokens)
+
+    if prompt_corpus is None:
+        return generate_face_prompt(return_attributes=True, max_prompt_tokens=max_prompt_tokens)
+
+    if prompt_corpus_next_index >= prompt_corpus_stop_index:
+        raise RuntimeError(f"Prompt corpus '{prompt_corpus.corpus_folder}' is exhausted at index {prompt_corpus_next_index}")
+
+    output_prompt = prompt_corpus[prompt_corpus_next_index]
+    prompt_attributes = prompt_corpus.get_attributes(prompt_corpus_next_index)
+    prompt_corpus_next_index += 1
+    return output_prompt, prompt_attributes
+
 def get_random_prompt():
-    output_prompt = generate_face_prompt()
+    output_prompt, _ = get_random_prompt_with_attributes()
     return output_prompt
 
+# model -> deque of the dead letter records whose prompts are generated again
+replay_prompts = {}
+
+def get_replay_path(dead_letter_path):
+    return dead_letter_path + '.replay'
+
+def load_replay_prompts(dead_letter_path):
+    # the samples dead lettered by earlier runs after transient errors or throttling are generated again by the same
+    # model, before new prompts. the dead letter file is moved to the replay file first, so the samples that fail again
+    # start a new dead letter file. returns the number of prompts to replay
+    replay_path = get_replay_path(dead_letter_path)
+    if os.path.exists(dead_letter_path):
+        with open(dead_letter_path, 'r', encoding='utf-8') as f, open(replay_path, 'a', encoding='utf-8') as replay_file:
+            replay_file.write(f.read())
+        os.remove(dead_letter_path)
+
+    replay_prompts.clear()
+    for record in read_dead_letters(replay_path):
+        if record.get('error_class') != 'permanent' and record.get('text_prompt') is not None:
+            replay_prompts.setdefault(record['model_used'], deque()).append(record)
+    return sum(len(records) for records in replay_prompts.values())
+
+def finish_replay(dead_letter_path):
+    # the records of the replay file that were not replayed (invalid requests, models that did not run) go back to the
+    # dead letter file. a run that crashed keeps its replay file, so its prompts may be replayed twice but none is lost
+    replay_path = get_replay_path(dead_letter_path)
+    if not os.path.exists(replay_path):
+        return
+    unused_records = [record for record in read_dead_letters(replay_path) if record.get('error_class') == 'permanent' or record.get('text_prompt') is None]
+    unused_records += [record for records in replay_prompts.values() for record in records]
+    with open(dead_letter_path, 'a', encoding='utf-8') as f:
+        for record in unused_records:
+            f.write(json.dumps(record) + '\n')
+    os.remove(replay_path)
+    replay_prompts.clear()
+
+def release_random_prompt(prompt_attributes):
+    # a prompt whose image generation failed no longer counts toward its quota
+    if prompt_quota_sampler is not None:
+        prompt_quota_sampler.remove_prompt(prompt_attributes)
+
+def save_prompt_attribute_vocabularies(output_db_folder):
+    # the attribute columns of the metadata CSV are indices into these vocabularies
+    vocabularies = {name: list(vocabulary) for name, vocabulary in FacePromptSampler.prompt_attribute_vocabularies.items()
+                    if vocabulary is not None}
+    with open(os.path.join(output_db_folder, PROMPT_ATTRIBUTE_VOCABULARIES_FILENAME), 'w') as f:
+        json.dump(vocabularies, f, indent=2)
+
 #%%
 
 if __name__ == "__main__":
@@ -503,7 +1454,66 @@ if __name__ == "__main__":
     
     os.makedirs(output_db_folder, exist_ok=True)
 
+    # optional pre-generated prompt corpus (see create_prompt_corpus.py), prompts are consumed in order from the start index
+    prompt_corpus_folder = None
+    prompt_corpus_start_index = 0
+    set_prompt_corpus(prompt_corpus_folder, start_index=prompt_corpus_start_index)
+
+    # optional coverage balanced prompts: number of images per (age_group, sex_group, ethnicity_group, lighting_category) cell
+    prompt_quota_per_cell = None
+
+    # optional prompt token budget, elements that do not fit are left out (77 for the CLIP text encoders of SDXL/FLUX)
+    max_prompt_tokens = None
+
+    # the async paths send up to max_concurrent_calls requests at a time to each provider, the actual number adapts to the
+    # latency, errors and throttling responses of the provider (see ProviderRateController in provider_rate_control.py)
     call_dev_pro_async = True
+    call_sdxl_dalle3_async = True
+    max_concurrent_calls = 10
+
+    # requests per minute allowed by the API rate limits of your account for each provider, None when unknown
+    provider_requests_per_minute = {'fal': None, 'stability': None, 'openai': None}
+    rate_controllers = {provider: ProviderRateController(provider, requests_per_minute, max_concurrency=max_concurrent_calls)
+                        for provider, requests_per_minute in provider_requests_per_minute.items()}
+    num_image_workers = None  # threads that decode, encode and save the images of the async paths (None for the default)
+    jpeg_pass_through = True  # save JPEG results as they are, only other images are re-encoded at jpeg_quality
+
+    # failed calls are retried up to generation_max_retries times with exponential backoff, invalid requests are not retried,
+    # and the calls to a provider are held back for circuit_breaker_reset_timeout_sec after circuit_breaker_failure_threshold
+    # consecutive failures (see provider_rate_control.py). samples that still fail go to the dead letter file, and their
+    # prompts are generated again by the next run when replay_dead_letters is True
+    generation_max_retries = 5
+    circuit_breaker_failure_threshold = 5
+    circuit_breaker_reset_timeout_sec = 30.0
+    replay_dead_letters = True
+
+    # keep-alive connection pool of the result image downloads (shared by all the models)
+    http_pool_max_connections = 20
+    http_pool_timeout_sec = 60
+    configure_http_sessions(max_connections=http_pool_max_connections, timeout_sec=http_pool_timeout_sec)
+
+    # live per model stage timings, images per hour, error rate and cost, exported every metrics_export_interval_sec
+    # in the Prometheus text format ('prometheus') or as 'json' (see generation_telemetry.py)
+    metrics_format = 'prometheus'
+    metrics_path = os.path.join(output_db_folder, "generation_metrics.prom" if metrics_format == 'prometheus' else "generation_metrics.json")
+    metrics_export_interval_sec = 30
+    telemetry = GenerationTelemetry(metrics_path, export_format=metrics_format, export_interval_sec=metrics_export_interval_sec,
+                                    cost_per_image_usd=MODEL_COST_PER_IMAGE_USD, model_providers=MODEL_PROVIDERS)
+
+    # optional sharded output: images and their metadata rows are appended to tar shards of up to shard_max_size_bytes in
+    # {output_db_folder}/shards, with an index for random access (see image_shards.py), instead of one file per image
+    use_image_shards = False
+    shard_max_size_bytes = 1024**3
+
+    # image numbers are leased from a small SQLite database in the output_db_folder (see image_number_allocator.py), so several
+    # generator processes, also on several machines sharing the folder, never write the same image filename. give every
+    # process its own worker_name (None for a single process), each one journals (and shards) its rows to its own files
+    image_number_lease_size = 100
+    worker_name = None
+
+    # long lived gRPC channels of the SDXL calls (shared by all the calls and engines, replaced when they break)
+    sdxl_channel_pool_size = 2
+    configure_SDXL_channels(pool_size=sdxl_channel_pool_size)
 
     # FLUX1.dev (about 1150 images per 1 hour when async is on, costs ~$29 per 1150 images)
     flux1_dev_samples = 10
@@ -521,7 +1531,7 @@ if __name__ == "__main__":
         'jpeg_quality': 90
     }
 
-    # SDXL (about 550 images per 1 hour, costs ~$2 per 550 images)
+    # SDXL (about 550 images per 1 hour when async is off, costs ~$2 per 550 images)
     sdxl_samples = 10
     sdxl_config = {
         "engine_id": "stable-diffusion-xl-1024-v1-0",
@@ -537,7 +1547,7 @@ if __name__ == "__main__":
         'jpeg_quality': 90
     }
 
-    # DALL-E 3 (about 233 images per 1 hour, costs ~$8.6 per 233 images)
+    # DALL-E 3 (about 233 images per 1 hour when async is off, costs ~$8.6 per 233 images)
     dalle3_samples = 10
     dalle3_config = {
         "size": "1024x1024",
@@ -549,55 +1559,99 @@ if __name__ == "__main__":
     image_folder = os.path.join(output_db_folder, "images")
     os.makedirs(image_folder, exist_ok=True)
     csv_path = os.path.join(output_db_folder, "SFHQ_T2I_dataset.csv")
+    save_prompt_attribute_vocabularies(output_db_folder)
+
+    # metadata rows are journaled as soon as each image is saved and moved into the CSV at the end of the run,
+    # rows left in the journal by a run that crashed are moved into the CSV here (images without any row are reported,
+    # with several workers these include the images other workers are saving, so do not remove them then)
+    worker_suffix = "" if worker_name is None else f"_{worker_name}"
+    journal_path = os.path.join(output_db_folder, f"SFHQ_T2I_dataset_journal{worker_suffix}.jsonl")
+    dead_letter_path = os.path.join(output_db_folder, f"SFHQ_T2I_dead_letters{worker_suffix}.jsonl")
+    remove_orphan_images = False
+    if use_image_shards:
+        image_shard_writer = ShardWriter(os.path.join(output_db_folder, "shards"), shard_prefix=f"SFHQ_T2I_shard{worker_suffix}",
+                                         max_shard_size_bytes=shard_max_size_bytes)
+    image_number_allocator = ImageNumberAllocator(os.path.join(output_db_folder, "SFHQ_T2I_image_numbers.sqlite"), lease_size=image_number_lease_size,
+                                                  get_initial_number=lambda model_prefix: get_existing_image_count(image_folder, model_prefix))
+    # the CSV is only written under the allocator's database lock, one worker at a time
+    with image_number_allocator.exclusive():
+        resume_dataset(csv_path, journal_path, image_folder, remove_orphan_images=remove_orphan_images)
+    if prompt_quota_per_cell is not None:
+        set_prompt_quota_sampler(CoverageQuotaSampler(prompt_quota_per_cell), csv_path)
+    if replay_dead_letters:
+        num_replay_prompts = load_replay_prompts(dead_letter_path)
+        print(f"Replaying {num_replay_prompts} prompts of earlier failed samples")
+    dead_letter_file = DeadLetterFile(dead_letter_path)
     
     print("\nStarting image generation...\n")
-    
-    if call_dev_pro_async:
-        max_concurrent_calls = 10
-
-        loop = asyncio.get_event_loop()
-
-        if flux1_dev_samples > 0:
-            flux1_dev_df = loop.run_until_complete(create_dataset_FLUX_parallel(
-                flux1_dev_samples, 'FLUX1_dev', image_folder, max_concurrent_calls=max_concurrent_calls, **flux1_dev_config
-            ))
-            combined_df = update_csv(flux1_dev_df, csv_path)
-            print(f"CSV updated with {len(flux1_dev_df)} FLUX1_dev images")
-
-        if flux1_pro_samples > 0:
-            flux1_pro_df = loop.run_until_complete(create_dataset_FLUX_parallel(
-                flux1_pro_samples, 'FLUX1_pro', image_folder, max_concurrent_calls=max_concurrent_calls, **flux1_pro_config
-            ))
-            combined_df = update_csv(flux1_pro_df, csv_path)
-            print(f"CSV updated with {len(flux1_pro_df)} FLUX1_pro images")
-
-        loop.close()
-    else:
-        if flux1_dev_samples > 0:
-            flux1_dev_df = create_dataset_FLUX(flux1_dev_samples, 'FLUX1_dev', image_folder, **flux1_dev_config)
-            combined_df = update_csv(flux1_dev_df, csv_path)
-            print(f"CSV updated with {len(flux1_dev_df)} FLUX1_dev images")
-
-        if flux1_pro_samples > 0:
-            flux1_pro_df = create_dataset_FLUX(flux1_pro_samples, 'FLUX1_pro', image_folder, **flux1_pro_config)
-            combined_df = update_csv(flux1_pro_df, csv_path)
-            print(f"CSV updated with {len(flux1_pro_df)} FLUX1_pro images")
-
-    if flux1_schnell_samples > 0:
-        flux1_schnell_df = create_dataset_FLUX(flux1_schnell_samples, 'FLUX1_schnell', image_folder, **flux1_schnell_config)
-        combined_df = update_csv(flux1_schnell_df, csv_path)
-        print(f"CSV updated with {len(flux1_schnell_df)} FLUX1_schnell images")
-
-    if sdxl_samples > 0:
-        sdxl_df = create_dataset_SDXL(sdxl_samples, image_folder, **sdxl_config)
-        combined_df = update_csv(sdxl_df, csv_path)
-        print(f"CSV updated with {len(sdxl_df)} SDXL images")
-    
-    if dalle3_samples > 0:
-        dalle3_df = create_dataset_DALLE3(dalle3_samples, image_folder, **dalle3_config)
-        combined_df = update_csv(dalle3_df, csv_path)
-        print(f"CSV updated with {len(dalle3_df)} DALLE3 images")
-    
+
+    loop = asyncio.get_event_loop()
+
+    with MetadataJournal(journal_path) as journal:
+        result_sink = journal if image_shard_writer is None else chain_result_sinks(image_shard_writer, journal)
+        if call_dev_pro_async:
+            if flux1_dev_samples > 0:
+                num_images = loop.run_until_complete(create_dataset_FLUX_parallel(
+                    flux1_dev_samples, 'FLUX1_dev', image_folder, max_concurrent_calls=max_concurrent_calls, num_image_workers=num_image_workers,
+                    result_sink=result_sink, rate_controller=rate_controllers['fal'], telemetry=telemetry, **flux1_dev_config
+                ))
+                print(f"Journal updated with {num_images} FLUX1_dev images")
+
+            if flux1_pro_samples > 0:
+                num_images = loop.run_until_complete(create_dataset_FLUX_parallel(
+                    flux1_pro_samples, 'FLUX1_pro', image_folder, max_concurrent_calls=max_concurrent_calls, num_image_workers=num_image_workers,
+                    result_sink=result_sink, rate_controller=rate_controllers['fal'], telemetry=telemetry, **flux1_pro_config
+                ))
+                print(f"Journal updated with {num_images} FLUX1_pro images")
+        else:
+            if flux1_dev_samples > 0:
+                num_images = create_dataset_FLUX(flux1_dev_samples, 'FLUX1_dev', image_folder, result_sink=result_sink, telemetry=telemetry, **flux1_dev_config)
+                print(f"Journal updated with {num_images} FLUX1_dev images")
+
+            if flux1_pro_samples > 0:
+                num_images = create_dataset_FLUX(flux1_pro_samples, 'FLUX1_pro', image_folder, result_sink=result_sink, telemetry=telemetry, **flux1_pro_config)
+                print(f"Journal updated with {num_images} FLUX1_pro images")
+
+        if flux1_schnell_samples > 0:
+            num_images = create_dataset_FLUX(flux1_schnell_samples, 'FLUX1_schnell', image_folder, result_sink=result_sink, telemetry=telemetry, **flux1_schnell_config)
+            print(f"Journal updated with {num_images} FLUX1_schnell images")
+
+        if sdxl_samples > 0:
+            if call_sdxl_dalle3_async:
+                num_images = loop.run_until_complete(create_dataset_SDXL_parallel(
+                    sdxl_samples, image_folder, max_concurrent_calls=max_concurrent_calls, num_image_workers=num_image_workers,
+                    result_sink=result_sink, rate_controller=rate_controllers['stability'], telemetry=telemetry, **sdxl_config
+                ))
+            else:
+                num_images = create_dataset_SDXL(sdxl_samples, image_folder, result_sink=result_sink, telemetry=telemetry, **sdxl_config)
+            print(f"Journal updated with {num_images} SDXL images")
+
+        if dalle3_samples > 0:
+            if call_sdxl_dalle3_async:
+                num_images = loop.run_until_complete(create_dataset_DALLE3_parallel(
+                    dalle3_samples, image_folder, max_concurrent_calls=max_concurrent_calls, num_image_workers=num_image_workers,
+                    result_sink=result_sink, rate_controller=rate_controllers['openai'], telemetry=telemetry, **dalle3_config
+                ))
+            else:
+                num_images = create_dataset_DALLE3(dalle3_samples, image_folder, result_sink=result_sink, telemetry=telemetry, **dalle3_config)
+            print(f"Journal updated with {num_images} DALLE3 images")
+
+    if image_shard_writer is not None:
+        image_shard_writer.close()
+    telemetry.export()
+    loop.run_until_complete(close_async_http_client())
+    loop.run_until_complete(close_SDXL_async_channels())
+    loop.close()
+    close_SDXL_channels()
+
+    if replay_dead_letters:
+        finish_replay(dead_letter_path)
+    with image_number_allocator.exclusive():
+        num_rows = compact_journal(journal_path, csv_path)
+    image_number_allocator.close()
+    print(f"CSV updated with {num_rows} images from the journal")
+
+    combined_df = pd.read_csv(csv_path)
     print("\nDataset creation completed!\n")
     print(f"Total images in the dataset per model:")
     for model in ["SDXL", "DALLE3", "FLUX1_pro", "FLUX1_dev", "FLUX1_schnell"]:
@@ -605,6 +1659,9 @@ if __name__ == "__main__":
         print(f"- {count} {model} images")
     print(f"Combined total of images: {len(combined_df)}")
     print(f"\nMetadata saved to 'SFHQ_T2I_dataset.csv'")
+    print(f"Generation metrics saved to '{metrics_path}'")
+    if dead_letter_file.num_records > 0:
+        print(f"{dead_letter_file.num_records} failed samples saved to '{dead_letter_path}'")
 
 
 #%%
@@ -0,0 +1,193 @@
+#%% Imports
+
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from multiprocessing import Pool
+
+from face_prompt_utils import FacePromptSampler, get_prompt_rng
+
+#%% Constants
+
+PROMPT_CORPUS_INFO_FILENAME = 'prompt_corpus.json'
+PROMPT_TEXT_FILENAME = 'prompt_text.bin'
+PROMPT_OFFSETS_FILENAME = 'prompt_offsets.bin'
+
+# per prompt columns, besides the text: the stream index and the prompt attribute record
+# (categorical attributes are indices into the vocabularies stored in the info file)
+PROMPT_CORPUS_COLUMN_DTYPES = {'stream_index': 'int32'}
+PROMPT_CORPUS_COLUMN_DTYPES.update({name: 'int16' for name in FacePromptSampler.prompt_attribute_names})
+PROMPT_CORPUS_COLUMN_DTYPES['element_kinds'] = 'int32'
+
+#%% Helper functions
+
+def generate_prompt_corpus_chunk(chunk_args):
+    # every chunk is generated from its own random stream, so the corpus does not depend on the number of workers
+    seed, chunk_index, num_prompts, conditions_dict = chunk_args
+
+    sampler = FacePromptSampler(get_prompt_rng(seed, chunk_index))
+    prompts, attributes = sampler.generate_face_prompts(num_prompts, return_attributes=True, **conditions_dict)
+
+    encoded_prompts = [prompt.encode('utf-8') for prompt in prompts]
+    prompt_text = np.frombuffer(b''.join(encoded_prompts), dtype=np.uint8)
+    prompt_lengths = np.array([len(encoded_prompt) for encoded_prompt in encoded_prompts], dtype=np.int64)
+
+    columns = dict(attributes)
+    columns['stream_index'] = np.full(num_prompts, chunk_index)
+
+    return prompt_text, prompt_lengths, columns
+
+def create_prompt_corpus(corpus_folder, num_prompts, seed, chunk_size=100_000, num_workers=None, **conditions_dict):
+    """Pre-generate `num_prompts` face prompts into a folder of memory-mappable columns.
+
+    Chunk `i` of the corpus is generated with the random stream `get_prompt_rng(seed, i)`,
+    so any chunk can be regenerated (or appended to a corpus) independently of the others.
+    `conditions_dict` holds conditioning arguments of `generate_face_prompts` that apply to
+    the whole corpus (e.g. `age_group='elderly'`).
+    """
+
+    os.makedirs(corpus_folder, exist_ok=True)
+    start_time = time.time()
+
+    num_chunks = (num_prompts + chunk_size - 1) // chunk_size
+    chunk_args_list = [(seed, chunk_index, min(chunk_size, num_prompts - chunk_index * chunk_size), conditions_dict)
+                       for chunk_index in range(num_chunks)]
+
+    column_files = {name: open(os.path.join(corpus_folder, f'{name}.bin'), 'wb') for name in PROMPT_CORPUS_COLUMN_DTYPES}
+    text_file = open(os.path.join(corpus_folder, PROMPT_TEXT_FILENAME), 'wb')
+    offsets_file = open(os.path.join(corpus_folder, PROMPT_OFFSETS_FILENAME), 'wb')
+
+    try:
+        # chunks are written in order as they come back from the workers
+        num_text_bytes = 0
+        np.zeros(1, dtype=np.int64).tofile(offsets_file)
+        with Pool(num_workers) as pool:
+            chunk_results = pool.imap(generate_prompt_corpus_chunk, chunk_args_list)
+            for prompt_text, prompt_lengths, columns in tqdm(chunk_results, total=num_chunks, desc="Generating prompt corpus"):
+                prompt_text.tofile(text_file)
+                (num_text_bytes + np.cumsum(prompt_lengths)).tofile(offsets_file)
+                num_text_bytes += len(prompt_text)
+                for name, dtype in PROMPT_CORPUS_COLUMN_DTYPES.items():
+                    columns[name].astype(dtype).tofile(column_files[name])
+    finally:
+        text_file.close()
+        offsets_file.close()
+        for column_file in column_files.values():
+            column_file.close()
+
+    corpus_info = {
+        'num_prompts': num_prompts,
+        'seed': seed,
+        'chunk_size': chunk_size,
+        'conditions': conditions_dict,
+        'column_dtypes': PROMPT_CORPUS_COLUMN_DTYPES,
+        'vocabularies': {name: list(vocabulary) for name, vocabulary in FacePromptSampler.prompt_attribute_vocabularies.items()
+                         if vocabulary is not None},
+    }
+    with open(os.path.join(corpus_folder, PROMPT_CORPUS_INFO_FILENAME), 'w') as f:
+        json.dump(corpus_info, f, indent=2)
+
+    total_duration_sec = time.time() - start_time
+    print(f"Prompt corpus: generated {num_prompts} prompts in {total_duration_sec:.1f} seconds ({num_prompts / total_duration_sec:.0f} prompts per second)")
+    print(f"Prompt corpus saved to '{corpus_folder}'")
+
+#%% Prompt corpus reader
+
+class PromptCorpus:
+    """Read only access to a prompt corpus folder, all the columns are memory mapped.
+
+    `corpus[i]` returns the text of prompt `i`, and `corpus.columns[name]` the integer
+    column `name` of all prompts, so filtering or balancing the corpus is a column scan.
+    """
+
+    def __init__(self, corpus_folder):
+        self.corpus_folder = corpus_folder
+        with open(os.path.join(corpus_folder, PROMPT_CORPUS_INFO_FILENAME), 'r') as f:
+            self.info = json.load(f)
+
+        self.vocabularies = self.info['vocabularies']
+        self.prompt_text = np.memmap(os.path.join(corpus_folder, PROMPT_TEXT_FILENAME), dtype=np.uint8, mode='r')
+        self.prompt_offsets = np.memmap(os.path.join(corpus_folder, PROMPT_OFFSETS_FILENAME), dtype=np.int64, mode='r')
+        self.columns = {name: np.memmap(os.path.join(corpus_folder, f'{name}.bin'), dtype=dtype, mode='r')
+                        for name, dtype in self.info['column_dtypes'].items()}
+
+    def __len__(self):
+        return self.info['num_prompts']
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"prompt index {index} is out of range for a corpus of {len(self)} prompts")
+        return self.prompt_text[self.prompt_offsets[index]:self.prompt_offsets[index + 1]].tobytes().decode('utf-8')
+
+    def get_prompts(self, start, stop):
+        return [self[index] for index in range(start, min(stop, len(self)))]
+
+    def get_shard_range(self, shard_index, num_shards):
+        # contiguous [start, stop) range of prompts for one of num_shards machines
+        shard_size = (len(self) + num_shards - 1) // num_shards
+        return min(shard_index * shard_size, len(self)), min((shard_index + 1) * shard_size, len(self))
+
+    def find_prompt_indices(self, **conditions_dict):
+        # e.g. find_prompt_indices(age_group='elderly', sex_group='female', age=70). attributes with a vocabulary take a
+        # value of it (None for prompts without the attribute), element_kinds an element kind that the prompt must
+        # include, and the other attributes (e.g. age, num_elements) an integer
+        is_selected = np.ones(len(self), dtype=bool)
+        for name, value in conditions_dict.items():
+            if name not in self.columns:
+                raise ValueError(f"unknown prompt attribute '{name}', expected one of {list(self.columns)}")
+            vocabulary = self.vocabularies.get(name)
+            if vocabulary is None:
+                is_selected &= self.columns[name] == value
+                continue
+            expected_values = vocabulary if name == 'element_kinds' else vocabulary + [None]
+            if value not in expected_values:
+                raise ValueError(f"unknown value {value!r} of prompt attribute '{name}', expected one of {expected_values}")
+            if name == 'element_kinds':
+                is_selected &= (self.columns[name] >> vocabulary.index(value) & 1).astype(bool)
+            else:
+                is_selected &= self.columns[name] == (vocabulary.index(value) if value is not None else -1)
+        return np.flatnonzero(is_selected)
+
+    def get_attributes(self, index):
+        # integer coded attribute record of prompt `index`, as returned by generate_face_prompt(..., return_attributes=True)
+        return {name: int(self.columns[name][index]) for name in FacePromptSampler.prompt_attribute_names}
+
+    def to_dataframe(self, start=0, stop=None):
+        # decoded view of a range of the corpus, for inspection
+        stop = len(self) if stop is None else min(stop, len(self))
+        corpus_df = pd.DataFrame({'text_prompt': self.get_prompts(start, stop)})
+        for name, column in self.columns.items():
+            values = np.asarray(column[start:stop])
+            if name == 'element_kinds':
+                vocabulary = self.vocabularies[name]
+                corpus_df[name] = [', '.join(kind for bit, kind in enumerate(vocabulary) if mask >> bit & 1) for mask in values.tolist()]
+            elif name in self.vocabularies:
+                vocabulary = np.array(self.vocabularies[name] + [None], dtype=object)
+                corpus_df[name] = vocabulary[values]
+            else:
+                corpus_df[name] = values
+        return corpus_df
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    corpus_folder = r"prompt_corpus_001"
+    num_prompts = 2_000_000
+    seed = 1234
+    chunk_size = 100_000
+    num_workers = None  # one worker per CPU
+
+    create_prompt_corpus(corpus_folder, num_prompts, seed, chunk_size=chunk_size, num_workers=num_workers)
+
+    prompt_corpus = PromptCorpus(corpus_folder)
+    print(prompt_corpus.to_dataframe(0, 5))
+    print(f"\nNumber of elderly female prompts: {len(prompt_corpus.find_prompt_indices(age_group='elderly', sex_group='female'))}")
+    print(f"Prompts of shard 1 out of 4: {prompt_corpus.get_shard_range(1, 4)}")
+
+#%%
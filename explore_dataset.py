@@ -2,6 +2,7 @@
 
 import os
 import glob
+import json
 import torch
 import open_clip
 import numpy as np
@@ -10,6 +11,7 @@ import matplotlib.pyplot as plt
 from PIL import Image
 from extract_pretrained_features import extract_pretrained_features, load_openclip_model
 from extract_pretrained_features import collect_pretrained_features_from_folder
+from face_prompt_utils import count_prompt_tokens
 
 #%% Helper functions
 
@@ -68,6 +70,40 @@ def plot_prompt_length_distribution(df):
     plt.tight_layout()
     return fig
 
+def plot_prompt_token_distribution(df, context_length=77):
+    # CLIP token counts from the cached fragment token counts (no tokenizer pass over the whole CSV)
+    df['prompt_tokens'] = count_prompt_tokens(df['text_prompt'].tolist())
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+
+    models = df['model_used'].unique()
+    colors = plt.cm.rainbow(np.linspace(0, 1, len(models)))
+
+    for model, color in zip(models, colors):
+        model_data = df[df['model_used'] == model]['prompt_tokens']
+        truncated_percent = 100 * (model_data > context_length).mean()
+        ax.hist(model_data, bins=50, alpha=0.5, label=f'{model} ({truncated_percent:.1f}% truncated)', color=color)
+
+    ax.axvline(context_length, color='white', linestyle='--')
+    ax.set_title('Prompt Length in CLIP Tokens', fontsize=15)
+    ax.set_xlabel('Number of Tokens', fontsize=13)
+    ax.set_ylabel('Frequency', fontsize=13)
+    ax.legend(fontsize=14)
+
+    plt.tight_layout()
+    return fig
+
+def filter_by_prompt_attributes(df, dataset_folder, **conditions_dict):
+    # e.g. filter_by_prompt_attributes(df, dataset_folder, age_group='elderly', sex_group='female')
+    # only for datasets created with the prompt attribute columns (integer codes into the saved vocabularies)
+    with open(os.path.join(dataset_folder, 'prompt_attribute_vocabularies.json'), 'r') as f:
+        vocabularies = json.load(f)
+
+    is_selected = np.ones(len(df), dtype=bool)
+    for name, value in conditions_dict.items():
+        is_selected &= (df[name] == vocabularies[name].index(value)).values
+    return df[is_selected]
+
 def format_prompt(prompt, max_width=85, min_width=55):
     words = prompt.split()
     lines = []
@@ -227,6 +263,7 @@ if __name__ == "__main__":
 
     # Plot the distribution of prompt lengths
     fig_prompt_lengths = plot_prompt_length_distribution(df)
+    fig_prompt_tokens = plot_prompt_token_distribution(df)
 
     # Display two random images for each model
     model_to_use = 'FLUX1_pro'
@@ -1,7 +1,11 @@
 #%%
 
+import math
+import bisect
 import random
+import itertools
 import numpy as np
+from collections import Counter, defaultdict
 
 #%% data
 
@@ -590,822 +594,2098 @@ face_poses_list = [
     "with their head rotated a bit to the left", "with their chin pointing slightly upwards", "with their face resting on their hand"
 ]
 
-#%% helper functions
+prompt_start_list = [
+    "Photo of a", "Portrait of a", "Photograph of a", "Medium Shot of a", "Close-Up of a", "An artistic portrayal of a",
+    "Headshot of a", "Face of a", "Facial portrait of a", "Studio portrait of a", "Candid portrait of a", "A serene image of a",
+    "Profile view of a", "Character study of a", "Expressive portrait of a", "Cinematic portrait of a", "A candid portrait of a",
+    "A portrait photo of a", "A professional photograph of a", "A professional portrait photograph of a", "A pro portrait photo of a", 
+    "A high-resolution image of a", "A captivating picture of a", "An enchanting photo of a", "A studio shot of a", "A casual snapshot of a",
+    "A meticulously composed portrait of a", "An authentic picture of a", "A magazine-quality portrait of a", "A compelling photograph of a",
+    "A striking portrait of a", "A vintage photograph of a", "A black and white portrait of a", "An evocative image of a", 
+    "A low-angle shot of a", "A wide-angle shot of a", "An atmospheric portrait of a", "A moody portrayal of a", "A whimsical image of a",
+    "An extreme wide shot of a", "A wide shot of a", "A full shot of a", "A medium wide shot of a", "A medium close-up of a",
+    "An extreme close-up of a", "An eye-level shot of a", "A Dutch angle shot of a", "A tracking shot of a", "A pan shot of a",
+    "A tilt shot of a", "A dolly shot of a", "A zoom shot of a", "An over-the-shoulder shot of a", "A POV shot of a",
+    "A cutaway shot of a", "An insert shot of a", "An aerial portrait shot of a", "A high-angle shot of a",
+]
 
-def get_prompt_start():
-    prompt_start_list = [
-        "Photo of a", "Portrait of a", "Photograph of a", "Medium Shot of a", "Close-Up of a", "An artistic portrayal of a",
-        "Headshot of a", "Face of a", "Facial portrait of a", "Studio portrait of a", "Candid portrait of a", "A serene image of a",
-        "Profile view of a", "Character study of a", "Expressive portrait of a", "Cinematic portrait of a", "A candid portrait of a",
-        "A portrait photo of a", "A professional photograph of a", "A professional portrait photograph of a", "A pro portrait photo of a", 
-        "A high-resolution image of a", "A captivating picture of a", "An enchanting photo of a", "A studio shot of a", "A casual snapshot of a",
-        "A meticulously composed portrait of a", "An authentic picture of a", "A magazine-quality portrait of a", "A compelling photograph of a",
-        "A striking portrait of a", "A vintage photograph of a", "A black and white portrait of a", "An evocative image of a", 
-        "A low-angle shot of a", "A wide-angle shot of a", "An atmospheric portrait of a", "A moody portrayal of a", "A whimsical image of a",
-        "An extreme wide shot of a", "A wide shot of a", "A full shot of a", "A medium wide shot of a", "A medium close-up of a",
-        "An extreme close-up of a", "An eye-level shot of a", "A Dutch angle shot of a", "A tracking shot of a", "A pan shot of a",
-        "A tilt shot of a", "A dolly shot of a", "A zoom shot of a", "An over-the-shoulder shot of a", "A POV shot of a",
-        "A cutaway shot of a", "An insert shot of a", "An aerial portrait shot of a", "A high-angle shot of a",
-    ]
+glasses_list = [
+    "wearing classic rectangular glasses", "with round vintage-style glasses", "sporting cat-eye frames",
+    "with aviator-style glasses", "wearing oversized square glasses", "with sleek rimless glasses",
+    "sporting horn-rimmed glasses", "with retro browline glasses", "wearing geometric hexagonal frames",
+    "with trendy clear frame glasses", "sporting thick-framed hipster glasses", "with oval wire-frame glasses",
+    "wearing sporty wraparound glasses", "with stylish half-rim glasses", "sporting colorful acetate frames",
+    "with sophisticated titanium frames", "wearing bold colored glasses", "with minimalist thin metal frames",
+    "sporting funky asymmetrical glasses", "with classic wayfarers", "wearing trendy blue light blocking glasses",
+    "with elegant gold-rimmed glasses", "sporting futuristic shield glasses", "with retro round sunglasses",
+    "wearing clip-on sunglasses", "with gradient lens sunglasses", "sporting mirrored aviator sunglasses",
+    "with polarized sports sunglasses", "wearing fashionable oversized sunglasses", "with classic clubmaster sunglasses",
+    "sporting trendy transparent sunglasses", "with vintage cat-eye sunglasses", "wearing modern shield sunglasses",
+    "with retro square sunglasses", "sporting stylish browline sunglasses", "with cool wrap-around sunglasses", 
+    "with cyberpunk LED glasses", "wearing steampunk goggles", "sporting futuristic visor sunglasses",
+    "with monocle", "wearing diamond-studded glasses", 
+]
 
-    return random.choice(prompt_start_list)
-
-def get_random_glasses():
-    glasses_list = [
-        "wearing classic rectangular glasses", "with round vintage-style glasses", "sporting cat-eye frames",
-        "with aviator-style glasses", "wearing oversized square glasses", "with sleek rimless glasses",
-        "sporting horn-rimmed glasses", "with retro browline glasses", "wearing geometric hexagonal frames",
-        "with trendy clear frame glasses", "sporting thick-framed hipster glasses", "with oval wire-frame glasses",
-        "wearing sporty wraparound glasses", "with stylish half-rim glasses", "sporting colorful acetate frames",
-        "with sophisticated titanium frames", "wearing bold colored glasses", "with minimalist thin metal frames",
-        "sporting funky asymmetrical glasses", "with classic wayfarers", "wearing trendy blue light blocking glasses",
-        "with elegant gold-rimmed glasses", "sporting futuristic shield glasses", "with retro round sunglasses",
-        "wearing clip-on sunglasses", "with gradient lens sunglasses", "sporting mirrored aviator sunglasses",
-        "with polarized sports sunglasses", "wearing fashionable oversized sunglasses", "with classic clubmaster sunglasses",
-        "sporting trendy transparent sunglasses", "with vintage cat-eye sunglasses", "wearing modern shield sunglasses",
-        "with retro square sunglasses", "sporting stylish browline sunglasses", "with cool wrap-around sunglasses", 
-        "with cyberpunk LED glasses", "wearing steampunk goggles", "sporting futuristic visor sunglasses",
-        "with monocle", "wearing diamond-studded glasses", 
-    ]
-    
-    return random.choice(glasses_list)
-
-def get_random_gaze_direction():
-    gaze_direction_list = [
-        "looking directly into the camera", "gazing off to the side", 
-        "looking down in thought", "looking upwards", "with eyes closed", 
-        "staring to the side", "with a sidelong glance", "looking past the camera",
-        "with a far-off look", "with a focused gaze", "with a wandering gaze",
-        "looking into the distance", "with eyes nearly shut", 
-        "with eyes fixed on an unseen object", "glancing over their shoulder",
-        "with eyes darting around nervously", "staring intently at something off-camera",
-        "with a thousand-yard stare", "looking through half-lidded eyes",
-        "with eyes wide in surprise", "squinting against bright light",
-        "with a dreamy, unfocused gaze", "looking down demurely",
-        "with eyes crinkled in laughter", "peering curiously at the viewer",
-        "with a piercing stare", "looking up through their lashes",
-        "with eyes reflecting deep contemplation", "gazing longingly into the distance",
-        "with a mischievous twinkle in their eyes", "looking sideways with suspicion",
-        "with eyes brimming with tears", "staring defiantly at the camera",
-        "with a vacant, expressionless gaze", "looking up in wonder",
-        "with eyes narrowed in concentration", "gazing lovingly at someone off-camera",
-        "with a faraway look of nostalgia", "looking down with a shy smile",
-        "with eyes alight with excitement", "staring off into space pensively",
-        "with a haunted look in their eyes", "glancing furtively to the side",
-        "with eyes filled with determination", "looking straight ahead with resolve",
-        "with a distant, melancholic gaze", "peering intently at something in their hands",
-        "with eyes dancing with amusement", "staring blankly ahead",
-        "with a wistful gaze towards the horizon", "looking down with a furrowed brow",
-        "with eyes half-closed in contentment", "gazing upward with hope",
-        "with a sharp, analytical stare", "looking sideways with skepticism",
-        "with eyes wide with wonder", "staring intensely at their own reflection",
-        "with a distant gaze, lost in memory", "looking directly at the viewer with vulnerability",
-        "with eyes scanning the environment alertly", "gazing into middle distance, deep in thought",
-        "with a penetrating stare that seems to see through the viewer", "looking down with eyes closed, in meditation",
-        "with eyes darting back and forth, reading something", "staring off-camera with a look of longing",
-        "with eyes widened in fear or shock", "gazing at their own hands with fascination",
-        "with a soft, compassionate look in their eyes", "staring at the ground with a mix of shame and regret",
-        "with eyes twinkling with inner joy", "looking past the camera with a stoic expression"
-    ]
+gaze_direction_list = [
+    "looking directly into the camera", "gazing off to the side", 
+    "looking down in thought", "looking upwards", "with eyes closed", 
+    "staring to the side", "with a sidelong glance", "looking past the camera",
+    "with a far-off look", "with a focused gaze", "with a wandering gaze",
+    "looking into the distance", "with eyes nearly shut", 
+    "with eyes fixed on an unseen object", "glancing over their shoulder",
+    "with eyes darting around nervously", "staring intently at something off-camera",
+    "with a thousand-yard stare", "looking through half-lidded eyes",
+    "with eyes wide in surprise", "squinting against bright light",
+    "with a dreamy, unfocused gaze", "looking down demurely",
+    "with eyes crinkled in laughter", "peering curiously at the viewer",
+    "with a piercing stare", "looking up through their lashes",
+    "with eyes reflecting deep contemplation", "gazing longingly into the distance",
+    "with a mischievous twinkle in their eyes", "looking sideways with suspicion",
+    "with eyes brimming with tears", "staring defiantly at the camera",
+    "with a vacant, expressionless gaze", "looking up in wonder",
+    "with eyes narrowed in concentration", "gazing lovingly at someone off-camera",
+    "with a faraway look of nostalgia", "looking down with a shy smile",
+    "with eyes alight with excitement", "staring off into space pensively",
+    "with a haunted look in their eyes", "glancing furtively to the side",
+    "with eyes filled with determination", "looking straight ahead with resolve",
+    "with a distant, melancholic gaze", "peering intently at something in their hands",
+    "with eyes dancing with amusement", "staring blankly ahead",
+    "with a wistful gaze towards the horizon", "looking down with a furrowed brow",
+    "with eyes half-closed in contentment", "gazing upward with hope",
+    "with a sharp, analytical stare", "looking sideways with skepticism",
+    "with eyes wide with wonder", "staring intensely at their own reflection",
+    "with a distant gaze, lost in memory", "looking directly at the viewer with vulnerability",
+    "with eyes scanning the environment alertly", "gazing into middle distance, deep in thought",
+    "with a penetrating stare that seems to see through the viewer", "looking down with eyes closed, in meditation",
+    "with eyes darting back and forth, reading something", "staring off-camera with a look of longing",
+    "with eyes widened in fear or shock", "gazing at their own hands with fascination",
+    "with a soft, compassionate look in their eyes", "staring at the ground with a mix of shame and regret",
+    "with eyes twinkling with inner joy", "looking past the camera with a stoic expression"
+]
 
-    return np.random.choice(gaze_direction_list)
-
-def ger_facial_hair_description():
-    facial_hair_list = [
-        "clean-shaven", "with light stubble", "with heavy stubble",
-        "with a short, neat beard", "with a full, thick beard", "with a long, flowing beard",
-        "with a well-groomed goatee", "with a circle beard", "with a chin strap beard",
-        "with a neat mustache", "with a handlebar mustache", "with a horseshoe mustache",
-        "with mutton chops", "with friendly sideburns", "with a soul patch",
-        "with a Van Dyke beard", "with a Garibaldi beard", "with a ducktail beard",
-        "with a French fork beard", "with a Bandholz beard", "with a yeard",
-        "with a ZZ Top-style beard", "with a 5 o'clock shadow", "with designer stubble",
-        "with a pencil mustache", "with a Fu Manchu mustache", "with an imperial mustache",
-        "with a Dali mustache", "with a walrus mustache", "with a chevron mustache",
-        "with a Hollywoodian beard", "with a short boxed beard", "with a Verdi beard",
-        "with a Spartan beard", "with a Norse beard", "with a Viking-style beard",
-        "with a neatly trimmed beard", "with an unkempt beard", "with a patchy beard",
-        "with a salt-and-pepper beard", "with a graying beard", "with a shabby chic beard",
-        "with a faded beard", "with a tapered beard", "with a pointy beard",
-        "with a braided beard", "with a forked beard", "with a sculpted beard",
-        "with an Asian-style mustache", "with a handlebar-and-goatee combo",
-        "with a thin-line beard", "with a disconnected mustache",
-        "with a chin curtain beard", "with a Klingon-style beard",
-        "with a wild, untamed beard", "with a precisely lined beard",
-        "with a barely-there mustache", "with a bushy mustache",
-        "with a curled mustache", "with waxed mustache tips",
-        "with a scruffy beard", "with a lumberjack-style beard",
-        "with a hipster beard", "with an artistically trimmed beard",
-        "with a multi-colored dyed beard", "with a glitter beard",
-        "with a freestyle beard", "with a neck beard",
-        "with mutton chops connected to a mustache", "with a chin puff",
-        "with an anchor beard", "with a Balbo beard", "with a royal beard", 
-        "with a Zappa-style beard", "with a Hulihee beard",
-        "with a long goatee", "with sideburns connected to a mustache",
-        "with a mustache-free beard", "with a beard-free mustache",
-        "with a pencil-thin chin strap", "with a double mustache",
-        "with a triangle beard", "with an inverted T-shape beard",
-    ]
+facial_hair_list = [
+    "clean-shaven", "with light stubble", "with heavy stubble",
+    "with a short, neat beard", "with a full, thick beard", "with a long, flowing beard",
+    "with a well-groomed goatee", "with a circle beard", "with a chin strap beard",
+    "with a neat mustache", "with a handlebar mustache", "with a horseshoe mustache",
+    "with mutton chops", "with friendly sideburns", "with a soul patch",
+    "with a Van Dyke beard", "with a Garibaldi beard", "with a ducktail beard",
+    "with a French fork beard", "with a Bandholz beard", "with a yeard",
+    "with a ZZ Top-style beard", "with a 5 o'clock shadow", "with designer stubble",
+    "with a pencil mustache", "with a Fu Manchu mustache", "with an imperial mustache",
+    "with a Dali mustache", "with a walrus mustache", "with a chevron mustache",
+    "with a Hollywoodian beard", "with a short boxed beard", "with a Verdi beard",
+    "with a Spartan beard", "with a Norse beard", "with a Viking-style beard",
+    "with a neatly trimmed beard", "with an unkempt beard", "with a patchy beard",
+    "with a salt-and-pepper beard", "with a graying beard", "with a shabby chic beard",
+    "with a faded beard", "with a tapered beard", "with a pointy beard",
+    "with a braided beard", "with a forked beard", "with a sculpted beard",
+    "with an Asian-style mustache", "with a handlebar-and-goatee combo",
+    "with a thin-line beard", "with a disconnected mustache",
+    "with a chin curtain beard", "with a Klingon-style beard",
+    "with a wild, untamed beard", "with a precisely lined beard",
+    "with a barely-there mustache", "with a bushy mustache",
+    "with a curled mustache", "with waxed mustache tips",
+    "with a scruffy beard", "with a lumberjack-style beard",
+    "with a hipster beard", "with an artistically trimmed beard",
+    "with a multi-colored dyed beard", "with a glitter beard",
+    "with a freestyle beard", "with a neck beard",
+    "with mutton chops connected to a mustache", "with a chin puff",
+    "with an anchor beard", "with a Balbo beard", "with a royal beard", 
+    "with a Zappa-style beard", "with a Hulihee beard",
+    "with a long goatee", "with sideburns connected to a mustache",
+    "with a mustache-free beard", "with a beard-free mustache",
+    "with a pencil-thin chin strap", "with a double mustache",
+    "with a triangle beard", "with an inverted T-shape beard",
+]
 
-    return random.choice(facial_hair_list)
-
-def get_makeup_description():
-    makeup_list = [
-        "with natural, barely-there makeup", "wearing a classic red lip and winged eyeliner", "with a smoky eye and nude lips",
-        "featuring a bold cat-eye and coral lipstick", "with a fresh, dewy look and pink blush", "wearing dramatic false eyelashes and glossy lips",
-        "with a bronzed, sun-kissed glow", "featuring metallic eyeshadow and matte lips", "with a no-makeup makeup look",
-        "wearing bold, colorful eyeshadow and neutral lips", "with perfectly contoured cheekbones", "featuring glossy eyelids and a subtle lip tint",
-        "with a gothic-inspired dark lip and pale complexion", "wearing pastel eyeshadow and peach blush", "with a monochromatic makeup look in earthy tones",
-        "featuring glitter accents around the eyes", "with a bold, avant-garde makeup design", "wearing a 1950s-inspired pin-up look",
-        "with a subtle brown smoky eye and pink lips", "featuring holographic highlighter on cheekbones", "with minimal eye makeup and a bold berry lip",
-        "wearing blue mascara and orange-tinted lips", "with graphic eyeliner designs", "featuring ombre lips from dark to light",
-        "with strategically placed facial gems or rhinestones", "wearing an ethereal, fairy-like makeup look", "with a bold unibrow statement",
-        "featuring neon eyeliner accents", "with a soft, romantic rose-gold palette", "wearing dramatic stage makeup with exaggerated features",
-        "with a 1960s-inspired Twiggy lash look", "featuring bright, color-blocked eyeshadow", "with a glossy, wet-look eye makeup",
-        "wearing a subtle everyday makeup with focus on skincare", "with an edgy, punk-inspired dark eye and bright lip", 
-        "with artfully applied freckles", "wearing mermaid-inspired shimmery scales on cheekbones", "with a soft focus, blurred lip look",
-        "featuring negative space eyeliner designs", "with an airbrushed, flawless complexion", "wearing ice princess-inspired frosty tones",
-        "with a sun-striping technique using bronzer", "featuring floating crease liner", "with a soft focus hazy eye look",
-        "wearing a classic French girl inspired minimal makeup", "with deconstructed bright eyeshadow placement", "featuring a cut-crease eyeshadow technique",
-        "with an extreme contour and highlight", "wearing a watercolor-inspired soft wash of colors", "featuring a gradient lip from dark center to light edges",
-    ]
+makeup_list = [
+    "with natural, barely-there makeup", "wearing a classic red lip and winged eyeliner", "with a smoky eye and nude lips",
+    "featuring a bold cat-eye and coral lipstick", "with a fresh, dewy look and pink blush", "wearing dramatic false eyelashes and glossy lips",
+    "with a bronzed, sun-kissed glow", "featuring metallic eyeshadow and matte lips", "with a no-makeup makeup look",
+    "wearing bold, colorful eyeshadow and neutral lips", "with perfectly contoured cheekbones", "featuring glossy eyelids and a subtle lip tint",
+    "with a gothic-inspired dark lip and pale complexion", "wearing pastel eyeshadow and peach blush", "with a monochromatic makeup look in earthy tones",
+    "featuring glitter accents around the eyes", "with a bold, avant-garde makeup design", "wearing a 1950s-inspired pin-up look",
+    "with a subtle brown smoky eye and pink lips", "featuring holographic highlighter on cheekbones", "with minimal eye makeup and a bold berry lip",
+    "wearing blue mascara and orange-tinted lips", "with graphic eyeliner designs", "featuring ombre lips from dark to light",
+    "with strategically placed facial gems or rhinestones", "wearing an ethereal, fairy-like makeup look", "with a bold unibrow statement",
+    "featuring neon eyeliner accents", "with a soft, romantic rose-gold palette", "wearing dramatic stage makeup with exaggerated features",
+    "with a 1960s-inspired Twiggy lash look", "featuring bright, color-blocked eyeshadow", "with a glossy, wet-look eye makeup",
+    "wearing a subtle everyday makeup with focus on skincare", "with an edgy, punk-inspired dark eye and bright lip", 
+    "with artfully applied freckles", "wearing mermaid-inspired shimmery scales on cheekbones", "with a soft focus, blurred lip look",
+    "featuring negative space eyeliner designs", "with an airbrushed, flawless complexion", "wearing ice princess-inspired frosty tones",
+    "with a sun-striping technique using bronzer", "featuring floating crease liner", "with a soft focus hazy eye look",
+    "wearing a classic French girl inspired minimal makeup", "with deconstructed bright eyeshadow placement", "featuring a cut-crease eyeshadow technique",
+    "with an extreme contour and highlight", "wearing a watercolor-inspired soft wash of colors", "featuring a gradient lip from dark center to light edges",
+]
 
-    makeup_description = random.choice(makeup_list)
-    return makeup_description
-
-def get_location_setting_background():
-    locations_settings_backgrounds_list = [
-        "in a corn field", "in a wheat field", "in a rice field", "in a sunflower field", "in a strawberry field", 
-        "in a lavender field", "in a tulip field", "in a pumpkin patch", "in a flower garden", "in a vegetable garden",
-        "in a water garden", "in a rose garden", 'in a grass hill', 'in a grass field', 'in a grassy meadow', 'in a grassy plain',
-        "at the desert", "in the forest", "in the park", "at the garden", "at the beach", "outside in wild nature",
-        "at the lake", "outside near a mountain", "near a waterfall", "in a cherry blossom park",
-        "on a snowy mountaintop", "in a botanical garden", "on a scenic cliff", "on a tropical island", "in a secluded cave",
-        "in a vineyard", "in an orchard", "at a coral reef", "in a bamboo forest", "in an ice cave", "in a tulip field",
-        "in a pumpkin patch", "next to a scenic pond", "in a tea plantation", "in a coffee plantation", "in an olive grove",
-        "in a date palm grove", "in a mossy forest", "in a zen garden", "in a maze garden", "in a grass field",
-        "in an alpine meadow", "on a rocky mountain ridge", "in a misty mountain valley", "near a glacial lake", 
-        "in a dense tropical rainforest", "in an old-growth redwood forest", "in a misty cloud forest",
-        "in a colorful autumn deciduous forest", "in a sparse boreal forest", "near a tranquil mountain stream",
-        "in a red rock desert canyon", "among towering sand dunes", "in a rocky desert with cacti",
-        "in a salt flat desert", "in a desert oasis with palm trees", "near a coral reef", "on a pebble beach",
-        "on a rocky coastal cliff", "on a pristine white sand beach", "in a mangrove swamp",
-        "in a rolling grassland prairie", "in an African savanna", "in a wildflower-filled meadow",
-        "in a high-altitude steppe", "in a grassy wetland marsh", "near a melting glacier", "in a snowy taiga forest",
-        "on the Arctic tundra", "near an Antarctic ice shelf", "in a field of Arctic wildflowers",
-        "near an active volcano", "in a field of hardened lava", "near a bubbling mud pot",
-        "next to a steaming geyser", "in a volcanic crater lake", "in a slot canyon", "among giant boulders",
-        "on the banks of a meandering river", "near a thundering waterfall", "in a river canyon",
-        "on a misty river at dawn", "near a series of cascading rapids", "on a snow-capped mountain peak",
-        "among bizarre rock hoodoos", "in a limestone karst landscape", "near a natural stone arch",
-        "on a remote tropical island", "on a volcanic island coastline", "in a lush island jungle interior",
-        "on a windswept subarctic island", "near a fjord on a mountainous island"
-        "in a verdant tea plantation with red-clothed pickers", "in a bamboo forest with golden sunlight filtering through",
-        "in a lush rainforest with colorful tropical birds", "in a mossy ancient forest with pink cherry blossoms",
-        "in a terraced rice field with workers in conical hats", "in a topiary garden with whimsical shapes",
-        "in a dense fern gully with a small, clear stream", "in a tropical botanical garden with exotic flowers",
-        "on a golf course with white sand bunkers", "in a vineyard with purple grapes ready for harvest",
-        "in a field of tall grass with red poppies scattered throughout", "in a misty pine forest with orange mushrooms",
-        "in an English garden maze with blooming roses", "in a lush valley with a rainbow arching overhead",
-        "in a green tea field with Mount Fuji in the background", "in a traditional Peruvian weaving village",
-        "in a vast sunflower field", "on a beach with golden sand and blue water", "in a field of yellow rapeseed flowers",
-        "among fall foliage with golden leaves", "in a wheat field ready for harvest", "in a desert with golden sand dunes",
-        "in a field of yellow tulips", "surrounded by autumn birch trees with yellow leaves", "in a field of yellow daffodils",
-        "on a hillside covered in yellow wildflowers", "in a lemon grove with ripe yellow fruit", "in a field of goldenrod flowers",
-        "among yellow aspen trees in autumn", "in a field of yellow marigolds", "surrounded by yellow ginkgo trees in fall"
-        "in the village", "in the city", "at home", "on the couch", "in the livingroom", "near the fireplace",
-        "in a cosy wooden cabin", "in a ski lodge", "in a mansion", "in a villa", "in a photography studio",
-        "in a studio apartment", "in a penthouse apartment", "in Times Square, New York", "in the Red Square, Moscow",
-        "in Los Angeles", "in Hollywood", "in a Bel Air villa", "in Paris", "in San Francisco", "in London", "in New York",
-        "in Berlin", "in Tokyo", "in Chicago", "in Rome", "in Barcelona", "in Canada", "in Toronto", "in Alaska",
-        "in Antarctica", "in the office", "at a luxury hotel", "in the kitchen", "at the balcony", "in a studio",
-        "on the Great Wall of China", "in a historic castle", "at a famous landmark", "in an ancient ruin",
-        "in a modern skyscraper", "on a bustling street market", "on a charming bridge", "at a picturesque harbor",
-        "in a bustling cafe", "in a majestic palace", "in an art gallery", "in a world-famous museum", "in a theater",
-        "in a fish market", "in a clock tower", "at a lighthouse", "in an old village", "in a professional photography studio",
-        "at a historic monastery", "in an art deco building", "in a gothic cathedral", "at a scenic viewpoint",
-        "at a picturesque quarry", "next to a windmill", "at a historic fort", "in an aquarium", "in a planetarium",
-        "at a scenic dock", "on a historic ship", "in a bustling subway station", "in a busy city street", "on a yacht",
-        "in a quiet village", "in a quiet library", "in a bustling airport terminal", "in a lively sports stadium",
-        "in an elegant art gallery", "in a high-tech laboratory", "in an opulent palace", "in a cutting-edge skyscraper",
-        "in a charming bed and breakfast", "in a bustling food market", "in a historic lighthouse",
-        "in a whimsical fairy-tale inspired theme park", "at a remote Arctic research station", "on a cruise ship",
-        "in a traditional Mongolian yurt camp", "at a bustling Broadway theater", "in a serene botanical garden",
-        "next to a yellow stone wall", "next to a red brick wall", "next to a green tile wall", "next to a purple stone wall",
-        "next to a blue stone wall", "next to a white stone wall", "next to a black stone wall", "next to a brown stone wall",
-        "next to a wooden lime wall", "next to a orange brick wall", "next to a magenta stone wall", "next to a cyan stone wall",
-        "next to a wooden wall", "next to a stone wall", "next to a marble wall", "next to a brick wall",
-        "next to a glass window", "next to a yellow wall", "next to a red wall", "next to a green tile wall",
-        "next to a purple wall", "next to a yellow wooden wall", "next to an orange stone wall",
-        "next to a green stone wall", "next to a purple marble wall", "next to a blue marble wall",
-        "next to a white marble wall", "next to a black marble wall", "next to a brown tile wall",
-        "next to an ancient stone wall", "with a plain background", "with a blurred background",
-        "against a white backdrop", "against a black backdrop", "with a colorful backdrop",
-        "with a textured background", "with a gradient background", "with a bokeh effect background",
-        "at the Grand Canyon", "next to Victoria Falls", "next to Niagara Falls", "at a music festival",
-        "on a historic battlefield", "on a sailboat", "in a hot air balloon", "under the northern lights",
-        "next to a historic statue", "in a traditional tea house", "in a serene butterfly sanctuary",
-        "in an ancient underground cave system", "in a vibrant street art alley", "in a misty Scottish highland",
-        "at a futuristic vertical farm", "in a traditional Japanese onsen", "at a bustling spice market in Marrakech",
-        "in an otherworldly salt flat", "at a bioluminescent beach at night", "in a lush tropical treehouse resort",
-        "at a historic Route 66 diner", "in a neon-lit cyberpunk cityscape", "in a tranquil lavender field in Provence",
-        "in a serene Scandinavian fjord", "at a colorful hot air balloon festival",
-        "in a mystical fog-covered ancient forest", "at a cutting-edge renewable energy farm",
-        "outdoors", "indoors", "in an outdoor setting", "in a studio setting", "against an urban setting",
-        "against a nature backdrop", "against a studio background", "against a beach scene"
-        "in an old steel mill", "at a bustling shipyard", "in a modern automotive factory",
-        "at an active construction site", "in a textile manufacturing plant", "at a wind turbine farm",
-        "in a high-tech electronics assembly line", "at a busy seaport with cargo containers",
-        "in a traditional blacksmith's workshop", "at a state-of-the-art recycling facility",
-        "in a university lecture hall", "in a elementary school classroom", "at a public library reading room",
-        "in a high school science lab", "at a coding bootcamp workspace", "in a music conservatory practice room",
-        "at a culinary school kitchen", "in a medical school anatomy lab", "at an art school studio",
-        "on a professional basketball court", "at an Olympic swimming pool", "in a state-of-the-art gymnasium",
-        "on a golf course green", "at a baseball stadium dugout", "in a boxing ring corner", "on a soccer field sideline",
-        "on an athletics track stadium", "at a professional football stadium", "on a track & field course",
-        "on a tennis court baseline", "at a rock climbing wall", "in a yoga studio", "at a horse racing track",
-        "in the cockpit of a commercial airliner", "on the deck of a luxury cruise ship",
-        "at a bustling train station platform", "in the cabin of a high-speed bullet train",
-        "at a busy airport terminal", "in the back of a yellow taxi cab", "on a city bus during rush hour",
-        "in a sleek, modern subway car", "at a car rental facility", "in the control room of a cargo ship",
-        "at a colorful Holi festival celebration", "during a traditional Japanese tea ceremony",
-        "at a lively Carnival parade in Rio", "during a solemn Native American powwow",
-        "at a vibrant Chinese New Year celebration", "during a formal Western wedding ceremony",
-        "at a lively Oktoberfest beer hall", "during a traditional Indian Diwali festival",
-        "at a Mexican Day of the Dead celebration", "during a Moroccan Ramadan evening feast",
-        "in front of a large abstract mural", "surrounded by classical marble sculptures",
-        "in a glass-blowing studio mid-creation", "at a pottery wheel shaping clay",
-        "in front of a wall of colorful street art", "in a dance studio with mirrored walls",
-        "at an outdoor installation art exhibit", "in a photography darkroom", "in a marine biology research vessel", 
-        "at a bustling art gallery opening night", "in a theater prop and costume workshop",
-        "in a cutting-edge robotics laboratory", "at a particle accelerator facility", "at an archaeological dig site",
-        "in a clean room for semiconductor manufacturing", "at a radio telescope array", "in a renewable energy research center", 
-        "in a genetic research laboratory", "at a weather monitoring station", "at a space mission control center",
-    ]
+locations_settings_backgrounds_list = [
+    "in a corn field", "in a wheat field", "in a rice field", "in a sunflower field", "in a strawberry field", 
+    "in a lavender field", "in a tulip field", "in a pumpkin patch", "in a flower garden", "in a vegetable garden",
+    "in a water garden", "in a rose garden", 'in a grass hill', 'in a grass field', 'in a grassy meadow', 'in a grassy plain',
+    "at the desert", "in the forest", "in the park", "at the garden", "at the beach", "outside in wild nature",
+    "at the lake", "outside near a mountain", "near a waterfall", "in a cherry blossom park",
+    "on a snowy mountaintop", "in a botanical garden", "on a scenic cliff", "on a tropical island", "in a secluded cave",
+    "in a vineyard", "in an orchard", "at a coral reef", "in a bamboo forest", "in an ice cave", "in a tulip field",
+    "in a pumpkin patch", "next to a scenic pond", "in a tea plantation", "in a coffee plantation", "in an olive grove",
+    "in a date palm grove", "in a mossy forest", "in a zen garden", "in a maze garden", "in a grass field",
+    "in an alpine meadow", "on a rocky mountain ridge", "in a misty mountain valley", "near a glacial lake", 
+    "in a dense tropical rainforest", "in an old-growth redwood forest", "in a misty cloud forest",
+    "in a colorful autumn deciduous forest", "in a sparse boreal forest", "near a tranquil mountain stream",
+    "in a red rock desert canyon", "among towering sand dunes", "in a rocky desert with cacti",
+    "in a salt flat desert", "in a desert oasis with palm trees", "near a coral reef", "on a pebble beach",
+    "on a rocky coastal cliff", "on a pristine white sand beach", "in a mangrove swamp",
+    "in a rolling grassland prairie", "in an African savanna", "in a wildflower-filled meadow",
+    "in a high-altitude steppe", "in a grassy wetland marsh", "near a melting glacier", "in a snowy taiga forest",
+    "on the Arctic tundra", "near an Antarctic ice shelf", "in a field of Arctic wildflowers",
+    "near an active volcano", "in a field of hardened lava", "near a bubbling mud pot",
+    "next to a steaming geyser", "in a volcanic crater lake", "in a slot canyon", "among giant boulders",
+    "on the banks of a meandering river", "near a thundering waterfall", "in a river canyon",
+    "on a misty river at dawn", "near a series of cascading rapids", "on a snow-capped mountain peak",
+    "among bizarre rock hoodoos", "in a limestone karst landscape", "near a natural stone arch",
+    "on a remote tropical island", "on a volcanic island coastline", "in a lush island jungle interior",
+    "on a windswept subarctic island", "near a fjord on a mountainous island"
+    "in a verdant tea plantation with red-clothed pickers", "in a bamboo forest with golden sunlight filtering through",
+    "in a lush rainforest with colorful tropical birds", "in a mossy ancient forest with pink cherry blossoms",
+    "in a terraced rice field with workers in conical hats", "in a topiary garden with whimsical shapes",
+    "in a dense fern gully with a small, clear stream", "in a tropical botanical garden with exotic flowers",
+    "on a golf course with white sand bunkers", "in a vineyard with purple grapes ready for harvest",
+    "in a field of tall grass with red poppies scattered throughout", "in a misty pine forest with orange mushrooms",
+    "in an English garden maze with blooming roses", "in a lush valley with a rainbow arching overhead",
+    "in a green tea field with Mount Fuji in the background", "in a traditional Peruvian weaving village",
+    "in a vast sunflower field", "on a beach with golden sand and blue water", "in a field of yellow rapeseed flowers",
+    "among fall foliage with golden leaves", "in a wheat field ready for harvest", "in a desert with golden sand dunes",
+    "in a field of yellow tulips", "surrounded by autumn birch trees with yellow leaves", "in a field of yellow daffodils",
+    "on a hillside covered in yellow wildflowers", "in a lemon grove with ripe yellow fruit", "in a field of goldenrod flowers",
+    "among yellow aspen trees in autumn", "in a field of yellow marigolds", "surrounded by yellow ginkgo trees in fall"
+    "in the village", "in the city", "at home", "on the couch", "in the livingroom", "near the fireplace",
+    "in a cosy wooden cabin", "in a ski lodge", "in a mansion", "in a villa", "in a photography studio",
+    "in a studio apartment", "in a penthouse apartment", "in Times Square, New York", "in the Red Square, Moscow",
+    "in Los Angeles", "in Hollywood", "in a Bel Air villa", "in Paris", "in San Francisco", "in London", "in New York",
+    "in Berlin", "in Tokyo", "in Chicago", "in Rome", "in Barcelona", "in Canada", "in Toronto", "in Alaska",
+    "in Antarctica", "in the office", "at a luxury hotel", "in the kitchen", "at the balcony", "in a studio",
+    "on the Great Wall of China", "in a historic castle", "at a famous landmark", "in an ancient ruin",
+    "in a modern skyscraper", "on a bustling street market", "on a charming bridge", "at a picturesque harbor",
+    "in a bustling cafe", "in a majestic palace", "in an art gallery", "in a world-famous museum", "in a theater",
+    "in a fish market", "in a clock tower", "at a lighthouse", "in an old village", "in a professional photography studio",
+    "at a historic monastery", "in an art deco building", "in a gothic cathedral", "at a scenic viewpoint",
+    "at a picturesque quarry", "next to a windmill", "at a historic fort", "in an aquarium", "in a planetarium",
+    "at a scenic dock", "on a historic ship", "in a bustling subway station", "in a busy city street", "on a yacht",
+    "in a quiet village", "in a quiet library", "in a bustling airport terminal", "in a lively sports stadium",
+    "in an elegant art gallery", "in a high-tech laboratory", "in an opulent palace", "in a cutting-edge skyscraper",
+    "in a charming bed and breakfast", "in a bustling food market", "in a historic lighthouse",
+    "in a whimsical fairy-tale inspired theme park", "at a remote Arctic research station", "on a cruise ship",
+    "in a traditional Mongolian yurt camp", "at a bustling Broadway theater", "in a serene botanical garden",
+    "next to a yellow stone wall", "next to a red brick wall", "next to a green tile wall", "next to a purple stone wall",
+    "next to a blue stone wall", "next to a white stone wall", "next to a black stone wall", "next to a brown stone wall",
+    "next to a wooden lime wall", "next to a orange brick wall", "next to a magenta stone wall", "next to a cyan stone wall",
+    "next to a wooden wall", "next to a stone wall", "next to a marble wall", "next to a brick wall",
+    "next to a glass window", "next to a yellow wall", "next to a red wall", "next to a green tile wall",
+    "next to a purple wall", "next to a yellow wooden wall", "next to an orange stone wall",
+    "next to a green stone wall", "next to a purple marble wall", "next to a blue marble wall",
+    "next to a white marble wall", "next to a black marble wall", "next to a brown tile wall",
+    "next to an ancient stone wall", "with a plain background", "with a blurred background",
+    "against a white backdrop", "against a black backdrop", "with a colorful backdrop",
+    "with a textured background", "with a gradient background", "with a bokeh effect background",
+    "at the Grand Canyon", "next to Victoria Falls", "next to Niagara Falls", "at a music festival",
+    "on a historic battlefield", "on a sailboat", "in a hot air balloon", "under the northern lights",
+    "next to a historic statue", "in a traditional tea house", "in a serene butterfly sanctuary",
+    "in an ancient underground cave system", "in a vibrant street art alley", "in a misty Scottish highland",
+    "at a futuristic vertical farm", "in a traditional Japanese onsen", "at a bustling spice market in Marrakech",
+    "in an otherworldly salt flat", "at a bioluminescent beach at night", "in a lush tropical treehouse resort",
+    "at a historic Route 66 diner", "in a neon-lit cyberpunk cityscape", "in a tranquil lavender field in Provence",
+    "in a serene Scandinavian fjord", "at a colorful hot air balloon festival",
+    "in a mystical fog-covered ancient forest", "at a cutting-edge renewable energy farm",
+    "outdoors", "indoors", "in an outdoor setting", "in a studio setting", "against an urban setting",
+    "against a nature backdrop", "against a studio background", "against a beach scene"
+    "in an old steel mill", "at a bustling shipyard", "in a modern automotive factory",
+    "at an active construction site", "in a textile manufacturing plant", "at a wind turbine farm",
+    "in a high-tech electronics assembly line", "at a busy seaport with cargo containers",
+    "in a traditional blacksmith's workshop", "at a state-of-the-art recycling facility",
+    "in a university lecture hall", "in a elementary school classroom", "at a public library reading room",
+    "in a high school science lab", "at a coding bootcamp workspace", "in a music conservatory practice room",
+    "at a culinary school kitchen", "in a medical school anatomy lab", "at an art school studio",
+    "on a professional basketball court", "at an Olympic swimming pool", "in a state-of-the-art gymnasium",
+    "on a golf course green", "at a baseball stadium dugout", "in a boxing ring corner", "on a soccer field sideline",
+    "on an athletics track stadium", "at a professional football stadium", "on a track & field course",
+    "on a tennis court baseline", "at a rock climbing wall", "in a yoga studio", "at a horse racing track",
+    "in the cockpit of a commercial airliner", "on the deck of a luxury cruise ship",
+    "at a bustling train station platform", "in the cabin of a high-speed bullet train",
+    "at a busy airport terminal", "in the back of a yellow taxi cab", "on a city bus during rush hour",
+    "in a sleek, modern subway car", "at a car rental facility", "in the control room of a cargo ship",
+    "at a colorful Holi festival celebration", "during a traditional Japanese tea ceremony",
+    "at a lively Carnival parade in Rio", "during a solemn Native American powwow",
+    "at a vibrant Chinese New Year celebration", "during a formal Western wedding ceremony",
+    "at a lively Oktoberfest beer hall", "during a traditional Indian Diwali festival",
+    "at a Mexican Day of the Dead celebration", "during a Moroccan Ramadan evening feast",
+    "in front of a large abstract mural", "surrounded by classical marble sculptures",
+    "in a glass-blowing studio mid-creation", "at a pottery wheel shaping clay",
+    "in front of a wall of colorful street art", "in a dance studio with mirrored walls",
+    "at an outdoor installation art exhibit", "in a photography darkroom", "in a marine biology research vessel", 
+    "at a bustling art gallery opening night", "in a theater prop and costume workshop",
+    "in a cutting-edge robotics laboratory", "at a particle accelerator facility", "at an archaeological dig site",
+    "in a clean room for semiconductor manufacturing", "at a radio telescope array", "in a renewable energy research center", 
+    "in a genetic research laboratory", "at a weather monitoring station", "at a space mission control center",
+]
 
-    return random.choice(locations_settings_backgrounds_list)
-
-def get_skin_description(ethnicity_group=None, stereotype_prob=0.7):
-    skin_tones_by_ethnicity_dict = {
-        "European":            ["fair", "light", "pale", "ivory", "porcelain", "rosy", "peach", "cream", "alabaster", "milky", "cool beige"],
-        "Sub-Saharan African": ["dark brown", "deep brown", "chocolate", "ebony", "mahogany", "espresso", "rich brown"],
-        "Middle Eastern":      ["olive", "tan", "medium", "golden", "warm beige", "light brown", "honey"],
-        "Latin American":      ["olive", "tan", "caramel", "bronze", "golden", "medium", "coffee", "mocha"],
-        "Oceanian":            ["tan", "golden brown", "deep brown", "bronze", "copper"],
-        "Caribbean":           ["caramel", "golden brown", "deep brown", "mahogany", "cocoa"],
-        "Central Asian":       ["light", "medium", "olive", "golden", "wheat"],
-        "West Asian":          ["olive", "medium", "golden", "warm beige", "tan"],
-        "North African":       ["olive", "tan", "golden", "caramel", "light brown", "medium brown"],
-        "Scandinavian":        ["very fair", "pale", "porcelain", "ivory", "rosy"],
-        "North American":      ["fair", "light", "medium", "olive", "tan", "brown", "dark brown"],
-        "Arctic":              ["light", "fair", "golden", "ruddy"],
-        "Southeast Asian":     ["light brown", "medium brown", "tan", "golden", "caramel"],
-        "Balkan":              ["light", "medium", "olive", "golden", "tan"],
-        "Polynesian":          ["golden brown", "tan", "bronze", "deep brown"],
-        "Micronesian":         ["tan", "golden brown", "bronze", "medium brown"],
-        "Melanesian":          ["deep brown", "dark brown", "ebony", "rich brown"],
-        "Indigenous American": ["tan", "copper", "bronze", "reddish-brown", "golden brown"],
-        "Australasian":        ["fair", "tan", "golden", "deep brown", "reddish-brown"],
-        "Caucasian":           ["fair", "light", "pale", "ivory", "rosy", "peach", "beige"],
-        "East Asian":          ["light", "fair", "ivory", "warm beige", "golden", "porcelain"],
-        "South Asian":         ["tan", "caramel", "honey", "golden brown", "deep brown", "wheat", "bronze"]
-    }
+skin_tones_by_ethnicity_dict = {
+    "European":            ["fair", "light", "pale", "ivory", "porcelain", "rosy", "peach", "cream", "alabaster", "milky", "cool beige"],
+    "Sub-Saharan African": ["dark brown", "deep brown", "chocolate", "ebony", "mahogany", "espresso", "rich brown"],
+    "Middle Eastern":      ["olive", "tan", "medium", "golden", "warm beige", "light brown", "honey"],
+    "Latin American":      ["olive", "tan", "caramel", "bronze", "golden", "medium", "coffee", "mocha"],
+    "Oceanian":            ["tan", "golden brown", "deep brown", "bronze", "copper"],
+    "Caribbean":           ["caramel", "golden brown", "deep brown", "mahogany", "cocoa"],
+    "Central Asian":       ["light", "medium", "olive", "golden", "wheat"],
+    "West Asian":          ["olive", "medium", "golden", "warm beige", "tan"],
+    "North African":       ["olive", "tan", "golden", "caramel", "light brown", "medium brown"],
+    "Scandinavian":        ["very fair", "pale", "porcelain", "ivory", "rosy"],
+    "North American":      ["fair", "light", "medium", "olive", "tan", "brown", "dark brown"],
+    "Arctic":              ["light", "fair", "golden", "ruddy"],
+    "Southeast Asian":     ["light brown", "medium brown", "tan", "golden", "caramel"],
+    "Balkan":              ["light", "medium", "olive", "golden", "tan"],
+    "Polynesian":          ["golden brown", "tan", "bronze", "deep brown"],
+    "Micronesian":         ["tan", "golden brown", "bronze", "medium brown"],
+    "Melanesian":          ["deep brown", "dark brown", "ebony", "rich brown"],
+    "Indigenous American": ["tan", "copper", "bronze", "reddish-brown", "golden brown"],
+    "Australasian":        ["fair", "tan", "golden", "deep brown", "reddish-brown"],
+    "Caucasian":           ["fair", "light", "pale", "ivory", "rosy", "peach", "beige"],
+    "East Asian":          ["light", "fair", "ivory", "warm beige", "golden", "porcelain"],
+    "South Asian":         ["tan", "caramel", "honey", "golden brown", "deep brown", "wheat", "bronze"]
+}
 
-    skin_characteristics = [
-        "smooth", "soft", "silky", "velvety", "radiant", "glowing", "dewy", "matte", "textured", "porous", 
-        "freckled", "sun-kissed", "weathered", "leathery", "wrinkled", "lined", "age-spotted", "blemished", 
-        "scarred", "pockmarked", "clear", "unblemished", "youthful", "mature", "supple", "firm", "taut", 
-        "saggy", "dry", "oily", "combination", "sensitive", "rough", "calloused", "flushed", "ruddy", "pale", 
-        "sallow", "ashen", "vibrant", "luminous", "dull", "mottled", "patchy", "even-toned", "uneven", 
-        "translucent", "opaque", "porcelain-like", "alabaster-like", "bronzed", "sun-damaged", "tanned", 
-        "untanned", "sunburnt", "detailed", "detailed texture", "detailed pores", "lustrous", "healthy", 
-        "glassy", "plump", "hydrated", "moisturized", "flaky", "peeling", "bumpy", "dimpled", "velvety", 
-        "buttery", "waxy", "papery", "tight", "loose", "elastic", "toned", "polished", "raw", "chapped"
-    ]
+skin_characteristics_list = [
+    "smooth", "soft", "silky", "velvety", "radiant", "glowing", "dewy", "matte", "textured", "porous", 
+    "freckled", "sun-kissed", "weathered", "leathery", "wrinkled", "lined", "age-spotted", "blemished", 
+    "scarred", "pockmarked", "clear", "unblemished", "youthful", "mature", "supple", "firm", "taut", 
+    "saggy", "dry", "oily", "combination", "sensitive", "rough", "calloused", "flushed", "ruddy", "pale", 
+    "sallow", "ashen", "vibrant", "luminous", "dull", "mottled", "patchy", "even-toned", "uneven", 
+    "translucent", "opaque", "porcelain-like", "alabaster-like", "bronzed", "sun-damaged", "tanned", 
+    "untanned", "sunburnt", "detailed", "detailed texture", "detailed pores", "lustrous", "healthy", 
+    "glassy", "plump", "hydrated", "moisturized", "flaky", "peeling", "bumpy", "dimpled", "velvety", 
+    "buttery", "waxy", "papery", "tight", "loose", "elastic", "toned", "polished", "raw", "chapped"
+]
 
-    all_skin_tones = get_all_unique_dict_values(skin_tones_by_ethnicity_dict)
-    if ethnicity_group is None or random.random() > stereotype_prob:
-        tone = random.choice(all_skin_tones)
-    else:
-        tone = random.choice(skin_tones_by_ethnicity_dict.get(ethnicity_group, all_skin_tones))
-
-    characteristic = random.choice(skin_characteristics)
-
-    return f"{tone}, {characteristic} skin"
-
-def get_hats_and_headwear(sex_group=None, stereotype_prob=0.8):
-    hats_and_headwear_dict = {
-        "Male": [
-            "wearing a baseball cap", "with a fedora", "sporting a beanie", "with a flat cap", "wearing a turban",
-            "wearing a cowboy hat", "with a top hat", "wearing a bowler hat", "with a newsboy cap",
-            "sporting a trucker hat", "with a bucket hat", "wearing a military cap", "with a golf visor",
-            "sporting a bandana", "with a beret", "wearing a sombrero", "with a turban", "with a mexican hat",
-            "sporting a kippah", "with a fez", "wearing a ushanka", "with a porkpie hat", "with a scarf",
-            "sporting a panama hat", "with a boater hat", "wearing a deerstalker", "with a trapper hat",
-            "sporting a taqiyah", "with a tam o' shanter", "wearing a tricorn hat", "with a helmet", "with a steampunk top hat",
-            "over-ear headphones", "with an earpice", "with in-ear headphones", "with a bluetooth headset", "with a VR headset",
-        ],
-        "Female": [
-            "wearing a sun hat", "with a beret", "sporting a fascinator", "with a cloche hat", "with a traditional Chinese hair stick",
-            "wearing a pillbox hat", "with a wide-brimmed hat", "with a headband", "with a headscarf",
-            "wearing a beanie", "with a flower crown", "sporting a fedora", "with a bucket hat", "wearing a hijab",
-            "wearing a turban", "with a baseball cap", "sporting a bandana", "with a hijab", "wearing a hair wrap",
-            "wearing a veiled hat", "with a cowboy hat", "sporting a newsboy cap", "with a beret", "wearing a beaded African headwrap",
-            "wearing a knit hat", "with a visor", "sporting a bonnet", "with a tam hat", "with a scarf",
-            "wearing a cocktail hat", "with a lampshade hat", "sporting a toque", "with a furry trapper hat",
-            "over-ear headphones", "with an earpice", "with in-ear headphones", "with a bluetooth headset", "with a VR headset",
-        ],
-        "Unisex": [
-            "with a beanie", "wearing a snapback cap", "sporting a bucket hat", "with a bandana", "with a scrunchie", 
-            "with a traditional Native American headdress", "with a military beret",
-            "wearing a fedora", "with a baseball cap", "sporting a sun visor", "with a headband", "with hairpins",
-            "wearing a flat cap", "with a beret", "sporting a trucker hat", "with a cowboy hat", "with a summer scarf",
-            "wearing a knit cap", "with a military cap", "sporting a panama hat", "with a headscarf", "wearing a traditional Russian ushanka",
-            "wearing a turban", "with a boonie hat", "sporting a cadet cap", "with a helmet", "with a winter scarf", "wearing a crown",
-            "wearing a straw hat", "with a ski mask", "sporting a floppy hat", "with a trapper hat", "with decorative bobby pins",
-        ]
-    }
-    
-    all_headwear = get_all_unique_dict_values(hats_and_headwear_dict)
-    if sex_group is None or random.random() > stereotype_prob:
-        return random.choice(all_headwear)
-    else:
-        return random.choice(hats_and_headwear_dict.get(sex_group, all_headwear))
-
-def get_random_jewelry(sex_group=None, stereotype_prob=0.8):
-    jewelry_dict = {
-        "Male": [
-            "wearing a chain necklace", "with a simple ear stud", "sporting a bolo tie",
-            "with a dog tag necklace", "wearing a small hoop earring", "with a nose stud",
-            "sporting a tribal necklace", "with an eyebrow ring", "wearing a leather cord necklace",
-            "with a septum piercing", "sporting a single diamond stud", "with a small gauge ear piercing",
-            "wearing a thin gold chain", "with a curved barbell eyebrow piercing", "with a bowtie", 
-            "with multiple ear piercings", "wearing a pendant necklace", "with a helix ear piercing",
-            "with a tragus piercing", "wearing a silver chain", "sporting a shark tooth necklace",
-            "with a crystal stud earring", "sporting a tongue piercing", "with a daith piercing"
-        ],
-        "Female": [
-            "wearing hoop earrings", "with a pendant necklace", "sporting a choker", "with an eyebrow ring",
-            "with pearl earrings", "wearing a statement necklace", "with chandelier earrings",
-            "sporting a delicate chain necklace", "with a nose stud", "wearing drop earrings",
-            "with a pearl choker", "sporting multiple ear piercings", "with a septum ring",
-            "wearing a locket necklace", "with stud earrings", "sporting a bib necklace", "wearing geometric earrings",
-            "with a nose ring", "wearing tassel earrings", "with a layered necklace", "wearing climbing vine ear cuffs",
-            "sporting a crystal choker", "with ear cuffs", "wearing a cameo necklace",
-            "with a tongue piercing", "sporting dangle earrings", "with a septum clicker", "with a bowtie",
-        ],
-        "Unisex": [
-            "wearing a simple necklace", "with stud earrings", "sporting a nose ring", "with a bowtie",
-            "with a choker", "wearing a pendant", "with multiple ear piercings", "with a dermal piercing",
-            "sporting an ear cuff", "with a septum piercing", "wearing a chain necklace", 
-            "with hoop earrings", "sporting a tongue stud", "with a cartilage piercing",
-            "wearing a beaded necklace", "with a tragus piercing", "sporting a nose stud",
-            "with an industrial bar piercing", "wearing a collar necklace", "with a conch piercing",
-            "sporting a septum ring", "with dangle earrings", "wearing a torque necklace",
-            "with a labret piercing", "sporting a helix piercing", "with a rook piercing", "with a lip ring", 
-        ]
-    }
-    
-    all_jewelry = get_all_unique_dict_values(jewelry_dict)
-    if sex_group is None or random.random() > stereotype_prob:
-        return random.choice(all_jewelry)
-    else:
-        return random.choice(jewelry_dict.get(sex_group, all_jewelry))
-
-def get_weight_description():
-    weight_descriptions_list = [
-        "very slim", "slender", "lean", "willowy", "lithe", "waifish", "svelte",
-        "thin", "skinny", "gaunt", "bony", "emaciated",
-        "of average build", "with a moderate frame", "neither thin nor overweight",
-        "with a balanced physique", "of normal weight", "with a typical body type",
-        "curvy", "full-figured", "plump", "chubby", "rounded", "soft",
-        "with a bit of extra weight", "slightly heavy-set",
-        "heavyset", "portly", "stout", "corpulent", "rotund", "plush",
-        "plus-sized", "full-bodied", "generously proportioned",
-        "muscular", "athletic", "well-built", "toned", "fit", "strapping",
-        "brawny", "burly", "robust", "solid",
-        "with a unique body type", "with a distinctive physique",
-        "with an unconventional build", "with an interesting silhouette"
-    ]
-    return random.choice(weight_descriptions_list)
-
-def get_random_time_of_day():
-    times_of_day_list = [
-        'at dawn', 'at dusk', 'at twilight', 'during sunset', 'during sunrise', 'at midnight', 'at afternoon', 
-        'at late afternoon', 'at golden hour', 'at midday', 'at noon', 'at night', 'in the evening', 'in the morning', 
-        'in the afternoon', 'at the stroke of midnight', 'in the wee hours', 'at the crack of dawn', 'at high noon',
-        'during the witching hour', 'at brunch time', 'during tea time', 'at supper time', 'during happy hour',
-        'at the eleventh hour', 'during siesta time', 'at bedtime', 'at the break of day', 'during the dog days of summer',
-        'during early morning', 'during late morning', 'during early evening', 'during late evening',
-        'at cocktail hour', 'during lunchtime', 'during dinnertime', 'at the blue hour', 'at the magic hour',
-        'during rush hour', 'at daybreak', 'at sundown', 'during civil twilight', 'during nautical twilight',
-        'during astronomical twilight', 'at first light', 'at last light', 'during solar noon', 'during solar midnight'
+hats_and_headwear_dict = {
+    "Male": [
+        "wearing a baseball cap", "with a fedora", "sporting a beanie", "with a flat cap", "wearing a turban",
+        "wearing a cowboy hat", "with a top hat", "wearing a bowler hat", "with a newsboy cap",
+        "sporting a trucker hat", "with a bucket hat", "wearing a military cap", "with a golf visor",
+        "sporting a bandana", "with a beret", "wearing a sombrero", "with a turban", "with a mexican hat",
+        "sporting a kippah", "with a fez", "wearing a ushanka", "with a porkpie hat", "with a scarf",
+        "sporting a panama hat", "with a boater hat", "wearing a deerstalker", "with a trapper hat",
+        "sporting a taqiyah", "with a tam o' shanter", "wearing a tricorn hat", "with a helmet", "with a steampunk top hat",
+        "over-ear headphones", "with an earpice", "with in-ear headphones", "with a bluetooth headset", "with a VR headset",
+    ],
+    "Female": [
+        "wearing a sun hat", "with a beret", "sporting a fascinator", "with a cloche hat", "with a traditional Chinese hair stick",
+        "wearing a pillbox hat", "with a wide-brimmed hat", "with a headband", "with a headscarf",
+        "wearing a beanie", "with a flower crown", "sporting a fedora", "with a bucket hat", "wearing a hijab",
+        "wearing a turban", "with a baseball cap", "sporting a bandana", "with a hijab", "wearing a hair wrap",
+        "wearing a veiled hat", "with a cowboy hat", "sporting a newsboy cap", "with a beret", "wearing a beaded African headwrap",
+        "wearing a knit hat", "with a visor", "sporting a bonnet", "with a tam hat", "with a scarf",
+        "wearing a cocktail hat", "with a lampshade hat", "sporting a toque", "with a furry trapper hat",
+        "over-ear headphones", "with an earpice", "with in-ear headphones", "with a bluetooth headset", "with a VR headset",
+    ],
+    "Unisex": [
+        "with a beanie", "wearing a snapback cap", "sporting a bucket hat", "with a bandana", "with a scrunchie", 
+        "with a traditional Native American headdress", "with a military beret",
+        "wearing a fedora", "with a baseball cap", "sporting a sun visor", "with a headband", "with hairpins",
+        "wearing a flat cap", "with a beret", "sporting a trucker hat", "with a cowboy hat", "with a summer scarf",
+        "wearing a knit cap", "with a military cap", "sporting a panama hat", "with a headscarf", "wearing a traditional Russian ushanka",
+        "wearing a turban", "with a boonie hat", "sporting a cadet cap", "with a helmet", "with a winter scarf", "wearing a crown",
+        "wearing a straw hat", "with a ski mask", "sporting a floppy hat", "with a trapper hat", "with decorative bobby pins",
     ]
-    time_of_day = np.random.choice(times_of_day_list)
-    return time_of_day
-
-def get_random_weather_condition():
-    weather_conditions_list = [
-        'while its raining', 'while its snowing', 'when scorching hot', 'in perfect weather',
-        'during a thunderstorm', 'during a heatwave', 'during a cold snap', 'during a drizzle', 'during a hailstorm',
-        'during a sandstorm', 'during a snowstorm', 'during a windstorm', 'during a foggy day', 'during a cloudy day',
-        'during a sunny day', 'during an overcast day', 'during a monsoon', 'during a hurricane', 'during a tornado',
-        'during a blizzard', 'during an earthquake', 'during a solar eclipse', 'during a lunar eclipse', 'during a meteor shower',
-        'during high tide', 'during low tide', 'during a rainbow', 'during a flood', 'during a drought',
-        'during a wildfire', 'during a volcanic eruption', 'during an avalanche', 'during a cyclone', 'during a typhoon',
-        'during an ice storm', 'during a misty morning', 'during a humid afternoon', 'during a dry evening', 'during a muggy night'
-    ]
-    weather_condition = np.random.choice(weather_conditions_list)
-    return weather_condition
-
-def get_eye_description(ethnicity_group=None, stereotype_prob=0.3):
-
-    all_eye_colors = get_all_unique_dict_values(eye_colors_dict)
-    if ethnicity_group is None or np.random.rand() > stereotype_prob:
-        eye_colors_list = all_eye_colors
-    else:
-        eye_colors_list = eye_colors_dict.get(ethnicity_group, all_eye_colors)
-
-    color = random.choice(eye_colors_list)
-
-    eye_styles_list = [
-        "Captivating {color} eyes", "{color} eyes lost in thought", "Piercing {color} eyes", 'huge {color} eyes',
-        "Striking {color} eyes", "{color} eyes, large and expressive", "Small {color} eyes", 'large {color} eyes',
-        "Inviting {color} eyes", "{color} eyes, wide open", "Closed, {color} eyes", "Sparkling {color} eyes",
-        "Twinkling {color} eyes", "plain {color} eyes", "Regular {color} eyes", "Mysterious {color} eyes",
-        "Expressive {color} eyes", "Glistening {color} eyes", "Luminous {color} eyes", "Focused {color} eyes",
-        "Dreamy {color} eyes", "intense {color} eyes", "Gentle {color} eyes", "Curious {color} eyes", 'large striking {color} eyes',
-        "Alluring {color} eyes", "haunting {color} eyes", "Innocent {color} eyes", "Hypnotic {color} eyes",
-        "Mesmerizing {color} eyes", "animated {color} eyes", "Sleepy {color} eyes", "Observant {color} eyes",
-        "deep set {color} eyes", "bulging {color} eyes", "Hooded, {color} eyes", "Almond shaped, {color} eyes",
-        "round {color} eyes", "wide {color} eyes", "Narrow, {color} eyes", "Cat-like {color} eyes",
-        "winking {color} eyes", "dilated pupil, {color} eyes", "{color} eyes with an enigmatic hue", 'deep {color} eyes',
-        "{color} eyes radiating vibrant light", "{color} eyes deep in introspection", "{color} eyes resolute and firm",
-        "{color} eyes reflecting a whimsical sparkle", "{color} eyes sorrowful and deep", 
-        "{color} eyes brimming with joy", "{color} eyes in a contemplative state", 
-        "{color} eyes emanating serenity", "{color} eyes ablaze with intensity"
+}
+
+jewelry_dict = {
+    "Male": [
+        "wearing a chain necklace", "with a simple ear stud", "sporting a bolo tie",
+        "with a dog tag necklace", "wearing a small hoop earring", "with a nose stud",
+        "sporting a tribal necklace", "with an eyebrow ring", "wearing a leather cord necklace",
+        "with a septum piercing", "sporting a single diamond stud", "with a small gauge ear piercing",
+        "wearing a thin gold chain", "with a curved barbell eyebrow piercing", "with a bowtie", 
+        "with multiple ear piercings", "wearing a pendant necklace", "with a helix ear piercing",
+        "with a tragus piercing", "wearing a silver chain", "sporting a shark tooth necklace",
+        "with a crystal stud earring", "sporting a tongue piercing", "with a daith piercing"
+    ],
+    "Female": [
+        "wearing hoop earrings", "with a pendant necklace", "sporting a choker", "with an eyebrow ring",
+        "with pearl earrings", "wearing a statement necklace", "with chandelier earrings",
+        "sporting a delicate chain necklace", "with a nose stud", "wearing drop earrings",
+        "with a pearl choker", "sporting multiple ear piercings", "with a septum ring",
+        "wearing a locket necklace", "with stud earrings", "sporting a bib necklace", "wearing geometric earrings",
+        "with a nose ring", "wearing tassel earrings", "with a layered necklace", "wearing climbing vine ear cuffs",
+        "sporting a crystal choker", "with ear cuffs", "wearing a cameo necklace",
+        "with a tongue piercing", "sporting dangle earrings", "with a septum clicker", "with a bowtie",
+    ],
+    "Unisex": [
+        "wearing a simple necklace", "with stud earrings", "sporting a nose ring", "with a bowtie",
+        "with a choker", "wearing a pendant", "with multiple ear piercings", "with a dermal piercing",
+        "sporting an ear cuff", "with a septum piercing", "wearing a chain necklace", 
+        "with hoop earrings", "sporting a tongue stud", "with a cartilage piercing",
+        "wearing a beaded necklace", "with a tragus piercing", "sporting a nose stud",
+        "with an industrial bar piercing", "wearing a collar necklace", "with a conch piercing",
+        "sporting a septum ring", "with dangle earrings", "wearing a torque necklace",
+        "with a labret piercing", "sporting a helix piercing", "with a rook piercing", "with a lip ring", 
     ]
+}
 
-    eye_style = random.choice(eye_styles_list)
-    eye_description = eye_style.format(color=color)
+weight_descriptions_list = [
+    "very slim", "slender", "lean", "willowy", "lithe", "waifish", "svelte",
+    "thin", "skinny", "gaunt", "bony", "emaciated",
+    "of average build", "with a moderate frame", "neither thin nor overweight",
+    "with a balanced physique", "of normal weight", "with a typical body type",
+    "curvy", "full-figured", "plump", "chubby", "rounded", "soft",
+    "with a bit of extra weight", "slightly heavy-set",
+    "heavyset", "portly", "stout", "corpulent", "rotund", "plush",
+    "plus-sized", "full-bodied", "generously proportioned",
+    "muscular", "athletic", "well-built", "toned", "fit", "strapping",
+    "brawny", "burly", "robust", "solid",
+    "with a unique body type", "with a distinctive physique",
+    "with an unconventional build", "with an interesting silhouette"
+]
 
-    return eye_description
+times_of_day_list = [
+    'at dawn', 'at dusk', 'at twilight', 'during sunset', 'during sunrise', 'at midnight', 'at afternoon', 
+    'at late afternoon', 'at golden hour', 'at midday', 'at noon', 'at night', 'in the evening', 'in the morning', 
+    'in the afternoon', 'at the stroke of midnight', 'in the wee hours', 'at the crack of dawn', 'at high noon',
+    'during the witching hour', 'at brunch time', 'during tea time', 'at supper time', 'during happy hour',
+    'at the eleventh hour', 'during siesta time', 'at bedtime', 'at the break of day', 'during the dog days of summer',
+    'during early morning', 'during late morning', 'during early evening', 'during late evening',
+    'at cocktail hour', 'during lunchtime', 'during dinnertime', 'at the blue hour', 'at the magic hour',
+    'during rush hour', 'at daybreak', 'at sundown', 'during civil twilight', 'during nautical twilight',
+    'during astronomical twilight', 'at first light', 'at last light', 'during solar noon', 'during solar midnight'
+]
 
-def get_clothing_description(sex_group=None, sterotype_prob=0.6):
+weather_conditions_list = [
+    'while its raining', 'while its snowing', 'when scorching hot', 'in perfect weather',
+    'during a thunderstorm', 'during a heatwave', 'during a cold snap', 'during a drizzle', 'during a hailstorm',
+    'during a sandstorm', 'during a snowstorm', 'during a windstorm', 'during a foggy day', 'during a cloudy day',
+    'during a sunny day', 'during an overcast day', 'during a monsoon', 'during a hurricane', 'during a tornado',
+    'during a blizzard', 'during an earthquake', 'during a solar eclipse', 'during a lunar eclipse', 'during a meteor shower',
+    'during high tide', 'during low tide', 'during a rainbow', 'during a flood', 'during a drought',
+    'during a wildfire', 'during a volcanic eruption', 'during an avalanche', 'during a cyclone', 'during a typhoon',
+    'during an ice storm', 'during a misty morning', 'during a humid afternoon', 'during a dry evening', 'during a muggy night'
+]
 
-    clothing_color_list = random.choice([
-        "red", "blue", "green", "yellow", "purple", "pink", "orange",
-        "black", "white", "gray", "brown", "navy", "teal", "maroon", "olive",
-        "beige", "turquoise", "lavender", "crimson", "indigo", "magenta",
-        "chartreuse", "burgundy", "periwinkle", "coral", "mustard", "plum",
-        "khaki", "mauve", "salmon", "mint", "gold", "silver", "bronze",
-        "copper", "platinum", "pastel pink", "pastel blue", "pastel green",
-        "pastel yellow", "pastel purple", "emerald", "sapphire", "ruby",
-        "amethyst", "topaz", "garnet", "ivory", "cream", "tan", "taupe",
-        "charcoal", "slate"
-    ])
+eye_styles_list = [
+    "Captivating {color} eyes", "{color} eyes lost in thought", "Piercing {color} eyes", 'huge {color} eyes',
+    "Striking {color} eyes", "{color} eyes, large and expressive", "Small {color} eyes", 'large {color} eyes',
+    "Inviting {color} eyes", "{color} eyes, wide open", "Closed, {color} eyes", "Sparkling {color} eyes",
+    "Twinkling {color} eyes", "plain {color} eyes", "Regular {color} eyes", "Mysterious {color} eyes",
+    "Expressive {color} eyes", "Glistening {color} eyes", "Luminous {color} eyes", "Focused {color} eyes",
+    "Dreamy {color} eyes", "intense {color} eyes", "Gentle {color} eyes", "Curious {color} eyes", 'large striking {color} eyes',
+    "Alluring {color} eyes", "haunting {color} eyes", "Innocent {color} eyes", "Hypnotic {color} eyes",
+    "Mesmerizing {color} eyes", "animated {color} eyes", "Sleepy {color} eyes", "Observant {color} eyes",
+    "deep set {color} eyes", "bulging {color} eyes", "Hooded, {color} eyes", "Almond shaped, {color} eyes",
+    "round {color} eyes", "wide {color} eyes", "Narrow, {color} eyes", "Cat-like {color} eyes",
+    "winking {color} eyes", "dilated pupil, {color} eyes", "{color} eyes with an enigmatic hue", 'deep {color} eyes',
+    "{color} eyes radiating vibrant light", "{color} eyes deep in introspection", "{color} eyes resolute and firm",
+    "{color} eyes reflecting a whimsical sparkle", "{color} eyes sorrowful and deep", 
+    "{color} eyes brimming with joy", "{color} eyes in a contemplative state", 
+    "{color} eyes emanating serenity", "{color} eyes ablaze with intensity"
+]
 
-    clothing_patterns_list = [
-        "striped", "polka dot", "floral", "plaid", "checkered", "paisley",
-        "herringbone", "houndstooth", "geometric pattern"
-    ]
+clothing_colors_list = [
+    "red", "blue", "green", "yellow", "purple", "pink", "orange",
+    "black", "white", "gray", "brown", "navy", "teal", "maroon", "olive",
+    "beige", "turquoise", "lavender", "crimson", "indigo", "magenta",
+    "chartreuse", "burgundy", "periwinkle", "coral", "mustard", "plum",
+    "khaki", "mauve", "salmon", "mint", "gold", "silver", "bronze",
+    "copper", "platinum", "pastel pink", "pastel blue", "pastel green",
+    "pastel yellow", "pastel purple", "emerald", "sapphire", "ruby",
+    "amethyst", "topaz", "garnet", "ivory", "cream", "tan", "taupe",
+    "charcoal", "slate"
+]
 
-    clothing_types_dict = {
-        "casual": {
-            "neutral": ["t-shirt", "jeans", "sweater", "hoodie", "shorts", "tracksuit"],
-            "male": ["polo shirt"],
-            "female": ["leggings", "yoga pants", "tank top"]
-        },
-        "formal": {
-            "neutral": ["suit"],
-            "male": ["tuxedo", "dress shirt", "tie"],
-            "female": ["cocktail dress", "evening gown", "blouse", "pencil skirt"]
-        },
-        "professional": {
-            "neutral": ["business suit", "slacks"],
-            "male": ["necktie"],
-            "female": ["pantsuit", "blouse", "knee-length skirt"]
-        },
-        "outerwear": {
-            "neutral": ["jacket", "coat", "trench coat", "parka", "windbreaker", "peacoat", "leather jacket", "denim jacket", "bomber jacket"]
-        },
-        "dresses_skirts": {
-            "female": ["sundress", "maxi dress", "mini skirt", "midi skirt", "wrap dress", "shirt dress", "A-line dress", "pleated skirt", "tulle skirt"],
-            "male": ["scottish kilt", "togas"]
-        },
-        "ethnic": {
-            "neutral": ["kaftan", "poncho", "tunic"],
-            "male": ["kurta", "sherwani", "kilt", "lederhosen"],
-            "female": ["sari", "cheongsam", "dirndl", "ao dai", "hanbok", "qipao", "yukata"]
-        },
-        "uniform": {
-            "neutral": ["military uniform", "police uniform", "firefighter uniform", "doctor's white coat", "chef's uniform", "pilot's uniform", "nurse's scrubs", "judge's robe", "academic regalia"]
-        },
-        "sports": {
-            "neutral": ["soccer jersey", "basketball uniform", "tennis whites", "cycling gear", "martial arts gi"],
-            "female": ["leotard", "gymnast outfit", "yoga attire"]
-        },
-        "workwear": {
-            "neutral": ["overalls", "coveralls", "high-visibility vest", "lab coat", "welder's protective gear"]
-        },
-        "unique": {
-            "neutral": ["avant-garde designer piece", "futuristic bodysuit", "steampunk-inspired outfit", "cyberpunk ensemble"]
-        },
-        "historical": {
-            "neutral": ["Renaissance costume"],
-            "male": ["Victorian-era suit", "1920s gangster style"],
-            "female": ["Victorian-era dress", "1920s flapper style", "1950s rockabilly fashion"]
-        },
-        "religious": {
-            "neutral": ["ceremonial tribal wear", "traditional wedding attire"],
-            "male": ["monk's robe"],
-            "female": ["nun's habit"]
-        }
+clothing_patterns_list = [
+    "striped", "polka dot", "floral", "plaid", "checkered", "paisley",
+    "herringbone", "houndstooth", "geometric pattern"
+]
+
+clothing_types_dict = {
+    "casual": {
+        "neutral": ["t-shirt", "jeans", "sweater", "hoodie", "shorts", "tracksuit"],
+        "male": ["polo shirt"],
+        "female": ["leggings", "yoga pants", "tank top"]
+    },
+    "formal": {
+        "neutral": ["suit"],
+        "male": ["tuxedo", "dress shirt", "tie"],
+        "female": ["cocktail dress", "evening gown", "blouse", "pencil skirt"]
+    },
+    "professional": {
+        "neutral": ["business suit", "slacks"],
+        "male": ["necktie"],
+        "female": ["pantsuit", "blouse", "knee-length skirt"]
+    },
+    "outerwear": {
+        "neutral": ["jacket", "coat", "trench coat", "parka", "windbreaker", "peacoat", "leather jacket", "denim jacket", "bomber jacket"]
+    },
+    "dresses_skirts": {
+        "female": ["sundress", "maxi dress", "mini skirt", "midi skirt", "wrap dress", "shirt dress", "A-line dress", "pleated skirt", "tulle skirt"],
+        "male": ["scottish kilt", "togas"]
+    },
+    "ethnic": {
+        "neutral": ["kaftan", "poncho", "tunic"],
+        "male": ["kurta", "sherwani", "kilt", "lederhosen"],
+        "female": ["sari", "cheongsam", "dirndl", "ao dai", "hanbok", "qipao", "yukata"]
+    },
+    "uniform": {
+        "neutral": ["military uniform", "police uniform", "firefighter uniform", "doctor's white coat", "chef's uniform", "pilot's uniform", "nurse's scrubs", "judge's robe", "academic regalia"]
+    },
+    "sports": {
+        "neutral": ["soccer jersey", "basketball uniform", "tennis whites", "cycling gear", "martial arts gi"],
+        "female": ["leotard", "gymnast outfit", "yoga attire"]
+    },
+    "workwear": {
+        "neutral": ["overalls", "coveralls", "high-visibility vest", "lab coat", "welder's protective gear"]
+    },
+    "unique": {
+        "neutral": ["avant-garde designer piece", "futuristic bodysuit", "steampunk-inspired outfit", "cyberpunk ensemble"]
+    },
+    "historical": {
+        "neutral": ["Renaissance costume"],
+        "male": ["Victorian-era suit", "1920s gangster style"],
+        "female": ["Victorian-era dress", "1920s flapper style", "1950s rockabilly fashion"]
+    },
+    "religious": {
+        "neutral": ["ceremonial tribal wear", "traditional wedding attire"],
+        "male": ["monk's robe"],
+        "female": ["nun's habit"]
     }
+}
 
-    if sex_group is None or np.random.rand() > sterotype_prob:
-        sex_group = random.choice(['male', 'female', 'neutral'])
+modifier_options_list = [
+    (0.2, ['wearing traditional attire, ']),
+    (0.1, ['casual pose, ']),
+    (0.3, ['photography, ', 'professional photography, ', 'photorealism, ', 'ultrarealistic uhd faces, ']),
+    (0.2, ['hyper realism, ',  'realistic, ', 'ultra realistic, ',
+           'highly detailed, ', 'very detailed, ', 'hyper detailed, ', 'detailed, ']),
+    (0.6, ['detailed skin, ', 'detailed skin texture, ', 'detailed skin pores, ']),
+    (0.5, ['bokeh, ']),
+    (0.5, ['film, ', 'still from a film, ', 'raw candid cinema, ', 'cinematic movie still, ']),
+    (0.2, ['head shot, ', 'medium shot, ', 'wide shot, ', 'zoomed out, ']),
+    (0.2, ['triadic color scheme, ', 'vivid color, ', 'remarkable color, ', 'color graded, ']),
+    (0.5, ['studio lighting, ', 'volumetric lighting, ', 'subsurface scatter, ', 'natural light, ', 'soft light, ', 'hard light, ',
+           'atmospheric lighting, ', 'cinematic lighting, ', 'dramatic lighting, ', 'hard rim lighting photography, ']),
+    (0.3, ['4k, ', '8k, ', 'uhd, ', 'ultra hd, ', 'high quality, ', 'HDR, ']),
+    (0.3, ['nikon d850, ', 'kodachrome 25, ', 'kodak ultra max 800, ', 'kodak portra 160, ', 'DSLR camera, ',
+           'canon eos r3, ', 'Ilford HP5 400, ', 'samsung nx300m, ', 'sony a6000, ', 'olympus om-d, ',
+           'panasonic lumix dmc-gx85, ', 'fujifilm x70, ', 'canon eos, ', 'color graded porta 400 film, ']),
+    (0.1, ['120mm, ', '85mm, ', '50mm, ', '35mm, ']),
+    (0.1, ['f/1.4, ', 'f/2.5, ', 'f/3.2, ', 'f/1.1, ']),
+    (0.1, ['35mm film roll photo, ', 'film, ', 'porta 400 film, ']),
+    (0.1, ['iso 120, ', 'iso 210, ']),
+    (0.1, ['wide lens, ', 'lens flare, ', 'sharp focus, ', 'hasselblad, ']),
+    (0.3, ['alluring, ', 'beautiful, ', 'breath-taking, ', 'captivating, ', 'addorable, ', 'intricate, ',
+           'chic, ', 'classy, ', 'curvaceous, ', 'breath-cute, ', 'fashionable, ', 'elegant, ',
+           'gorgeous, ', 'graceful, ', 'lovely, ', 'mesmerizing, ', 'petite, ', 'pretty, ', 'tall, ',
+           'radiant, ', 'ravishing, ', 'slim, ', 'stunning, ', 'stylish, ', 'sultry, ', 'sweet, ',
+           'affectionate, ', 'ardent, ', 'articulate, ', 'at ease, ', 'attentive, ', 'awake, ',
+           'aware, ', 'boyish, ', 'brave, ', 'broad-shouldered, ', 'calm, ', 'voluptuous, ',
+           'caring, ', 'centered, ', 'charming, ', 'chiseled cheekbones, ', 'sharp features, ',
+           'classic good looks, ', 'clean-shaven, ', 'clever, ', 'compassionate, ', 'candid, ', 'attractive, ',
+           'confident, ', 'conscious, ', 'considerate, ', 'content, ', 'cosmopolitan, ',
+           'courageous, ', 'courteous, ', 'cultured, ', 'dark skin, ', 'dashing, ',
+           'debonair, ', 'defined jawline, ', 'devoted, ', 'educated, ', 'eloquent, ',
+           'faithful, ', 'fearless, ', 'firm skin, ', 'focused, ', 'full lips, ',
+           'fully engaged, ', 'gentle, ', 'glowing skin, ', 'grounded, ', 'handsome, ',
+           'handsome features, ', 'in the moment, ', 'insightful, ', 'intelligent, ',
+           'intense, ', 'kind, ', 'loyal, ', 'mannerly, ', 'mischievous, ', 'muscular, ',
+           'olive skin, ', 'passionate, ', 'peaceful, ', 'polite, ', 'porcelain skin, ',
+           'present, ', 'refined, ', 'reliable, ', 'rugged, ', 'secure, ', 'self assured, ',
+           'sensitive, ', 'serene, ', 'smooth skin, ', 'soft skin, ', 'sophisticated, ',
+           'square-jawed, ', 'stable, ', 'strong, ', 'strong chin, ', 'suave, ',
+           'sun kissed skin, ', 'thick, ', 'trustworthy, ', 'twinkling eyes, ', 'urbane, ',
+           'well mannered, ', 'well spoken, ', 'well traveled, ', 'well-built, ', 'witty, ', 'worldly, ']),
+    (0.2, ['subtle shadows, ', 'shadow, ']),
+    (0.05, ['mist, ', 'wet, ', 'foggy background, ']),
+    (0.05, ['golden ratio composition, ']),
+    (0.05, ['dramatic, ']),
+    (0.05, ['award winning photograph, ']),
+    (0.05, ['epic composition, ']),
+    (0.05, ['pexels, ']),
+    (0.05, ['high contrast, ']),
+]
 
-    assert sex_group in ['male', 'female', 'neutral']
+age_groups_dict = {
+    "baby": (1, 18),          # 1-18 months
+    "toddler": (1, 4),        # 1-4 years
+    "child": (4, 12),         # 4-12 years
+    "teenager": (13, 19),     # 13-19 years
+    "young adult": (18, 38),  # 18-38 years
+    "middle-aged": (30, 55),  # 30-55 years
+    "elderly": (50, 100)      # 50-100 years
+}
 
-    clothing_category = random.choice(list(clothing_types_dict.keys()))
-    all_clothing_category_items = get_all_unique_dict_values(clothing_types_dict[clothing_category])
-    clothing_items_list = clothing_types_dict[clothing_category].get(sex_group, all_clothing_category_items)
-    if sex_group in ['male', 'female']:
-        clothing_items_list += clothing_types_dict[clothing_category].get('neutral', all_clothing_category_items)
-    
-    clothing_item = random.choice(clothing_items_list)
-    clothing_color = random.choice(clothing_color_list)
+# probability of each age group when it is not provided to generate_face_prompt
+age_group_probs_dict = {
+    'baby': 0.05, 'toddler': 0.05, 'child': 0.05, 'teenager': 0.2,
+    'young adult': 0.2, 'middle-aged': 0.2, 'elderly': 0.25
+}
 
-    if clothing_category in ["casual", "formal", "professional", "outerwear", "dresses_skirts"]:
-        if random.random() < 0.2:
-            pattern = random.choice(clothing_patterns_list)
-            clothing_str = f"wearing a {pattern} {clothing_item}"
-        else:
-            clothing_str = f"wearing a {clothing_color} {clothing_item}"
-    elif clothing_category in ["ethnic", "unique", "historical"]:
-        clothing_str = f"dressed in {clothing_item}"
-    elif clothing_category in ["uniform", "sports", "workwear", "religious"]:
-        clothing_str = f"in {clothing_item}"
-    else:
-        clothing_str = f"wearing {clothing_item}"
-
-    # if we are not using a stereotype, we can mix and match clothing items from different categories
-    if np.random.rand() > sterotype_prob:
-        clothing_items_list = [item for sublist in clothing_types_dict[clothing_category].values() for item in sublist]
-        clothing_str = f"wearing {random.choice(clothing_items_list)}"
-        return clothing_str
+adult_sex_words_dict = {
+    'young adult': {
+        'male': ['man', 'guy', 'person', 'male', 'brother'],
+        'female': ['woman', 'dame', 'lady', 'female', 'sister'],
+    },
+    'middle-aged': {
+        'male': ['man', 'guy', 'husband', 'person', 'male', 'father', 'gentleman'],
+        'female': ['woman', 'dame', 'wife', 'lady', 'female', 'mother', 'gentlewoman'],
+    },
+    'elderly': {
+        'male': ['man', 'grandfather', 'grandpa', 'person', 'father', 'husband', 'gentleman'],
+        'female': ['woman', 'grandmother', 'grandma', 'lady', 'mother', 'wife', 'gentlewoman'],
+    },
+}
+
+adult_age_qualifiers_dict = {'young adult': 'young', 'middle-aged': 'middle-aged', 'elderly': 'elderly'}
 
-    return clothing_str
-
-def get_random_modifier_string():
-
-    modifier_str = ''
-    if np.random.rand() < 0.2:
-        modifier_str = modifier_str + 'wearing traditional attire, '
-    if np.random.rand() < 0.1:
-        modifier_str = modifier_str + 'casual pose, '
-    if np.random.rand() < 0.3:
-        modifier_str = modifier_str + np.random.choice(['photography, ', 'professional photography, ', 'photorealism, ', 'ultrarealistic uhd faces, '])
-    if np.random.rand() < 0.2:
-        modifier_str = modifier_str + np.random.choice(['hyper realism, ',  'realistic, ', 'ultra realistic, ',
-                                                        'highly detailed, ', 'very detailed, ', 'hyper detailed, ', 'detailed, '])
-    if np.random.rand() < 0.6:
-        modifier_str = modifier_str + np.random.choice(['detailed skin, ', 'detailed skin texture, ', 'detailed skin pores, '])
-    if np.random.rand() < 0.5:
-        modifier_str = modifier_str + 'bokeh, '
-    if np.random.rand() < 0.5:
-        modifier_str = modifier_str + np.random.choice(['film, ', 'still from a film, ', 'raw candid cinema, ', 'cinematic movie still, '])
-    if np.random.rand() < 0.2:
-        modifier_str = modifier_str + np.random.choice(['head shot, ', 'medium shot, ', 'wide shot, ', 'zoomed out, '])
-    if np.random.rand() < 0.2:
-        modifier_str = modifier_str + np.random.choice(['triadic color scheme, ', 'vivid color, ', 'remarkable color, ', 'color graded, '])
-    if np.random.rand() < 0.5:
-        modifier_str = modifier_str + np.random.choice(['studio lighting, ', 'volumetric lighting, ', 'subsurface scatter, ', 'natural light, ', 'soft light, ', 'hard light, ',
-                                                        'atmospheric lighting, ', 'cinematic lighting, ', 'dramatic lighting, ', 'hard rim lighting photography, '])
-    if np.random.rand() < 0.3:
-        modifier_str = modifier_str + np.random.choice(['4k, ', '8k, ', 'uhd, ', 'ultra hd, ', 'high quality, ', 'HDR, '])
-    if np.random.rand() < 0.3:
-        modifier_str = modifier_str + np.random.choice(['nikon d850, ', 'kodachrome 25, ', 'kodak ultra max 800, ', 'kodak portra 160, ', 'DSLR camera, ',
-                                                        'canon eos r3, ', 'Ilford HP5 400, ', 'samsung nx300m, ', 'sony a6000, ', 'olympus om-d, ',
-                                                        'panasonic lumix dmc-gx85, ', 'fujifilm x70, ', 'canon eos, ', 'color graded porta 400 film, '])
-    if np.random.rand() < 0.1:
-        modifier_str = modifier_str + np.random.choice(['120mm, ', '85mm, ', '50mm, ', '35mm, '])
-    if np.random.rand() < 0.1:
-        modifier_str = modifier_str + np.random.choice(['f/1.4, ', 'f/2.5, ', 'f/3.2, ', 'f/1.1, '])
-    if np.random.rand() < 0.1:
-        modifier_str = modifier_str + np.random.choice(['35mm film roll photo, ', 'film, ', 'porta 400 film, '])
-    if np.random.rand() < 0.1:
-        modifier_str = modifier_str + np.random.choice(['iso 120, ', 'iso 210, '])
-    if np.random.rand() < 0.1:
-        modifier_str = modifier_str + np.random.choice(['wide lens, ', 'lens flare, ', 'sharp focus, ', 'hasselblad, '])
-    if np.random.rand() < 0.3:
-        modifier_str = modifier_str + np.random.choice(['alluring, ', 'beautiful, ', 'breath-taking, ', 'captivating, ', 'addorable, ', 'intricate, ',
-                                                        'chic, ', 'classy, ', 'curvaceous, ', 'breath-cute, ', 'fashionable, ', 'elegant, ',
-                                                        'gorgeous, ', 'graceful, ', 'lovely, ', 'mesmerizing, ', 'petite, ', 'pretty, ', 'tall, ',
-                                                        'radiant, ', 'ravishing, ', 'slim, ', 'stunning, ', 'stylish, ', 'sultry, ', 'sweet, ',
-                                                        'affectionate, ', 'ardent, ', 'articulate, ', 'at ease, ', 'attentive, ', 'awake, ',
-                                                        'aware, ', 'boyish, ', 'brave, ', 'broad-shouldered, ', 'calm, ', 'voluptuous, ',
-                                                        'caring, ', 'centered, ', 'charming, ', 'chiseled cheekbones, ', 'sharp features, ',
-                                                        'classic good looks, ', 'clean-shaven, ', 'clever, ', 'compassionate, ', 'candid, ', 'attractive, ',
-                                                        'confident, ', 'conscious, ', 'considerate, ', 'content, ', 'cosmopolitan, ',
-                                                        'courageous, ', 'courteous, ', 'cultured, ', 'dark skin, ', 'dashing, ',
-                                                        'debonair, ', 'defined jawline, ', 'devoted, ', 'educated, ', 'eloquent, ',
-                                                        'faithful, ', 'fearless, ', 'firm skin, ', 'focused, ', 'full lips, ',
-                                                        'fully engaged, ', 'gentle, ', 'glowing skin, ', 'grounded, ', 'handsome, ',
-                                                        'handsome features, ', 'in the moment, ', 'insightful, ', 'intelligent, ',
-                                                        'intense, ', 'kind, ', 'loyal, ', 'mannerly, ', 'mischievous, ', 'muscular, ',
-                                                        'olive skin, ', 'passionate, ', 'peaceful, ', 'polite, ', 'porcelain skin, ',
-                                                        'present, ', 'refined, ', 'reliable, ', 'rugged, ', 'secure, ', 'self assured, ',
-                                                        'sensitive, ', 'serene, ', 'smooth skin, ', 'soft skin, ', 'sophisticated, ',
-                                                        'square-jawed, ', 'stable, ', 'strong, ', 'strong chin, ', 'suave, ',
-                                                        'sun kissed skin, ', 'thick, ', 'trustworthy, ', 'twinkling eyes, ', 'urbane, ',
-                                                        'well mannered, ', 'well spoken, ', 'well traveled, ', 'well-built, ', 'witty, ', 'worldly, '])
-    if np.random.rand() < 0.2:
-        modifier_str = modifier_str + np.random.choice(['subtle shadows, ', 'shadow, '])
-    if np.random.rand() < 0.05:
-        modifier_str = modifier_str + np.random.choice(['mist, ', 'wet, ', 'foggy background, '])
-    if np.random.rand() < 0.05:
-        modifier_str = modifier_str + 'golden ratio composition, '
-    if np.random.rand() < 0.05:
-        modifier_str = modifier_str + 'dramatic, '
-    if np.random.rand() < 0.05:
-        modifier_str = modifier_str + 'award winning photograph, '
-    if np.random.rand() < 0.05:
-        modifier_str = modifier_str + 'epic composition, '
-    if np.random.rand() < 0.05:
-        modifier_str = modifier_str + 'pexels, '
-    if np.random.rand() < 0.05:
-        modifier_str = modifier_str + 'high contrast, '
-
-    return modifier_str[:-2]
+#%% precompiled face prompt sampler
 
 def get_all_unique_dict_values(property_dict):
     all_unique_values = []
     for key, values in property_dict.items():
         all_unique_values.extend(values)
-    all_unique_values = list(set(all_unique_values))
+    all_unique_values = sorted(set(all_unique_values))
 
     return all_unique_values
 
-def get_random_ethnicity(ethnicity_group=None, top_level_prob=0.5):    
-    if ethnicity_group is None:
-        ethnicity_group = np.random.choice(list(ethnicities_dict.keys()))
-
-    if np.random.rand() < top_level_prob:
-        ethnicity = ethnicity_group
-    else:
-        ethnicity = np.random.choice(ethnicities_dict[ethnicity_group])
-    
-    return ethnicity
-
-def get_age_sex_ethnicity(ethnicity_group=None, sex_group=None, age_group=None):
-    # Age group definitions
-    age_groups = {
-        "baby": (1, 18),          # 1-18 months
-        "toddler": (1, 4),        # 1-4 years
-        "child": (4, 12),         # 4-12 years
-        "teenager": (13, 19),     # 13-19 years
-        "young adult": (18, 38),  # 18-38 years
-        "middle-aged": (30, 55),  # 30-55 years
-        "elderly": (50, 100)      # 50-100 years
+def _to_tuple_dict(property_dict):
+    return {key: tuple(values) for key, values in property_dict.items()}
+
+def _build_clothing_item_tables(clothing_types_dict):
+    # replicates the per call item lookup of the original get_clothing_description:
+    # male/female items are extended with the neutral items of the category (in place,
+    # so the extended list also ends up in the "mix and match" pool of that category)
+    stereotype_items = {}
+    mix_and_match_items = {}
+    for clothing_category, items_by_sex in clothing_types_dict.items():
+        all_category_items = get_all_unique_dict_values(items_by_sex)
+        for sex_group in ['male', 'female', 'neutral']:
+            clothing_items_list = list(items_by_sex.get(sex_group, all_category_items))
+            if sex_group in ['male', 'female']:
+                clothing_items_list += items_by_sex.get('neutral', all_category_items)
+            stereotype_items[(clothing_category, sex_group)] = tuple(clothing_items_list)
+
+            mixed_items_list = []
+            for key, values in items_by_sex.items():
+                mixed_items_list.extend(clothing_items_list if key == sex_group and sex_group != 'neutral' else values)
+            mix_and_match_items[(clothing_category, sex_group)] = tuple(mixed_items_list)
+
+    return stereotype_items, mix_and_match_items
+
+def _get_cumulative_probs(probs):
+    cumulative_probs = list(itertools.accumulate(probs))
+    cumulative_probs[-1] = 1.0
+    return tuple(cumulative_probs)
+
+def get_uniform_probs(options):
+    # probability of every distinct value of a uniform draw from `options` (repeated options are more likely)
+    return {value: count / len(options) for value, count in Counter(options).items()}
+
+def mix_probs(probs_a, probs_b, prob_b):
+    # mixture (1 - prob_b) * probs_a + prob_b * probs_b
+    mixed_probs = defaultdict(float)
+    for value, prob in probs_a.items():
+        mixed_probs[value] += (1 - prob_b) * prob
+    for value, prob in probs_b.items():
+        mixed_probs[value] += prob_b * prob
+    return dict(mixed_probs)
+
+def _get_constrained_draw_prob(num_slots, num_draws, required_counts, weighted_kinds):
+    # num_draws draws without replacement out of num_slots slots: probability that every kind of required_counts (slot counts)
+    # is drawn, where every kind of weighted_kinds ((slot count, weight) pairs) that is drawn multiplies the probability by its
+    # weight. Inclusion-exclusion over the kinds that are not drawn, since P(a set of s slots is not drawn) = C(n - s, k) / C(n, k)
+    total = 0.0
+    for required_mask in range(1 << len(required_counts)):
+        sign = -1 if bin(required_mask).count('1') % 2 else 1
+        num_missed_required = sum(count for i, count in enumerate(required_counts) if required_mask >> i & 1)
+        for weighted_mask in range(1 << len(weighted_kinds)):
+            coefficient = sign
+            num_missed = num_missed_required
+            for i, (count, weight) in enumerate(weighted_kinds):
+                if weighted_mask >> i & 1:
+                    coefficient *= 1 - weight
+                    num_missed += count
+                else:
+                    coefficient *= weight
+            if coefficient != 0:
+                total += coefficient * math.comb(num_slots - num_missed, num_draws)
+    return total / math.comb(num_slots, num_draws)
+
+class _ElementConstraints:
+    """Exact conditional distribution of a prompt given element constraints, sampled without rejection.
+
+    The demographic latents and the number of slot draws are drawn from their posterior given the
+    constraints, then the slots are drawn one by one from their conditional distribution given the
+    constraints that are still open, and the constrained elements from their allowed texts only.
+    Elements with excluded texts are as likely as the generator makes them keep an allowed text.
+    """
+
+    def __init__(self, sampler_class, ethnicity_group, sex_group, age_group, lighting_category, num_elements_to_add,
+                 required_elements, forbidden_elements, element_includes, element_excludes):
+        self.sampler_class = sampler_class
+        self.lighting_category = lighting_category
+        self.forbidden_elements = frozenset(forbidden_elements)
+        self.allowed_texts = {kind: frozenset(texts) for kind, texts in element_includes.items()}
+        self.excluded_texts = {kind: frozenset(texts) for kind, texts in element_excludes.items()}
+        self.required_elements = tuple(sorted(set(required_elements) | set(element_includes)))
+
+        constrained_kinds = set(self.required_elements) | self.forbidden_elements | set(self.excluded_texts)
+        unknown_kinds = constrained_kinds - set(sampler_class.element_kinds)
+        if unknown_kinds:
+            raise ValueError(f"unknown element kinds {sorted(unknown_kinds)}, expected kinds out of {sampler_class.element_kinds}")
+        if self.forbidden_elements & set(self.required_elements):
+            raise ValueError(f"element kinds {sorted(self.forbidden_elements & set(self.required_elements))} are both required and forbidden")
+        if 'modifiers' in set(self.allowed_texts) | set(self.excluded_texts):
+            raise ValueError("text constraints are not supported for 'modifiers' elements")
+        for kind, texts in list(self.allowed_texts.items()) + list(self.excluded_texts.items()):
+            unknown_texts = texts - {text for text, attribute_values in sampler_class.get_element_outcome_probs(kind)}
+            if unknown_texts:
+                raise ValueError(f"unknown texts {sorted(unknown_texts)} for '{kind}' elements, "
+                                 f"expected texts out of FacePromptSampler.get_element_outcome_probs('{kind}')")
+
+        # posterior of (ethnicity group, sex group, age group) and, for each, of the number of slot draws
+        ethnicity_groups = sampler_class.ethnicity_groups if ethnicity_group is None else (ethnicity_group,)
+        sex_groups = sampler_class.sex_groups if sex_group is None else (sex_group,)
+        if age_group is None:
+            cumulative_probs = (0.0,) + sampler_class.age_group_cumulative_probs
+            age_group_probs = {group: cumulative_probs[i + 1] - cumulative_probs[i] for i, group in enumerate(sampler_class.age_groups)}
+        else:
+            age_group_probs = {age_group: 1.0}
+        num_elements_probs = get_uniform_probs(range(4, 10)) if num_elements_to_add is None else {num_elements_to_add: 1.0}
+
+        self._restricted_outcomes = {}
+        self._draw_probs = {}
+        self.latents = []
+        latent_weights = []
+        for group in ethnicity_groups:
+            for sex in sex_groups:
+                for age, age_prob in age_group_probs.items():
+                    slot_counts = Counter(sampler_class.element_kinds[slot] for slot in sampler_class._get_element_slots(sex, age))
+                    if any(kind not in slot_counts for kind in self.required_elements):
+                        continue
+                    num_slots = sum(slot_counts.values())
+                    for kind in self.forbidden_elements:
+                        slot_counts.pop(kind, None)
+
+                    # required kinds must keep an allowed text, the other kinds with constraints are weighted by that probability
+                    weight = age_prob / len(ethnicity_groups) / len(sex_groups)
+                    kind_weights = {}
+                    for kind in set(self.allowed_texts) | set(self.excluded_texts):
+                        if kind in slot_counts:
+                            allowed_prob = self._get_restricted_outcomes(kind, group, sex)[2]
+                            if kind in self.required_elements:
+                                weight *= allowed_prob
+                            else:
+                                kind_weights[kind] = allowed_prob
+
+                    num_draws_weights = defaultdict(float)
+                    for num_elements, prob in num_elements_probs.items():
+                        num_draws = min(num_elements, num_slots)
+                        if weight > 0 and num_draws <= sum(slot_counts.values()):
+                            # probability that no forbidden slot is drawn, then that the draws satisfy the other constraints
+                            draw_prob = math.comb(sum(slot_counts.values()), num_draws) / math.comb(num_slots, num_draws) * \
+                                self._get_draw_prob(sum(slot_counts.values()), num_draws, [slot_counts[kind] for kind in self.required_elements],
+                                                    [(slot_counts[kind], weight) for kind, weight in kind_weights.items()])
+                            if draw_prob > 0:
+                                num_draws_weights[num_draws] += prob * draw_prob
+                    total_weight = weight * sum(num_draws_weights.values())
+                    if total_weight > 0:
+                        self.latents.append((group, sex, age, dict(slot_counts), kind_weights, tuple(num_draws_weights),
+                                             _get_cumulative_probs([value / sum(num_draws_weights.values()) for value in num_draws_weights.values()])))
+                        latent_weights.append(total_weight)
+
+        if not self.latents:
+            raise ValueError("no prompt satisfies the element constraints")
+        self.latent_cumulative_probs = _get_cumulative_probs([weight / sum(latent_weights) for weight in latent_weights])
+
+    def _get_restricted_outcomes(self, element_kind, ethnicity_group, sex_group):
+        # (outcomes, cumulative probabilities, total probability) of the element outcomes with an allowed text
+        key = (element_kind, ethnicity_group, sex_group)
+        if key not in self._restricted_outcomes:
+            allowed_texts = self.allowed_texts.get(element_kind)
+            excluded_texts = self.excluded_texts.get(element_kind, ())
+            outcome_probs = self.sampler_class.get_element_outcome_probs(element_kind, ethnicity_group, sex_group, self.lighting_category)
+            outcomes = [(outcome, prob) for outcome, prob in outcome_probs.items()
+                        if (allowed_texts is None or outcome[0] in allowed_texts) and outcome[0] not in excluded_texts]
+            total_prob = sum(prob for outcome, prob in outcomes)
+            cumulative_probs = _get_cumulative_probs([prob / total_prob for outcome, prob in outcomes]) if total_prob > 0 else ()
+            self._restricted_outcomes[key] = [outcome for outcome, prob in outcomes], cumulative_probs, total_prob
+        return self._restricted_outcomes[key]
+
+    def _get_draw_prob(self, num_slots, num_draws, required_counts, weighted_kinds):
+        key = (num_slots, num_draws, tuple(required_counts), tuple(weighted_kinds))
+        if key not in self._draw_probs:
+            self._draw_probs[key] = _get_constrained_draw_prob(*key)
+        return self._draw_probs[key]
+
+    def draw_latents(self, rng):
+        # (ethnicity group, sex group, age group, index of the latents)
+        latent_index = bisect.bisect_right(self.latent_cumulative_probs, rng.random())
+        group, sex, age = self.latents[latent_index][:3]
+        return group, sex, age, latent_index
+
+    def select_element_kinds(self, rng, latent_index):
+        group, sex, age, slot_counts, kind_weights, num_draws_options, num_draws_cumulative_probs = self.latents[latent_index]
+        num_draws = num_draws_options[bisect.bisect_right(num_draws_cumulative_probs, rng.random())]
+
+        slot_counts = dict(slot_counts)
+        num_slots = sum(slot_counts.values())
+        required_kinds = list(self.required_elements)
+        kind_weights = dict(kind_weights)
+        selected_kinds = []
+        for draw_index in range(num_draws):
+            # probability of the next slot, times the probability that the remaining draws still satisfy the constraints
+            num_remaining_draws = num_draws - draw_index - 1
+            required_counts = [slot_counts[kind] for kind in required_kinds]
+            weighted_kinds = [(slot_counts[kind], weight) for kind, weight in kind_weights.items()]
+            candidate_kinds, candidate_weights = [], []
+            for i, kind in enumerate(required_kinds):
+                candidate_kinds.append(kind)
+                candidate_weights.append(required_counts[i] * self._get_draw_prob(num_slots - 1, num_remaining_draws,
+                                                                                  required_counts[:i] + required_counts[i + 1:], weighted_kinds))
+            for i, kind in enumerate(kind_weights):
+                count, weight = weighted_kinds[i]
+                candidate_kinds.append(kind)
+                candidate_weights.append(count * weight * self._get_draw_prob(num_slots - 1, num_remaining_draws, required_counts,
+                                                                              weighted_kinds[:i] + weighted_kinds[i + 1:]))
+            # the kinds without open constraints share the same probability, None stands for any of them
+            num_other_slots = num_slots - sum(required_counts) - sum(count for count, weight in weighted_kinds)
+            if num_other_slots > 0:
+                candidate_kinds.append(None)
+                candidate_weights.append(num_other_slots * self._get_draw_prob(num_slots - 1, num_remaining_draws, required_counts, weighted_kinds))
+
+            total_weight = sum(candidate_weights)
+            kind = candidate_kinds[bisect.bisect_right(_get_cumulative_probs([weight / total_weight for weight in candidate_weights]), rng.random())]
+            if kind is None:
+                slot_position = int(rng.random() * num_other_slots)
+                for kind, count in slot_counts.items():
+                    if kind not in kind_weights and kind not in required_kinds:
+                        slot_position -= count
+                        if slot_position < 0:
+                            break
+
+            slot_counts[kind] -= 1
+            num_slots -= 1
+            kind_weights.pop(kind, None)
+            if kind in required_kinds:
+                required_kinds.remove(kind)
+            if kind not in selected_kinds:
+                selected_kinds.append(kind)
+        return selected_kinds
+
+    def is_constrained(self, element_kind):
+        return element_kind in self.allowed_texts or element_kind in self.excluded_texts
+
+    def draw_element(self, rng, element_kind, ethnicity_group, sex_group):
+        # (text, attribute values) of a constrained element
+        outcomes, cumulative_probs, total_prob = self._get_restricted_outcomes(element_kind, ethnicity_group, sex_group)
+        return outcomes[bisect.bisect_right(cumulative_probs, rng.random())]
+
+class _RaggedTable:
+    """Rows of different lengths flattened into a single list, to draw one value per row in a vectorized way."""
+
+    def __init__(self, rows):
+        rows = [tuple(row) if len(row) > 0 else ('',) for row in rows]
+        self.values = [value for row in rows for value in row]
+        self.lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(np.int64)
+
+    def draw(self, rng, row_indices):
+        # returns positions into self.values, one uniformly drawn value of each requested row
+        row_indices = np.asarray(row_indices)
+        return self.offsets[row_indices] + (rng.random(row_indices.shape) * self.lengths[row_indices]).astype(np.int64)
+
+class _BufferedUniformSource:
+    """Serves uniform floats of a `np.random.Generator` one at a time, drawing them in blocks
+    since single draws from a Generator are slow."""
+
+    def __init__(self, generator, block_size=256):
+        self.generator = generator
+        self.block_size = block_size
+        self._uniforms = []
+
+    def random(self):
+        if not self._uniforms:
+            self._uniforms = self.generator.random(self.block_size).tolist()
+            self._uniforms.reverse()
+        return self._uniforms.pop()
+
+class FacePromptSampler:
+    """Face prompt generator that works on vocabulary tables precompiled into tuples.
+
+    All vocabularies, union tables and per group lists are built once, when the class
+    is created, and are shared by all instances. Drawing a prompt therefore only costs
+    a few index draws. `rng` is any object with a `random()` method returning a float
+    in [0, 1), e.g. the `random` module (default), a `random.Random` instance or a
+    `np.random.Generator`. The uniforms of a Generator are drawn in blocks of `buffer_size`,
+    since single draws are slow. The unused rest of a block is lost with the sampler, so
+    short lived samplers use `buffer_size=1`.
+    """
+
+    sex_groups = ('male', 'female')
+    clothing_sex_groups = ('male', 'female', 'neutral')
+    age_groups = tuple(age_group_probs_dict.keys())
+    age_group_cumulative_probs = _get_cumulative_probs(age_group_probs_dict.values())
+    age_ranges = dict(age_groups_dict)
+    adult_sex_words = {age_group: _to_tuple_dict(words) for age_group, words in adult_sex_words_dict.items()}
+    adult_age_qualifiers = dict(adult_age_qualifiers_dict)
+
+    ethnicity_groups = tuple(ethnicities_dict.keys())
+    ethnicities = _to_tuple_dict(ethnicities_dict)
+    all_ethnicities = tuple(get_all_unique_dict_values(ethnicities_dict))
+    lighting_categories = tuple(lighting_descriptions_dict.keys())
+    lighting_descriptions = _to_tuple_dict(lighting_descriptions_dict)
+
+    prompt_starts = tuple(prompt_start_list)
+    expressions = tuple(expressions_list)
+    face_poses = tuple(face_poses_list)
+    gaze_directions = tuple(gaze_direction_list)
+    glasses = tuple(glasses_list)
+    facial_hair_descriptions = tuple(facial_hair_list)
+    makeup_descriptions = tuple(makeup_list)
+    locations_settings_backgrounds = tuple(locations_settings_backgrounds_list)
+    weight_descriptions = tuple(weight_descriptions_list)
+    times_of_day = tuple(times_of_day_list)
+    weather_conditions = tuple(weather_conditions_list)
+    modifier_options = tuple((prob, tuple(options)) for prob, options in modifier_options_list)
+
+    hair_styles = tuple(hair_styles_list)
+    hair_colors = _to_tuple_dict(hair_colors_dict)
+    all_hair_colors = tuple(get_all_unique_dict_values(hair_colors_dict))
+    eye_styles = tuple(eye_styles_list)
+    eye_colors = _to_tuple_dict(eye_colors_dict)
+    all_eye_colors = tuple(get_all_unique_dict_values(eye_colors_dict))
+    skin_tones = _to_tuple_dict(skin_tones_by_ethnicity_dict)
+    all_skin_tones = tuple(get_all_unique_dict_values(skin_tones_by_ethnicity_dict))
+    skin_characteristics = tuple(skin_characteristics_list)
+    headwear = _to_tuple_dict(hats_and_headwear_dict)
+    all_headwear = tuple(get_all_unique_dict_values(hats_and_headwear_dict))
+    jewelry = _to_tuple_dict(jewelry_dict)
+    all_jewelry = tuple(get_all_unique_dict_values(jewelry_dict))
+
+    clothing_categories = tuple(clothing_types_dict.keys())
+    clothing_colors = tuple(clothing_colors_list)
+    clothing_patterns = tuple(clothing_patterns_list)
+    clothing_items, clothing_mix_and_match_items = _build_clothing_item_tables(clothing_types_dict)
+    patterned_clothing_categories = frozenset(["casual", "formal", "professional", "outerwear", "dresses_skirts"])
+    dressed_in_clothing_categories = frozenset(["ethnic", "unique", "historical"])
+    worn_in_clothing_categories = frozenset(["uniform", "sports", "workwear", "religious"])
+
+    # element kinds that can be added after the base prompt, and the slots they occupy in the
+    # list that the element subset is drawn from (weight, modifiers and lighting occupy two
+    # slots and makeup three, to increase their probability)
+    element_kinds = ('face_pose', 'gaze_direction', 'hair', 'eyes', 'skin', 'clothing', 'headwear', 'jewelry',
+                     'glasses', 'time_of_day', 'weather', 'weight', 'modifiers', 'lighting', 'facial_hair', 'makeup')
+    adult_age_groups = frozenset(['teenager', 'young adult', 'middle-aged', 'elderly'])
+    base_element_slots = tuple(range(14)) + (11, 12, 13)
+    facial_hair_element_slots = base_element_slots + (14,)
+    makeup_element_slots = base_element_slots + (15, 15, 15)
+
+    # attributes that only exist when an element of that kind is part of the prompt
+    element_kind_attribute_names = {
+        'hair': ('hair_color', 'hair_style'),
+        'eyes': ('eye_color', 'eye_style'),
+        'skin': ('skin_tone', 'skin_characteristic'),
+        'lighting': ('lighting_category',),
     }
 
-    # sample age group if not provided
-    if age_group is None:
-        age_group = np.random.choice(list(age_groups.keys()))
+    # integer coded attribute record of a prompt (return_attributes=True). Categorical attributes are indices
+    # into these vocabularies, -1 when the attribute is not part of the prompt ('ethnicity' is -1 when only the
+    # ethnicity group is written). 'element_kinds' is a bit mask over element_kinds, 'age' is in months for babies
+    prompt_attribute_vocabularies = {
+        'ethnicity_group': ethnicity_groups,
+        'ethnicity': all_ethnicities,
+        'sex_group': sex_groups,
+        'age_group': age_groups,
+        'age': None,
+        'lighting_category': lighting_categories,
+        'num_elements': None,
+        'element_kinds': element_kinds,
+        'hair_color': all_hair_colors,
+        'hair_style': hair_styles,
+        'eye_color': all_eye_colors,
+        'eye_style': eye_styles,
+        'skin_tone': all_skin_tones,
+        'skin_characteristic': skin_characteristics,
+    }
+    prompt_attribute_names = tuple(prompt_attribute_vocabularies.keys())
+    _attribute_value_indices = {name: {value: index for index, value in reversed(list(enumerate(vocabulary)))}
+                                for name, vocabulary in prompt_attribute_vocabularies.items() if vocabulary is not None}
 
-    # sample sex group if not provided
-    if sex_group is None:
-        sex_group = np.random.choice(['male', 'female'])
+    # element kinds whose text depends on the ethnicity group / on the sex group
+    ethnicity_dependent_element_kinds = frozenset(['hair', 'eyes', 'skin'])
+    sex_dependent_element_kinds = frozenset(['clothing', 'headwear', 'jewelry'])
 
-    # sample ethnicity based on the cluster
-    ethnicity = get_random_ethnicity(ethnicity_group)
+    _batch_tables = None
+    _element_outcome_probs_cache = {}
+    _element_constraints_cache = {}
 
-    # sample age based on age group range
-    age_min, age_max = age_groups[age_group]
-    age = np.random.choice(range(age_min, age_max + 1))
+    def __init__(self, rng=None, buffer_size=256):
+        self.numpy_rng = rng if isinstance(rng, np.random.Generator) else None
+        if self.numpy_rng is not None and buffer_size > 1:
+            rng = _BufferedUniformSource(self.numpy_rng, buffer_size)
+        self.rng = random if rng is None else rng
+
+    # basic draws
+
+    def _choice(self, options):
+        return options[int(self.rng.random() * len(options))]
+
+    def _sample(self, population, k):
+        # partial Fisher-Yates shuffle, returns k distinct elements in random order
+        pool = list(population)
+        for i in range(k):
+            j = i + int(self.rng.random() * (len(pool) - i))
+            pool[i], pool[j] = pool[j], pool[i]
+        return pool[:k]
+
+    def _randint(self, low, high):
+        return low + int(self.rng.random() * (high - low + 1))
+
+    def _record_attribute(self, attributes, name, value):
+        if attributes is not None:
+            attributes[name] = self._attribute_value_indices[name][value]
+
+    # attribute draws
+
+    def get_prompt_start(self):
+        return self._choice(self.prompt_starts)
+
+    def get_random_glasses(self):
+        return self._choice(self.glasses)
+
+    def get_random_gaze_direction(self):
+        return self._choice(self.gaze_directions)
+
+    def get_facial_hair_description(self):
+        return self._choice(self.facial_hair_descriptions)
+
+    def get_makeup_description(self):
+        return self._choice(self.makeup_descriptions)
+
+    def get_location_setting_background(self):
+        return self._choice(self.locations_settings_backgrounds)
+
+    def get_skin_description(self, ethnicity_group=None, stereotype_prob=0.7, attributes=None):
+        if ethnicity_group is None or self.rng.random() > stereotype_prob:
+            tone = self._choice(self.all_skin_tones)
+        else:
+            tone = self._choice(self.skin_tones.get(ethnicity_group, self.all_skin_tones))
+
+        characteristic = self._choice(self.skin_characteristics)
+        self._record_attribute(attributes, 'skin_tone', tone)
+        self._record_attribute(attributes, 'skin_characteristic', characteristic)
+
+        return f"{tone}, {characteristic} skin"
+
+    def get_hats_and_headwear(self, sex_group=None, stereotype_prob=0.8):
+        if sex_group is None or self.rng.random() > stereotype_prob:
+            return self._choice(self.all_headwear)
+        else:
+            return self._choice(self.headwear.get(sex_group, self.all_headwear))
+
+    def get_random_jewelry(self, sex_group=None, stereotype_prob=0.8):
+        if sex_group is None or self.rng.random() > stereotype_prob:
+            return self._choice(self.all_jewelry)
+        else:
+            return self._choice(self.jewelry.get(sex_group, self.all_jewelry))
+
+    def get_weight_description(self):
+        return self._choice(self.weight_descriptions)
+
+    def get_random_time_of_day(self):
+        return self._choice(self.times_of_day)
+
+    def get_random_weather_condition(self):
+        return self._choice(self.weather_conditions)
+
+    def get_eye_description(self, ethnicity_group=None, stereotype_prob=0.3, attributes=None):
+        if ethnicity_group is None or self.rng.random() > stereotype_prob:
+            eye_colors_list = self.all_eye_colors
+        else:
+            eye_colors_list = self.eye_colors.get(ethnicity_group, self.all_eye_colors)
+
+        color = self._choice(eye_colors_list)
+        eye_style = self._choice(self.eye_styles)
+        self._record_attribute(attributes, 'eye_color', color)
+        self._record_attribute(attributes, 'eye_style', eye_style)
+
+        return eye_style.format(color=color)
+
+    def get_clothing_description(self, sex_group=None, stereotype_prob=0.6):
+        if sex_group is None or self.rng.random() > stereotype_prob:
+            sex_group = self._choice(self.clothing_sex_groups)
+
+        assert sex_group in self.clothing_sex_groups
+
+        clothing_category = self._choice(self.clothing_categories)
+        clothing_item = self._choice(self.clothing_items[(clothing_category, sex_group)])
+        clothing_color_list = self._choice(self.clothing_colors)
+        clothing_color = self._choice(clothing_color_list)
+
+        if clothing_category in self.patterned_clothing_categories:
+            if self.rng.random() < 0.2:
+                pattern = self._choice(self.clothing_patterns)
+                clothing_str = f"wearing a {pattern} {clothing_item}"
+            else:
+                clothing_str = f"wearing a {clothing_color} {clothing_item}"
+        elif clothing_category in self.dressed_in_clothing_categories:
+            clothing_str = f"dressed in {clothing_item}"
+        elif clothing_category in self.worn_in_clothing_categories:
+            clothing_str = f"in {clothing_item}"
+        else:
+            clothing_str = f"wearing {clothing_item}"
+
+        # if we are not using a stereotype, we can mix and match clothing items from different categories
+        if self.rng.random() > stereotype_prob:
+            return f"wearing {self._choice(self.clothing_mix_and_match_items[(clothing_category, sex_group)])}"
+
+        return clothing_str
+
+    def get_random_modifier_string(self):
+        modifier_str = ''.join([self._choice(options) for prob, options in self.modifier_options if self.rng.random() < prob])
+        return modifier_str[:-2]
+
+    def get_random_ethnicity(self, ethnicity_group=None, top_level_prob=0.5, attributes=None):
+        if ethnicity_group is None:
+            ethnicity_group = self._choice(self.ethnicity_groups)
+        self._record_attribute(attributes, 'ethnicity_group', ethnicity_group)
+
+        if self.rng.random() < top_level_prob:
+            return ethnicity_group
+        else:
+            ethnicity = self._choice(self.ethnicities[ethnicity_group])
+            self._record_attribute(attributes, 'ethnicity', ethnicity)
+            return ethnicity
+
+    def get_age_sex_ethnicity(self, ethnicity_group=None, sex_group=None, age_group=None, attributes=None):
+        if age_group is None:
+            age_group = self._choice(self.age_groups)
+        if sex_group is None:
+            sex_group = self._choice(self.sex_groups)
+
+        ethnicity = self.get_random_ethnicity(ethnicity_group, attributes=attributes)
+        age = self._randint(*self.age_ranges[age_group])
+        self._record_attribute(attributes, 'age_group', age_group)
+        self._record_attribute(attributes, 'sex_group', sex_group)
+        if attributes is not None:
+            attributes['age'] = age
+
+        if age_group in self.adult_sex_words:
+            sex = self._choice(self.adult_sex_words[age_group]['male' if sex_group == 'male' else 'female'])
+            sex = f'{self.adult_age_qualifiers[age_group]} {sex}' if self.rng.random() < 0.25 else sex
+            return f'{age} year old {ethnicity} {sex}'
 
-    if age_group == 'baby':
-        sex = 'boy' if sex_group == 'male' else 'girl'
-        age_sex_ethnicity_str = f'{age} month old {ethnicity} baby {sex}'
-    elif age_group == 'toddler':
-        sex = 'boy' if sex_group == 'male' else 'girl'
-        age_sex_ethnicity_str = f'{age} year old {ethnicity} toddler {sex}'
-    elif age_group == 'child':
-        sex = 'boy' if sex_group == 'male' else 'girl'
-        age_sex_ethnicity_str = f'{age} year old {ethnicity} {sex}'
-    elif age_group == 'teenager':
         sex = 'boy' if sex_group == 'male' else 'girl'
-        age_sex_ethnicity_str = f'{age} year old {ethnicity} teenage {sex}'
-    elif age_group == 'young adult':
-        if sex_group == 'male':
-            sex = np.random.choice(['man', 'guy', 'person', 'male', 'brother'])
+        if age_group == 'baby':
+            return f'{age} month old {ethnicity} baby {sex}'
+        elif age_group == 'toddler':
+            return f'{age} year old {ethnicity} toddler {sex}'
+        elif age_group == 'child':
+            return f'{age} year old {ethnicity} {sex}'
+        elif age_group == 'teenager':
+            return f'{age} year old {ethnicity} teenage {sex}'
+
+    def get_random_expression(self):
+        return self._choice(self.expressions)
+
+    def get_lighting_atmosphere(self, lighting_category=None, attributes=None):
+        if lighting_category is None:
+            lighting_category = self._choice(self.lighting_categories)
+        self._record_attribute(attributes, 'lighting_category', lighting_category)
+        return self._choice(self.lighting_descriptions[lighting_category])
+
+    def get_hair_description(self, ethnicity_group=None, stereotype_prob=0.3, attributes=None):
+        if ethnicity_group is None or self.rng.random() > stereotype_prob:
+            hair_colors_list = self.all_hair_colors
         else:
-            sex = np.random.choice(['woman', 'dame', 'lady', 'female', 'sister'])
-        sex = f'young {sex}' if np.random.rand() < 0.25 else sex
-        age_sex_ethnicity_str = f'{age} year old {ethnicity} {sex}'
-    elif age_group == 'middle-aged':
-        if sex_group == 'male':
-            sex = np.random.choice(['man', 'guy', 'husband', 'person', 'male', 'father', 'gentleman'])
+            hair_colors_list = self.hair_colors.get(ethnicity_group, self.all_hair_colors)
+
+        color = self._choice(hair_colors_list)
+        style = self._choice(self.hair_styles)
+        self._record_attribute(attributes, 'hair_color', color)
+        self._record_attribute(attributes, 'hair_style', style)
+        return f"with {color} {style}"
+
+    def get_random_face_pose(self):
+        return self._choice(self.face_poses)
+
+    # additional elements
+
+    def select_element_kinds(self, sex_group, age_group, num_elements_to_add=None):
+        # a uniform subset of the element slots, the kinds that occupy several slots are more likely
+        element_slots = self._get_element_slots(sex_group, age_group)
+        if num_elements_to_add is None:
+            num_elements_to_add = self._randint(4, 9)
+        selected_slots = self._sample(element_slots, min(num_elements_to_add, len(element_slots)))
+        return [self.element_kinds[slot] for slot in dict.fromkeys(selected_slots)]
+
+    def get_element(self, element_kind, ethnicity_group=None, sex_group=None, lighting_category=None, attributes=None):
+        if element_kind == 'face_pose':
+            return self.get_random_face_pose()
+        elif element_kind == 'gaze_direction':
+            return self.get_random_gaze_direction()
+        elif element_kind == 'hair':
+            return self.get_hair_description(ethnicity_group, attributes=attributes)
+        elif element_kind == 'eyes':
+            return self.get_eye_description(ethnicity_group, attributes=attributes)
+        elif element_kind == 'skin':
+            return self.get_skin_description(ethnicity_group, attributes=attributes)
+        elif element_kind == 'clothing':
+            return self.get_clothing_description(sex_group)
+        elif element_kind == 'headwear':
+            return self.get_hats_and_headwear(sex_group)
+        elif element_kind == 'jewelry':
+            return self.get_random_jewelry(sex_group)
+        elif element_kind == 'glasses':
+            return self.get_random_glasses()
+        elif element_kind == 'time_of_day':
+            return self.get_random_time_of_day()
+        elif element_kind == 'weather':
+            return self.get_random_weather_condition()
+        elif element_kind == 'weight':
+            return self.get_weight_description()
+        elif element_kind == 'modifiers':
+            return self.get_random_modifier_string()
+        elif element_kind == 'lighting':
+            return self.get_lighting_atmosphere(lighting_category, attributes)
+        elif element_kind == 'facial_hair':
+            return self.get_facial_hair_description()
+        elif element_kind == 'makeup':
+            return self.get_makeup_description()
+        raise ValueError(f"unknown element kind '{element_kind}'")
+
+    # full prompt
+
+    def generate_face_prompt(self, ethnicity_group=None, sex_group=None, age_group=None,
+                             lighting_category=None, num_elements_to_add=None, return_attributes=False, max_prompt_tokens=None,
+                             required_elements=None, forbidden_elements=None, element_includes=None, element_excludes=None):
+        """Generate a random face prompt, optionally conditioned on its demographics, lighting and number of elements.
+
+        Element constraints are satisfied directly, with the conditional distribution of the generator given them:
+        `required_elements` / `forbidden_elements` are element kinds (see `element_kinds`) that must / must not be
+        part of the prompt, `element_includes` maps element kinds to the texts allowed for them (the kind is then
+        required) and `element_excludes` maps element kinds to texts they must not have. E.g.
+        `generate_face_prompt(required_elements=['glasses', 'headwear'], element_includes={'weather': ['during a snowstorm']})`
+        """
+
+        # integer coded attribute record, filled in by the attribute draws (see prompt_attribute_vocabularies)
+        attributes = dict.fromkeys(self.prompt_attribute_names, -1) if return_attributes else None
+
+        constraints = None
+        if required_elements or forbidden_elements or element_includes or element_excludes:
+            constraints = self._get_element_constraints(ethnicity_group, sex_group, age_group, lighting_category, num_elements_to_add,
+                                                        required_elements, forbidden_elements, element_includes, element_excludes)
+            ethnicity_group, sex_group, age_group, latent_index = constraints.draw_latents(self.rng)
+
+        # Sample demographic information
+        if ethnicity_group is None:
+            ethnicity_group = self._choice(self.ethnicity_groups)
+        if sex_group is None:
+            sex_group = self._choice(self.sex_groups)
+        if age_group is None:
+            age_group = self.age_groups[bisect.bisect_right(self.age_group_cumulative_probs, self.rng.random())]
+
+        # Generate base prompt
+        prompt_start = self.get_prompt_start()
+        age_sex_ethnicity = self.get_age_sex_ethnicity(ethnicity_group, sex_group, age_group, attributes)
+        base_prompt = f"{prompt_start} {age_sex_ethnicity}, "
+
+        # Randomly select the element kinds to add, and only generate those
+        if constraints is None:
+            selected_kinds = self.select_element_kinds(sex_group, age_group, num_elements_to_add)
+            selected_elements = [self.get_element(kind, ethnicity_group, sex_group, lighting_category, attributes) for kind in selected_kinds]
         else:
-            sex = np.random.choice(['woman', 'dame', 'wife', 'lady', 'female', 'mother', 'gentlewoman'])
-        sex = f'middle-aged {sex}' if np.random.rand() < 0.25 else sex
-        age_sex_ethnicity_str = f'{age} year old {ethnicity} {sex}'
-    elif age_group == 'elderly':
-        if sex_group == 'male':
-            sex = np.random.choice(['man', 'grandfather', 'grandpa', 'person', 'father', 'husband', 'gentleman'])
+            selected_kinds = constraints.select_element_kinds(self.rng, latent_index)
+            selected_elements = []
+            for kind in selected_kinds:
+                if constraints.is_constrained(kind):
+                    element, attribute_values = constraints.draw_element(self.rng, kind, ethnicity_group, sex_group)
+                    for name, value in zip(self.element_kind_attribute_names.get(kind, ()), attribute_values):
+                        self._record_attribute(attributes, name, value)
+                else:
+                    element = self.get_element(kind, ethnicity_group, sex_group, lighting_category, attributes)
+                selected_elements.append(element)
+        expression = self.get_random_expression()
+        location_setting_background = self.get_location_setting_background()
+
+        # Drop the elements that do not fit in the token budget (expression, location and required elements are always kept)
+        if max_prompt_tokens is not None:
+            selected_kinds, selected_elements = self._fit_elements_to_token_budget(
+                [base_prompt, f"{expression},", location_setting_background], selected_kinds, selected_elements, max_prompt_tokens, attributes,
+                required_kinds=constraints.required_elements if constraints is not None else ())
+
+        selected_elements = [expression] + selected_elements # always add expression at the beginning
+        selected_elements.append(location_setting_background) # always add location setting background at the end
+
+        # Combine base prompt with selected elements
+        full_prompt = f"{base_prompt} {', '.join(selected_elements)}"
+
+        if return_attributes:
+            attributes['num_elements'] = len(selected_kinds)
+            attributes['element_kinds'] = sum(1 << self.element_kinds.index(kind) for kind in selected_kinds)
+            return full_prompt, attributes
+
+        return full_prompt
+
+    @classmethod
+    def _get_element_constraints(cls, ethnicity_group, sex_group, age_group, lighting_category, num_elements_to_add,
+                                 required_elements, forbidden_elements, element_includes, element_excludes):
+        # the conditional distribution tables are built once per set of conditions and constraints
+        def to_texts_dict(texts_dict):
+            return {kind: frozenset([texts] if isinstance(texts, str) else texts) for kind, texts in (texts_dict or {}).items()}
+
+        required_elements = frozenset([required_elements] if isinstance(required_elements, str) else required_elements or ())
+        forbidden_elements = frozenset([forbidden_elements] if isinstance(forbidden_elements, str) else forbidden_elements or ())
+        element_includes, element_excludes = to_texts_dict(element_includes), to_texts_dict(element_excludes)
+        key = (ethnicity_group, sex_group, age_group, lighting_category, num_elements_to_add, required_elements, forbidden_elements,
+               frozenset(element_includes.items()), frozenset(element_excludes.items()))
+        if key not in cls._element_constraints_cache:
+            cls._element_constraints_cache[key] = _ElementConstraints(cls, ethnicity_group, sex_group, age_group, lighting_category,
+                                                                      num_elements_to_add, required_elements, forbidden_elements,
+                                                                      element_includes, element_excludes)
+        return cls._element_constraints_cache[key]
+
+    def _fit_elements_to_token_budget(self, fixed_prompt_parts, element_kinds, elements, max_prompt_tokens, attributes=None, required_kinds=()):
+        # greedily keeps the elements, in prompt order, that still fit in the budget. Every element is
+        # inserted before the location and followed by a comma, so its tokens are those of "element,"
+        # Required elements are always kept, their tokens are reserved first
+        token_counter = get_prompt_token_counter()
+        num_tokens = token_counter.num_special_tokens + sum(token_counter.count_text_tokens(part) for part in fixed_prompt_parts)
+        num_tokens += sum(token_counter.count_text_tokens(element + ',') for element_kind, element in zip(element_kinds, elements)
+                          if element_kind in required_kinds)
+
+        kept_kinds, kept_elements = [], []
+        for element_kind, element in zip(element_kinds, elements):
+            if element_kind in required_kinds:
+                kept_kinds.append(element_kind)
+                kept_elements.append(element)
+                continue
+            element_num_tokens = token_counter.count_text_tokens(element + ',')
+            if num_tokens + element_num_tokens <= max_prompt_tokens:
+                num_tokens += element_num_tokens
+                kept_kinds.append(element_kind)
+                kept_elements.append(element)
+            elif attributes is not None:
+                for name in self.element_kind_attribute_names.get(element_kind, ()):
+                    attributes[name] = -1
+
+        return kept_kinds, kept_elements
+
+    # exact element distributions
+
+    @classmethod
+    def get_element_outcome_probs(cls, element_kind, ethnicity_group=None, sex_group=None, lighting_category=None):
+        """{(text, attribute values): probability} of the element drawn by `get_element` with the same arguments.
+
+        The attribute values are those of `element_kind_attribute_names[element_kind]` (an empty tuple for
+        most kinds). Not available for 'modifiers', whose text combines many independent draws.
+        """
+
+        key = (element_kind, ethnicity_group if element_kind in cls.ethnicity_dependent_element_kinds else None,
+               sex_group if element_kind in cls.sex_dependent_element_kinds else None, lighting_category if element_kind == 'lighting' else None)
+        if key in cls._element_outcome_probs_cache:
+            return cls._element_outcome_probs_cache[key]
+
+        def get_stereotype_probs(all_options, options_by_group, group, stereotype_prob):
+            # same draw as the get_* methods: the options of the group with probability stereotype_prob, else all the options
+            if group is None:
+                return get_uniform_probs(all_options)
+            return mix_probs(get_uniform_probs(all_options), get_uniform_probs(options_by_group.get(group, all_options)), stereotype_prob)
+
+        simple_kind_options = {'face_pose': cls.face_poses, 'gaze_direction': cls.gaze_directions, 'glasses': cls.glasses,
+                               'time_of_day': cls.times_of_day, 'weather': cls.weather_conditions, 'weight': cls.weight_descriptions,
+                               'facial_hair': cls.facial_hair_descriptions, 'makeup': cls.makeup_descriptions}
+        outcome_probs = defaultdict(float)
+        if element_kind in simple_kind_options:
+            for text, prob in get_uniform_probs(simple_kind_options[element_kind]).items():
+                outcome_probs[(text, ())] += prob
+        elif element_kind in cls.ethnicity_dependent_element_kinds:
+            if element_kind == 'hair':
+                color_probs = get_stereotype_probs(cls.all_hair_colors, cls.hair_colors, ethnicity_group, 0.3)
+                style_probs, text_format = get_uniform_probs(cls.hair_styles), "with {color} {style}"
+            elif element_kind == 'eyes':
+                color_probs = get_stereotype_probs(cls.all_eye_colors, cls.eye_colors, ethnicity_group, 0.3)
+                style_probs, text_format = get_uniform_probs(cls.eye_styles), None
+            else:
+                color_probs = get_stereotype_probs(cls.all_skin_tones, cls.skin_tones, ethnicity_group, 0.7)
+                style_probs, text_format = get_uniform_probs(cls.skin_characteristics), "{color}, {style} skin"
+            for color, color_prob in color_probs.items():
+                for style, style_prob in style_probs.items():
+                    text = style.format(color=color) if text_format is None else text_format.format(color=color, style=style)
+                    outcome_probs[(text, (color, style))] += color_prob * style_prob
+        elif element_kind in ('headwear', 'jewelry'):
+            all_options, options_by_sex = (cls.all_headwear, cls.headwear) if element_kind == 'headwear' else (cls.all_jewelry, cls.jewelry)
+            for text, prob in get_stereotype_probs(all_options, options_by_sex, sex_group, 0.8).items():
+                outcome_probs[(text, ())] += prob
+        elif element_kind == 'clothing':
+            for text, prob in cls._get_clothing_text_probs(sex_group).items():
+                outcome_probs[(text, ())] += prob
+        elif element_kind == 'lighting':
+            categories = cls.lighting_categories if lighting_category is None else (lighting_category,)
+            for category in categories:
+                for text, prob in get_uniform_probs(cls.lighting_descriptions[category]).items():
+                    outcome_probs[(text, (category,))] += prob / len(categories)
         else:
-            sex = np.random.choice(['woman', 'grandmother', 'grandma', 'lady', 'mother', 'wife', 'gentlewoman'])
-        sex = f'elderly {sex}' if np.random.rand() < 0.25 else sex
-        age_sex_ethnicity_str = f'{age} year old {ethnicity} {sex}'
+            raise ValueError(f"no outcome table for element kind '{element_kind}'")
+
+        cls._element_outcome_probs_cache[key] = dict(outcome_probs)
+        return cls._element_outcome_probs_cache[key]
+
+    @classmethod
+    def get_element_text_probs(cls, element_kind, ethnicity_group=None, sex_group=None, lighting_category=None):
+        # {text: probability} of the element drawn by get_element with the same arguments
+        text_probs = defaultdict(float)
+        for (text, attribute_values), prob in cls.get_element_outcome_probs(element_kind, ethnicity_group, sex_group, lighting_category).items():
+            text_probs[text] += prob
+        return dict(text_probs)
+
+    @classmethod
+    def _get_clothing_text_probs(cls, sex_group, stereotype_prob=0.6):
+        # same draws as get_clothing_description
+        clothing_sex_probs = get_uniform_probs(cls.clothing_sex_groups)
+        if sex_group is not None:
+            clothing_sex_probs = mix_probs(clothing_sex_probs, {sex_group: 1.0}, stereotype_prob)
+        color_probs = defaultdict(float)
+        for color_list in cls.clothing_colors:
+            for color, prob in get_uniform_probs(color_list).items():
+                color_probs[color] += prob / len(cls.clothing_colors)
+        pattern_probs = get_uniform_probs(cls.clothing_patterns)
+
+        text_probs = defaultdict(float)
+        for clothing_sex_group, sex_prob in clothing_sex_probs.items():
+            for category in cls.clothing_categories:
+                category_prob = sex_prob / len(cls.clothing_categories)
+                for item, item_prob in get_uniform_probs(cls.clothing_items[(category, clothing_sex_group)]).items():
+                    prob = stereotype_prob * category_prob * item_prob
+                    if category in cls.patterned_clothing_categories:
+                        for color, color_prob in color_probs.items():
+                            text_probs[f"wearing a {color} {item}"] += 0.8 * prob * color_prob
+                        for pattern, pattern_prob in pattern_probs.items():
+                            text_probs[f"wearing a {pattern} {item}"] += 0.2 * prob * pattern_prob
+                    elif category in cls.dressed_in_clothing_categories:
+                        text_probs[f"dressed in {item}"] += prob
+                    elif category in cls.worn_in_clothing_categories:
+                        text_probs[f"in {item}"] += prob
+                    else:
+                        text_probs[f"wearing {item}"] += prob
+                # mix and match items from the whole category
+                for item, item_prob in get_uniform_probs(cls.clothing_mix_and_match_items[(category, clothing_sex_group)]).items():
+                    text_probs[f"wearing {item}"] += (1 - stereotype_prob) * category_prob * item_prob
+        return dict(text_probs)
+
+    # batch generation
+
+    @classmethod
+    def _get_batch_tables(cls):
+        if cls._batch_tables is not None:
+            return cls._batch_tables
+
+        groups = cls.ethnicity_groups
+        sex_groups = cls.sex_groups
+        tables = {
+            'prompt_starts': _RaggedTable([cls.prompt_starts]),
+            'ethnicities': _RaggedTable([cls.ethnicities[group] for group in groups]),
+            'age_min': np.array([cls.age_ranges[age_group][0] for age_group in cls.age_groups]),
+            'age_span': np.array([cls.age_ranges[age_group][1] - cls.age_ranges[age_group][0] + 1 for age_group in cls.age_groups]),
+            'adult_sex_words': _RaggedTable([cls.adult_sex_words.get(age_group, {}).get(sex_group, ())
+                                             for age_group in cls.age_groups for sex_group in sex_groups]),
+            'expressions': _RaggedTable([cls.expressions]),
+            'locations': _RaggedTable([cls.locations_settings_backgrounds]),
+            'face_poses': _RaggedTable([cls.face_poses]),
+            'gaze_directions': _RaggedTable([cls.gaze_directions]),
+            'glasses': _RaggedTable([cls.glasses]),
+            'times_of_day': _RaggedTable([cls.times_of_day]),
+            'weather_conditions': _RaggedTable([cls.weather_conditions]),
+            'weight_descriptions': _RaggedTable([cls.weight_descriptions]),
+            'facial_hair': _RaggedTable([cls.facial_hair_descriptions]),
+            'makeup': _RaggedTable([cls.makeup_descriptions]),
+            # last row of the per group tables is the union of all groups
+            'hair_colors': _RaggedTable([cls.hair_colors.get(group, cls.all_hair_colors) for group in groups] + [cls.all_hair_colors]),
+            'hair_styles': _RaggedTable([cls.hair_styles]),
+            'eye_colors': _RaggedTable([cls.eye_colors.get(group, cls.all_eye_colors) for group in groups] + [cls.all_eye_colors]),
+            'eye_styles': _RaggedTable([cls.eye_styles]),
+            'skin_tones': _RaggedTable([cls.skin_tones.get(group, cls.all_skin_tones) for group in groups] + [cls.all_skin_tones]),
+            'skin_characteristics': _RaggedTable([cls.skin_characteristics]),
+            'headwear': _RaggedTable([cls.headwear.get(sex_group, cls.all_headwear) for sex_group in sex_groups] + [cls.all_headwear]),
+            'jewelry': _RaggedTable([cls.jewelry.get(sex_group, cls.all_jewelry) for sex_group in sex_groups] + [cls.all_jewelry]),
+            'clothing_items': _RaggedTable([cls.clothing_items[(category, sex_group)]
+                                            for category in cls.clothing_categories for sex_group in cls.clothing_sex_groups]),
+            'clothing_mix_and_match_items': _RaggedTable([cls.clothing_mix_and_match_items[(category, sex_group)]
+                                                          for category in cls.clothing_categories for sex_group in cls.clothing_sex_groups]),
+            'clothing_colors': _RaggedTable([cls.clothing_colors]),
+            'clothing_color_chars': _RaggedTable(cls.clothing_colors),
+            'clothing_patterns': _RaggedTable([cls.clothing_patterns]),
+            'clothing_category_formats': [
+                'wearing a {color} {item}' if category in cls.patterned_clothing_categories else
+                'dressed in {item}' if category in cls.dressed_in_clothing_categories else
+                'in {item}' if category in cls.worn_in_clothing_categories else
+                'wearing {item}' for category in cls.clothing_categories],
+            'clothing_is_patterned': np.array([category in cls.patterned_clothing_categories for category in cls.clothing_categories]),
+            'lighting_descriptions': _RaggedTable([cls.lighting_descriptions[category] for category in cls.lighting_categories]),
+            'modifier_probs': np.array([prob for prob, options in cls.modifier_options]),
+            'modifier_options': _RaggedTable([options for prob, options in cls.modifier_options]),
+        }
 
-    return age_sex_ethnicity_str
+        # index of every table value in the vocabulary of its prompt attribute
+        for table_name, attribute_name in [('ethnicities', 'ethnicity'), ('hair_colors', 'hair_color'), ('hair_styles', 'hair_style'),
+                                           ('eye_colors', 'eye_color'), ('eye_styles', 'eye_style'), ('skin_tones', 'skin_tone'),
+                                           ('skin_characteristics', 'skin_characteristic')]:
+            value_indices = cls._attribute_value_indices[attribute_name]
+            tables[f'{table_name}_attribute_indices'] = np.array([value_indices.get(value, -1) for value in tables[table_name].values], dtype=np.int64)
+
+        # element slot lists padded to the same length, one row per (sex group, age group)
+        max_num_slots = len(cls.makeup_element_slots)
+        element_slots = np.full((len(sex_groups), len(cls.age_groups), max_num_slots), -1, dtype=np.int64)
+        for sex_index, sex_group in enumerate(sex_groups):
+            for age_index, age_group in enumerate(cls.age_groups):
+                slots = cls._get_element_slots(sex_group, age_group)
+                element_slots[sex_index, age_index, :len(slots)] = slots
+        tables['element_slots'] = element_slots
+
+        cls._batch_tables = tables
+        return tables
+
+    @classmethod
+    def _get_element_slots(cls, sex_group, age_group):
+        if age_group in cls.adult_age_groups:
+            if sex_group == 'male':
+                return cls.facial_hair_element_slots
+            if sex_group == 'female':
+                return cls.makeup_element_slots
+        return cls.base_element_slots
+
+    def _get_numpy_generator(self):
+        if self.numpy_rng is not None:
+            return self.numpy_rng
+        return np.random.default_rng(int(self.rng.random() * 2**53))
+
+    def generate_face_prompts(self, num_prompts, ethnicity_group=None, sex_group=None, age_group=None,
+                              lighting_category=None, num_elements_to_add=None, return_attributes=False,
+                              max_prompt_tokens=None, batch_size=10000, required_elements=None, forbidden_elements=None,
+                              element_includes=None, element_excludes=None):
+        """Generate a list of `num_prompts` face prompts, same distribution as `generate_face_prompt`.
+
+        All the random draws of a batch are done at once with a `np.random.Generator`,
+        and strings are only assembled at the end for the elements that were selected.
+        Prompts with element constraints are drawn one at a time by `generate_face_prompt`.
+
+        With `return_attributes=True` a `(prompts, attributes)` tuple is returned, where
+        `attributes` holds the attribute record of all prompts as one integer array per
+        attribute (see `prompt_attribute_vocabularies`).
+        """
+
+        if required_elements or forbidden_elements or element_includes or element_excludes:
+            results = [self.generate_face_prompt(ethnicity_group, sex_group, age_group, lighting_category, num_elements_to_add, True,
+                                                 max_prompt_tokens, required_elements, forbidden_elements, element_includes, element_excludes)
+                       for _ in range(num_prompts)]
+            prompts = [prompt for prompt, prompt_attributes in results]
+            if not return_attributes:
+                return prompts
+            return prompts, {name: np.array([prompt_attributes[name] for prompt, prompt_attributes in results], dtype=np.int64)
+                             for name in self.prompt_attribute_names}
+
+        rng = self._get_numpy_generator()
+        prompts = []
+        attributes_list = []
+        for batch_start in range(0, num_prompts, batch_size):
+            batch_prompts, batch_attributes = self._generate_face_prompts_batch(rng, min(batch_size, num_prompts - batch_start), ethnicity_group,
+                                                                                sex_group, age_group, lighting_category, num_elements_to_add,
+                                                                                max_prompt_tokens)
+            prompts += batch_prompts
+            attributes_list.append(batch_attributes)
+
+        if not return_attributes:
+            return prompts
+
+        attributes = {name: np.concatenate([batch_attributes[name] for batch_attributes in attributes_list] or [np.zeros(0, dtype=np.int64)])
+                      for name in self.prompt_attribute_names}
+        return prompts, attributes
+
+    def _generate_face_prompts_batch(self, rng, n, ethnicity_group, sex_group, age_group, lighting_category, num_elements_to_add,
+                                     max_prompt_tokens=None):
+        tables = self._get_batch_tables()
+
+        def draw_category(options, value):
+            if value is None:
+                return (rng.random(n) * len(options)).astype(np.int64)
+            return np.full(n, options.index(value), dtype=np.int64)
+
+        def draw(table_name, row_indices=0):
+            return tables[table_name].draw(rng, np.broadcast_to(row_indices, (n,))).tolist()
+
+        # demographic information
+        ethnicity_group_index = draw_category(self.ethnicity_groups, ethnicity_group)
+        sex_index = draw_category(self.sex_groups, sex_group)
+        if age_group is None:
+            age_index = np.searchsorted(self.age_group_cumulative_probs, rng.random(n), side='right')
+            age_index = np.minimum(age_index, len(self.age_groups) - 1)
+        else:
+            age_index = draw_category(self.age_groups, age_group)
+        num_groups = len(self.ethnicity_groups)
+
+        # base prompt
+        prompt_start = draw('prompt_starts')
+        is_top_level_ethnicity = (rng.random(n) < 0.5).tolist()
+        ethnicity = draw('ethnicities', ethnicity_group_index)
+        age = (tables['age_min'][age_index] + (rng.random(n) * tables['age_span'][age_index]).astype(np.int64)).tolist()
+        adult_sex_word = draw('adult_sex_words', age_index * len(self.sex_groups) + sex_index)
+        is_qualified_sex_word = (rng.random(n) < 0.25).tolist()
+
+        # additional elements: pick which element slots are used
+        if num_elements_to_add is None:
+            num_elements = 4 + (rng.random(n) * 6).astype(np.int64)
+        else:
+            num_elements = np.full(n, num_elements_to_add, dtype=np.int64)
+        element_slots = tables['element_slots'][sex_index, age_index]
+        slot_keys = np.where(element_slots >= 0, rng.random(element_slots.shape), 2.0)
+        slot_order = np.argsort(slot_keys, axis=1)
+        selected_kinds = np.take_along_axis(element_slots, slot_order, axis=1).tolist()
+        num_elements = np.minimum(num_elements, (element_slots >= 0).sum(axis=1)).tolist()
+
+        # additional elements: draw the content of every kind
+        face_pose = draw('face_poses')
+        gaze_direction = draw('gaze_directions')
+        hair_color = draw('hair_colors', np.where(rng.random(n) > 0.3, num_groups, ethnicity_group_index))
+        hair_style = draw('hair_styles')
+        eye_color = draw('eye_colors', np.where(rng.random(n) > 0.3, num_groups, ethnicity_group_index))
+        eye_style = draw('eye_styles')
+        skin_tone = draw('skin_tones', np.where(rng.random(n) > 0.7, num_groups, ethnicity_group_index))
+        skin_characteristic = draw('skin_characteristics')
+        headwear = draw('headwear', np.where(rng.random(n) > 0.8, len(self.sex_groups), sex_index))
+        jewelry = draw('jewelry', np.where(rng.random(n) > 0.8, len(self.sex_groups), sex_index))
+        glasses = draw('glasses')
+        time_of_day = draw('times_of_day')
+        weather_condition = draw('weather_conditions')
+        weight_description = draw('weight_descriptions')
+        facial_hair = draw('facial_hair')
+        makeup = draw('makeup')
+
+        clothing_sex_index = np.where(rng.random(n) > 0.6, (rng.random(n) * 3).astype(np.int64), sex_index)
+        clothing_category_index = (rng.random(n) * len(self.clothing_categories)).astype(np.int64)
+        clothing_row = clothing_category_index * len(self.clothing_sex_groups) + clothing_sex_index
+        clothing_item = draw('clothing_items', clothing_row)
+        clothing_color_char = draw('clothing_color_chars', tables['clothing_colors'].draw(rng, np.zeros(n, dtype=np.int64)))
+        is_patterned = (tables['clothing_is_patterned'][clothing_category_index] & (rng.random(n) < 0.2)).tolist()
+        clothing_pattern = draw('clothing_patterns')
+        is_mix_and_match = (rng.random(n) > 0.6).tolist()
+        clothing_mix_and_match_item = draw('clothing_mix_and_match_items', clothing_row)
+        clothing_category_index = clothing_category_index.tolist()
+
+        modifier_tables = tables['modifier_options']
+        num_modifier_slots = len(self.modifier_options)
+        is_modifier_used = (rng.random((n, num_modifier_slots)) < tables['modifier_probs']).tolist()
+        modifier_option = modifier_tables.draw(rng, np.broadcast_to(np.arange(num_modifier_slots), (n, num_modifier_slots))).tolist()
+
+        lighting_category_index = draw_category(self.lighting_categories, lighting_category)
+        lighting_description = draw('lighting_descriptions', lighting_category_index)
+
+        expression = draw('expressions')
+        location = draw('locations')
+
+        # assemble the strings
+        values = {table_name: table.values for table_name, table in tables.items() if isinstance(table, _RaggedTable)}
+        clothing_formats = tables['clothing_category_formats']
+        ethnicity_groups, age_groups, sex_groups = self.ethnicity_groups, self.age_groups, self.sex_groups
+        ethnicity_group_index, age_index, sex_index = ethnicity_group_index.tolist(), age_index.tolist(), sex_index.tolist()
+
+        prompts = []
+        element_kinds_mask = np.zeros(n, dtype=np.int64)
+        num_added_elements = np.zeros(n, dtype=np.int64)
+        for i in range(n):
+            curr_ethnicity = ethnicity_groups[ethnicity_group_index[i]] if is_top_level_ethnicity[i] else values['ethnicities'][ethnicity[i]]
+            curr_age_group = age_groups[age_index[i]]
+            if curr_age_group in self.adult_sex_words:
+                sex = values['adult_sex_words'][adult_sex_word[i]]
+                if is_qualified_sex_word[i]:
+                    sex = f'{self.adult_age_qualifiers[curr_age_group]} {sex}'
+                age_sex_ethnicity = f'{age[i]} year old {curr_ethnicity} {sex}'
+            else:
+                sex = 'boy' if sex_groups[sex_index[i]] == 'male' else 'girl'
+                if curr_age_group == 'baby':
+                    age_sex_ethnicity = f'{age[i]} month old {curr_ethnicity} baby {sex}'
+                elif curr_age_group == 'toddler':
+                    age_sex_ethnicity = f'{age[i]} year old {curr_ethnicity} toddler {sex}'
+                elif curr_age_group == 'teenager':
+                    age_sex_ethnicity = f'{age[i]} year old {curr_ethnicity} teenage {sex}'
+                else:
+                    age_sex_ethnicity = f'{age[i]} year old {curr_ethnicity} {sex}'
+
+            used_kinds = []
+            selected_elements = []
+            for kind in selected_kinds[i][:num_elements[i]]:
+                if kind in used_kinds:
+                    continue
+                used_kinds.append(kind)
+                if kind == 0:
+                    element = values['face_poses'][face_pose[i]]
+                elif kind == 1:
+                    element = values['gaze_directions'][gaze_direction[i]]
+                elif kind == 2:
+                    element = f"with {values['hair_colors'][hair_color[i]]} {values['hair_styles'][hair_style[i]]}"
+                elif kind == 3:
+                    element = values['eye_styles'][eye_style[i]].format(color=values['eye_colors'][eye_color[i]])
+                elif kind == 4:
+                    element = f"{values['skin_tones'][skin_tone[i]]}, {values['skin_characteristics'][skin_characteristic[i]]} skin"
+                elif kind == 5:
+                    if is_mix_and_match[i]:
+                        element = f"wearing {values['clothing_mix_and_match_items'][clothing_mix_and_match_item[i]]}"
+                    else:
+                        color = values['clothing_patterns'][clothing_pattern[i]] if is_patterned[i] else values['clothing_color_chars'][clothing_color_char[i]]
+                        element = clothing_formats[clothing_category_index[i]].format(color=color, item=values['clothing_items'][clothing_item[i]])
+                elif kind == 6:
+                    element = values['headwear'][headwear[i]]
+                elif kind == 7:
+                    element = values['jewelry'][jewelry[i]]
+                elif kind == 8:
+                    element = values['glasses'][glasses[i]]
+                elif kind == 9:
+                    element = values['times_of_day'][time_of_day[i]]
+                elif kind == 10:
+                    element = values['weather_conditions'][weather_condition[i]]
+                elif kind == 11:
+                    element = values['weight_descriptions'][weight_description[i]]
+                elif kind == 12:
+                    element = ''.join([values['modifier_options'][option] for option, is_used in zip(modifier_option[i], is_modifier_used[i]) if is_used])[:-2]
+                elif kind == 13:
+                    element = values['lighting_descriptions'][lighting_description[i]]
+                elif kind == 14:
+                    element = values['facial_hair'][facial_hair[i]]
+                else:
+                    element = values['makeup'][makeup[i]]
+                selected_elements.append(element)
+
+            base_prompt = f"{values['prompt_starts'][prompt_start[i]]} {age_sex_ethnicity}, "
+            curr_expression = values['expressions'][expression[i]]
+            curr_location = values['locations'][location[i]]
+            if max_prompt_tokens is not None:
+                used_kinds, selected_elements = self._fit_elements_to_token_budget(
+                    [base_prompt, f"{curr_expression},", curr_location], used_kinds, selected_elements, max_prompt_tokens)
+            element_kinds_mask[i] = sum(1 << kind for kind in used_kinds)
+            num_added_elements[i] = len(used_kinds)
+
+            selected_elements = [curr_expression] + selected_elements + [curr_location]
+            prompts.append(f"{base_prompt} {', '.join(selected_elements)}")
+
+        # attribute record, the attributes of elements that were not selected are -1
+        def get_element_attribute(kind, table_name, positions):
+            return np.where(element_kinds_mask & (1 << kind), tables[f'{table_name}_attribute_indices'][positions], -1)
+
+        attributes = {
+            'ethnicity_group': np.array(ethnicity_group_index, dtype=np.int64),
+            'ethnicity': np.where(is_top_level_ethnicity, -1, tables['ethnicities_attribute_indices'][ethnicity]),
+            'sex_group': np.array(sex_index, dtype=np.int64),
+            'age_group': np.array(age_index, dtype=np.int64),
+            'age': np.array(age, dtype=np.int64),
+            'lighting_category': np.where(element_kinds_mask & (1 << 13), lighting_category_index, -1),
+            'num_elements': num_added_elements,
+            'element_kinds': element_kinds_mask,
+            'hair_color': get_element_attribute(2, 'hair_colors', hair_color),
+            'hair_style': get_element_attribute(2, 'hair_styles', hair_style),
+            'eye_color': get_element_attribute(3, 'eye_colors', eye_color),
+            'eye_style': get_element_attribute(3, 'eye_styles', eye_style),
+            'skin_tone': get_element_attribute(4, 'skin_tones', skin_tone),
+            'skin_characteristic': get_element_attribute(4, 'skin_characteristics', skin_characteristic),
+        }
+
+        return prompts, attributes
+
+_default_face_prompt_sampler = FacePromptSampler()
+
+#%% prompt token counting
+
+def _iter_vocabulary_strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _iter_vocabulary_strings(item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            yield from _iter_vocabulary_strings(item)
+
+class PromptTokenCounter:
+    """Counts prompt tokens by summing cached token counts of whitespace separated chunks.
+
+    CLIP style BPE tokenizers never merge tokens across whitespace, so the token count of
+    a text is the sum of the token counts of its chunks. The chunks of all the vocabulary
+    tables (with and without a trailing comma) are tokenized once when the counter is
+    created, any other chunk (e.g. an age) is tokenized once when first seen, so counting
+    a prompt is only a few dict lookups (whole fragments are also memoized, up to
+    `max_cached_fragments` of them). `encode` maps a text to token ids without the
+    start/end tokens; the default is the CLIP tokenizer of open_clip (SDXL and FLUX use
+    CLIP text encoders that truncate at 77 tokens).
+    """
+
+    def __init__(self, encode=None, context_length=77, num_special_tokens=2, max_cached_fragments=1_000_000):
+        if encode is None:
+            from open_clip.tokenizer import SimpleTokenizer
+            encode = SimpleTokenizer().encode
+
+        self.encode = encode
+        self.context_length = context_length
+        self.num_special_tokens = num_special_tokens
+        self.chunk_token_counts = {}
+        self.fragment_token_counts = {}
+        self.max_cached_fragments = max_cached_fragments
+
+        vocabulary_chunks = set()
+        for vocabulary_string in _iter_vocabulary_strings(list(vars(FacePromptSampler).values())):
+            for chunk in vocabulary_string.split():
+                vocabulary_chunks.update([chunk, chunk + ','])
+        for chunk in sorted(vocabulary_chunks):
+            self.chunk_token_counts[chunk] = len(self.encode(chunk))
+
+    def count_text_tokens(self, text):
+        # number of tokens of a prompt fragment, without the start/end tokens
+        num_tokens = self.fragment_token_counts.get(text)
+        if num_tokens is not None:
+            return num_tokens
+
+        num_tokens = 0
+        for chunk in text.split():
+            chunk_num_tokens = self.chunk_token_counts.get(chunk)
+            if chunk_num_tokens is None:
+                chunk_num_tokens = self.chunk_token_counts[chunk] = len(self.encode(chunk))
+            num_tokens += chunk_num_tokens
+
+        if len(self.fragment_token_counts) < self.max_cached_fragments:
+            self.fragment_token_counts[text] = num_tokens
+        return num_tokens
+
+    def count_prompt_tokens(self, prompt):
+        return self.count_text_tokens(prompt) + self.num_special_tokens
+
+    def is_truncated(self, prompt):
+        return self.count_prompt_tokens(prompt) > self.context_length
+
+_default_prompt_token_counter = None
+
+def get_prompt_token_counter():
+    # default token counter, created on first use (tokenizing the vocabularies takes a moment)
+    global _default_prompt_token_counter
+    if _default_prompt_token_counter is None:
+        _default_prompt_token_counter = PromptTokenCounter()
+    return _default_prompt_token_counter
+
+def set_prompt_token_counter(token_counter):
+    # e.g. set_prompt_token_counter(PromptTokenCounter(encode=other_tokenizer.encode, context_length=256))
+    global _default_prompt_token_counter
+    _default_prompt_token_counter = token_counter
+
+def count_prompt_tokens(prompts):
+    # token count of a prompt, or an array of token counts of a list of prompts (e.g. a dataset CSV column)
+    token_counter = get_prompt_token_counter()
+    if isinstance(prompts, str):
+        return token_counter.count_prompt_tokens(prompts)
+    return np.array([token_counter.count_prompt_tokens(prompt) for prompt in prompts], dtype=np.int64)
+
+#%% random streams
+
+def _get_sampler(rng):
+    # the module level functions make a sampler per call, unbuffered so a Generator shared across calls only advances
+    # by the uniforms actually drawn
+    return _default_face_prompt_sampler if rng is None else FacePromptSampler(rng, buffer_size=1)
+
+def get_prompt_rng(seed, *stream_index):
+    """Random generator of one independent stream of a prompt campaign.
+
+    `stream_index` identifies the stream, e.g. a worker index or an image index, so that
+    `generate_face_prompt(rng=get_prompt_rng(campaign_seed, n))` regenerates prompt n of a
+    campaign on demand. Streams are the children of `np.random.SeedSequence(seed)`, the same
+    ones returned by `spawn_prompt_rngs`.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=stream_index))
+
+def spawn_prompt_rngs(seed, num_streams):
+    return [np.random.default_rng(child_seed) for child_seed in np.random.SeedSequence(seed).spawn(num_streams)]
+
+#%% coverage balanced sampling
+
+class CoverageQuotaSampler:
+    """Steers prompt generation toward the attribute cells that are still under their quota.
+
+    A cell is a combination of `cell_attributes` values, by default
+    (age_group, sex_group, ethnicity_group, lighting_category). Every draw picks a cell
+    uniformly among the open cells (count < quota) and conditions `generate_face_prompt`
+    on it, so each generated image fills a missing cell and the target coverage is reached
+    with the minimum number of paid generations. Counts are updated in O(1) per prompt, and
+    cells are kept in an open list with swap-remove. When a generation fails, call
+    `remove_prompt(attributes)` to give its cell back. Once all the quotas are met,
+    prompts are drawn unconditioned.
+    """
+
+    cell_attribute_names = ('age_group', 'sex_group', 'ethnicity_group', 'lighting_category')
+
+    def __init__(self, quota_per_cell, cell_attributes=cell_attribute_names, cell_quotas=None, rng=None):
+        unknown_attributes = [name for name in cell_attributes if name not in self.cell_attribute_names]
+        if unknown_attributes:
+            raise ValueError(f"cell attributes must be conditioning arguments out of {self.cell_attribute_names}, got {unknown_attributes}")
+
+        self.sampler = _get_sampler(rng)
+        self.cell_attributes = tuple(cell_attributes)
+        # the lighting category is only part of the prompt when the lighting element is
+        self.required_elements = ['lighting'] if 'lighting_category' in self.cell_attributes else None
+
+        # cells are indexed in mixed radix order of the attribute codes
+        vocabularies = [FacePromptSampler.prompt_attribute_vocabularies[name] for name in self.cell_attributes]
+        self.cell_sizes = [len(vocabulary) for vocabulary in vocabularies]
+        self.cells = list(itertools.product(*vocabularies))
+        self.quotas = [quota_per_cell] * len(self.cells)
+        for cell, quota in (cell_quotas or {}).items():
+            self.quotas[self.get_cell_index(dict(zip(self.cell_attributes, cell)), encoded=False)] = quota
+        self.counts = [0] * len(self.cells)
+
+        self.open_cells = [cell_index for cell_index, quota in enumerate(self.quotas) if quota > 0]
+        self.open_cell_positions = [-1] * len(self.cells)
+        for position, cell_index in enumerate(self.open_cells):
+            self.open_cell_positions[cell_index] = position
+        self.num_missing_prompts = sum(self.quotas)
+
+    def get_cell_index(self, attributes, encoded=True):
+        # cell of an attribute record (integer codes, or values when encoded=False), None when not in any cell
+        cell_index = 0
+        for name, cell_size in zip(self.cell_attributes, self.cell_sizes):
+            code = attributes[name] if encoded else FacePromptSampler._attribute_value_indices[name][attributes[name]]
+            if code < 0:
+                return None
+            cell_index = cell_index * cell_size + code
+        return cell_index
+
+    def _close_cell(self, cell_index):
+        position = self.open_cell_positions[cell_index]
+        last_cell_index = self.open_cells.pop()
+        if last_cell_index != cell_index:
+            self.open_cells[position] = last_cell_index
+            self.open_cell_positions[last_cell_index] = position
+        self.open_cell_positions[cell_index] = -1
+
+    def _open_cell(self, cell_index):
+        self.open_cell_positions[cell_index] = len(self.open_cells)
+        self.open_cells.append(cell_index)
+
+    def add_prompt(self, attributes):
+        cell_index = self.get_cell_index(attributes)
+        if cell_index is None:
+            return
+        self.counts[cell_index] += 1
+        if self.counts[cell_index] <= self.quotas[cell_index]:
+            self.num_missing_prompts -= 1
+        if self.counts[cell_index] == self.quotas[cell_index]:
+            self._close_cell(cell_index)
+
+    def remove_prompt(self, attributes):
+        cell_index = self.get_cell_index(attributes)
+        if cell_index is None:
+            return
+        self.counts[cell_index] -= 1
+        if self.counts[cell_index] < self.quotas[cell_index]:
+            self.num_missing_prompts += 1
+        if self.counts[cell_index] == self.quotas[cell_index] - 1:
+            self._open_cell(cell_index)
+
+    def add_existing_prompts(self, attributes):
+        # struct of arrays attribute records (e.g. the attribute columns of an existing metadata CSV)
+        attribute_codes = [np.asarray(attributes[name]).tolist() for name in self.cell_attributes]
+        for codes in zip(*attribute_codes):
+            self.add_prompt(dict(zip(self.cell_attributes, codes)))
+
+    def is_complete(self):
+        return self.num_missing_prompts == 0
+
+    def generate_face_prompt(self, num_elements_to_add=None, max_prompt_tokens=None):
+        # returns (prompt, attributes) and counts the prompt in its cell
+        if not self.open_cells:
+            prompt, attributes = self.sampler.generate_face_prompt(num_elements_to_add=num_elements_to_add, return_attributes=True,
+                                                                   max_prompt_tokens=max_prompt_tokens)
+            self.add_prompt(attributes)
+            return prompt, attributes
+
+        cell_index = self.open_cells[int(self.sampler.rng.random() * len(self.open_cells))]
+        conditions_dict = dict(zip(self.cell_attributes, self.cells[cell_index]))
+
+        prompt, attributes = self.sampler.generate_face_prompt(num_elements_to_add=num_elements_to_add, return_attributes=True,
+                                                               max_prompt_tokens=max_prompt_tokens, required_elements=self.required_elements,
+                                                               **conditions_dict)
+        self.add_prompt(attributes)
+        return prompt, attributes
+
+#%% helper functions
+
+def get_prompt_start(rng=None):
+    return _get_sampler(rng).get_prompt_start()
+
+def get_random_glasses(rng=None):
+    return _get_sampler(rng).get_random_glasses()
+
+def get_random_gaze_direction(rng=None):
+    return _get_sampler(rng).get_random_gaze_direction()
+
+def ger_facial_hair_description(rng=None):
+    return _get_sampler(rng).get_facial_hair_description()
+
+def get_makeup_description(rng=None):
+    return _get_sampler(rng).get_makeup_description()
+
+def get_location_setting_background(rng=None):
+    return _get_sampler(rng).get_location_setting_background()
+
+def get_skin_description(ethnicity_group=None, stereotype_prob=0.7, rng=None):
+    return _get_sampler(rng).get_skin_description(ethnicity_group, stereotype_prob)
+
+def get_hats_and_headwear(sex_group=None, stereotype_prob=0.8, rng=None):
+    return _get_sampler(rng).get_hats_and_headwear(sex_group, stereotype_prob)
+
+def get_random_jewelry(sex_group=None, stereotype_prob=0.8, rng=None):
+    return _get_sampler(rng).get_random_jewelry(sex_group, stereotype_prob)
+
+def get_weight_description(rng=None):
+    return _get_sampler(rng).get_weight_description()
 
-def get_random_expression():
-    return random.choice(expressions_list)
+def get_random_time_of_day(rng=None):
+    return _get_sampler(rng).get_random_time_of_day()
 
-def get_lighting_atmosphere(lighting_category=None):
-    if lighting_category is None:
-        lighting_category = random.choice(list(lighting_descriptions_dict.keys()))
-    return random.choice(lighting_descriptions_dict[lighting_category])
+def get_random_weather_condition(rng=None):
+    return _get_sampler(rng).get_random_weather_condition()
 
-def get_hair_description(ethnicity_group=None, sterotype_prob=0.3):
+def get_eye_description(ethnicity_group=None, stereotype_prob=0.3, rng=None):
+    return _get_sampler(rng).get_eye_description(ethnicity_group, stereotype_prob)
 
-    all_hair_colors = get_all_unique_dict_values(hair_colors_dict)
-    if ethnicity_group is None or np.random.rand() > sterotype_prob:
-        hair_colors_list = all_hair_colors
-    else:
-        hair_colors_list = hair_colors_dict.get(ethnicity_group, all_hair_colors)
-    
-    color = random.choice(hair_colors_list)
-    style = random.choice(hair_styles_list)
-    return f"with {color} {style}"
+def get_clothing_description(sex_group=None, sterotype_prob=0.6, rng=None):
+    return _get_sampler(rng).get_clothing_description(sex_group, sterotype_prob)
 
-def get_random_face_pose():
-    return random.choice(face_poses_list)
+def get_random_modifier_string(rng=None):
+    return _get_sampler(rng).get_random_modifier_string()
+
+def get_random_ethnicity(ethnicity_group=None, top_level_prob=0.5, rng=None):
+    return _get_sampler(rng).get_random_ethnicity(ethnicity_group, top_level_prob)
+
+def get_age_sex_ethnicity(ethnicity_group=None, sex_group=None, age_group=None, rng=None):
+    return _get_sampler(rng).get_age_sex_ethnicity(ethnicity_group, sex_group, age_group)
+
+def get_random_expression(rng=None):
+    return _get_sampler(rng).get_random_expression()
+
+def get_lighting_atmosphere(lighting_category=None, rng=None):
+    return _get_sampler(rng).get_lighting_atmosphere(lighting_category)
+
+def get_hair_description(ethnicity_group=None, sterotype_prob=0.3, rng=None):
+    return _get_sampler(rng).get_hair_description(ethnicity_group, sterotype_prob)
+
+def get_random_face_pose(rng=None):
+    return _get_sampler(rng).get_random_face_pose()
 
 
 #%% main face prompt generator function
 
 def generate_face_prompt(ethnicity_group=None, sex_group=None, age_group=None,
-                         lighting_category=None, num_elements_to_add=None):
-    
-    # Sample demographic information
-    if ethnicity_group is None:
-        ethnicity_group = random.choice(list(ethnicities_dict.keys()))
-    if sex_group is None:
-        sex_group = np.random.choice(['male', 'female'], p=[0.5, 0.5])
-    if age_group is None:
-        age_group = np.random.choice(['baby', 'toddler', 'child', 'teenager', 'young adult', 'middle-aged', 'elderly'],
-                                     p=[0.05, 0.05, 0.05, 0.2, 0.2, 0.2, 0.25])
-
-    # Generate base prompt
-    prompt_start = get_prompt_start()
-    age_sex_ethnicity = get_age_sex_ethnicity(ethnicity_group, sex_group, age_group)
-    base_prompt = f"{prompt_start} {age_sex_ethnicity}, "
-
-    # Generate additional elements
-    elements = [
-        get_random_face_pose(),
-        get_random_gaze_direction(),
-        get_hair_description(ethnicity_group),
-        get_eye_description(ethnicity_group),
-        get_skin_description(ethnicity_group),
-        get_clothing_description(sex_group),
-        get_hats_and_headwear(sex_group),
-        get_random_jewelry(sex_group),
-        get_random_glasses(),
-        get_random_time_of_day(),
-        get_random_weather_condition(),
-        get_weight_description(),
-        get_random_modifier_string(),
-        get_lighting_atmosphere(lighting_category),
-    ]
-    elements = elements + elements[-3:]  # repeat last 3 elements to increase their probability
-    
-    # add facial hair possibility when needed
+                         lighting_category=None, num_elements_to_add=None, return_attributes=False,
+                         max_prompt_tokens=None, rng=None, required_elements=None, forbidden_elements=None,
+                         element_includes=None, element_excludes=None):
+    return _get_sampler(rng).generate_face_prompt(ethnicity_group, sex_group, age_group,
+                                                  lighting_category, num_elements_to_add, return_attributes, max_prompt_tokens,
+                                                  required_elements, forbidden_elements, element_includes, element_excludes)
+
+def generate_face_prompts(num_prompts, ethnicity_group=None, sex_group=None, age_group=None,
+                          lighting_category=None, num_elements_to_add=None, return_attributes=False,
+                          max_prompt_tokens=None, rng=None, required_elements=None, forbidden_elements=None,
+                          element_includes=None, element_excludes=None):
+    return _get_sampler(rng).generate_face_prompts(num_prompts, ethnicity_group, sex_group, age_group,
+                                                   lighting_category, num_elements_to_add, return_attributes, max_prompt_tokens,
+                                                   required_elements=required_elements, forbidden_elements=forbidden_elements,
+                                                   element_includes=element_includes, element_excludes=element_excludes)
+
+def decode_prompt_attributes(attributes):
+    # integer coded attribute record (of one prompt or of many) -> readable values, None for missing attributes
+    decoded_attributes = {}
+    for name, values in attributes.items():
+        vocabulary = FacePromptSampler.prompt_attribute_vocabularies.get(name)
+        if name == 'element_kinds':
+            decode = lambda mask: [kind for index, kind in enumerate(vocabulary) if int(mask) >> index & 1]
+        elif vocabulary is not None:
+            decode = lambda index: vocabulary[index] if index >= 0 else None
+        else:
+            decode = int
+        decoded_attributes[name] = [decode(value) for value in values] if np.ndim(values) > 0 else decode(values)
+    return decoded_attributes
+
+def get_element_kind_inclusion_probs(sex_group, age_group, num_elements_to_add):
+    # exact probability of each element kind to appear in a prompt, for a given number of elements to add
+    element_slots = FacePromptSampler._get_element_slots(sex_group, age_group)
+    num_slots = len(element_slots)
+    k = min(num_elements_to_add, num_slots)
+    inclusion_probs = {}
+    for slot in dict.fromkeys(element_slots):
+        multiplicity = element_slots.count(slot)
+        inclusion_probs[FacePromptSampler.element_kinds[slot]] = 1 - math.comb(num_slots - multiplicity, k) / math.comb(num_slots, k)
+    return inclusion_probs
+
+def simulate_original_element_kinds(sex_group, age_group, num_elements_to_add=None, rng=random):
+    # reference: the element kinds picked by the original list construction of generate_face_prompt, independent of the
+    # element slot tables. the last 3 elements were repeated, facial hair added once, makeup three times, a subset drawn
+    # with random.sample and duplicates removed
+    elements = ['face_pose', 'gaze_direction', 'hair', 'eyes', 'skin', 'clothing', 'headwear', 'jewelry',
+                'glasses', 'time_of_day', 'weather', 'weight', 'modifiers', 'lighting']
+    elements = elements + elements[-3:]
     if sex_group == 'male' and age_group in ['teenager', 'young adult', 'middle-aged', 'elderly']:
-        elements.append(ger_facial_hair_description())
-
-    # add makeup possibility when needed
+        elements.append('facial_hair')
     if sex_group == 'female' and age_group in ['teenager', 'young adult', 'middle-aged', 'elderly']:
-        elements.append(get_makeup_description())
-        elements = elements + [elements[-1]] # repeat makeup description to increase its probability
-        elements = elements + [elements[-1]] # repeat makeup description to increase its probability
-
-    # Randomly select subset of elements
+        elements.append('makeup')
+        elements = elements + [elements[-1]]
+        elements = elements + [elements[-1]]
     if num_elements_to_add is None:
-        num_elements_to_add = random.randint(4, 9)
-    selected_elements = random.sample(elements, min(num_elements_to_add, len(elements)))
-    selected_elements = list(set(selected_elements)) # remove duplicates
-    selected_elements = [get_random_expression()] + selected_elements # always add expression at the beginning
-    selected_elements.append(get_location_setting_background()) # always add location setting background at the end
-
-    # Combine base prompt with selected elements
-    full_prompt = f"{base_prompt} {', '.join(selected_elements)}"
-
-    return full_prompt
+        num_elements_to_add = rng.randint(4, 9)
+    return set(rng.sample(elements, min(num_elements_to_add, len(elements))))
+
+def check_element_kind_distribution(num_prompts=2000, rng=None, max_abs_z_score=5.0, num_elements_options=(None, 4, 9)):
+    # statistical test: the frequency of every element kind, and of every number of distinct kinds, in the prompts of
+    # generate_face_prompt and of generate_face_prompts vs. a simulation of the original list construction, for every
+    # sex and age group. two proportion z-test per frequency, fails when any |z| reaches max_abs_z_score
+    sampler = _get_sampler(rng)
+    reference_rng = random.Random(sampler.rng.random())
+    element_kinds = FacePromptSampler.element_kinds
+
+    def get_frequencies(kinds_list):
+        counts = Counter()
+        for kinds in kinds_list:
+            counts.update(kinds)
+            counts[len(kinds)] += 1
+        return {key: count / len(kinds_list) for key, count in counts.items()}
+
+    def decode_kinds(mask):
+        return [kind for index, kind in enumerate(element_kinds) if int(mask) >> index & 1]
+
+    all_passed = True
+    for sex_group in FacePromptSampler.sex_groups:
+        for age_group in FacePromptSampler.age_groups:
+            for num_elements_to_add in num_elements_options:
+                reference_frequencies = get_frequencies([simulate_original_element_kinds(sex_group, age_group, num_elements_to_add, reference_rng)
+                                                         for _ in range(num_prompts)])
+                single_kinds = [decode_kinds(sampler.generate_face_prompt(sex_group=sex_group, age_group=age_group, num_elements_to_add=num_elements_to_add,
+                                                                          return_attributes=True)[1]['element_kinds'])
+                                for _ in range(num_prompts)]
+                batch_masks = sampler.generate_face_prompts(num_prompts, sex_group=sex_group, age_group=age_group, num_elements_to_add=num_elements_to_add,
+                                                            return_attributes=True)[1]['element_kinds']
+                for path_name, kinds_list in [('single', single_kinds), ('batch', [decode_kinds(mask) for mask in batch_masks])]:
+                    frequencies = get_frequencies(kinds_list)
+                    z_scores = {}
+                    for key in set(reference_frequencies) | set(frequencies):
+                        p_reference, p = reference_frequencies.get(key, 0.0), frequencies.get(key, 0.0)
+                        p_pooled = (p_reference + p) / 2
+                        if 0 < p_pooled < 1:
+                            z_scores[key] = (p - p_reference) / math.sqrt(2 * p_pooled * (1 - p_pooled) / num_prompts)
+                    worst_key = max(z_scores, key=lambda key: abs(z_scores[key]))
+                    passed = abs(z_scores[worst_key]) < max_abs_z_score
+                    all_passed = all_passed and passed
+                    worst_name = f'{worst_key} kinds' if isinstance(worst_key, int) else worst_key
+                    print(f'{sex_group:>6}, {age_group:>11}, {num_elements_to_add or "4-9"} elements, {path_name:>6}: '
+                          f'max |z| = {abs(z_scores[worst_key]):.2f} ({worst_name}) -> {"passed" if passed else "FAILED"}')
+
+    return all_passed
 
 def display_conditions(conditions_dict):
     print('Conditions:')
@@ -1444,6 +2724,7 @@ if __name__ == "__main__":
     num_samples_per_type = 10
     show_conditional_sampling = True
     show_conditional_sampling = False
+    check_element_probabilities = False  # slow statistical check of the element kind selection, see check_element_kind_distribution
     print("Generating face prompts...\n")
 
     all_ethinicity_groups = list(ethnicities_dict.keys())
@@ -1520,4 +2801,11 @@ if __name__ == "__main__":
         print('=' * 100)
         print('\n\n')
 
+    if check_element_probabilities:
+        print('=' * 100)
+        print("4. Element kind probabilities (single and batch generation vs. the original list construction):")
+        element_probabilities_passed = check_element_kind_distribution()
+        print(f'Element kind distribution check {"passed" if element_probabilities_passed else "FAILED"}')
+        print('=' * 100)
+
 # %%
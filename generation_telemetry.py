@@ -0,0 +1,216 @@
+#%% Imports
+
+import os
+import json
+import time
+import random
+from collections import deque
+
+#%% Stage timings
+
+STAGE_NAMES = ['queue_wait', 'generate', 'api', 'download', 'decode', 'encode', 'write']
+QUANTILES = [0.5, 0.95, 0.99]
+
+def format_stage_timings(stage_timings):
+    # the stage timings of one image as the json string saved in its metadata row (seconds, millisecond resolution)
+    return json.dumps({stage: round(duration_sec, 3) for stage, duration_sec in stage_timings.items()})
+
+def get_quantile(sorted_values, quantile):
+    # nearest rank quantile of an already sorted list
+    return sorted_values[min(len(sorted_values) - 1, int(quantile * len(sorted_values)))]
+
+#%% Telemetry
+
+class GenerationTelemetry:
+    """Live timings, throughput, error rate and cost of the image generation runs, per model.
+
+    Every image reports the duration of its stages (see STAGE_NAMES): `queue_wait` in the work
+    queue, `generate` for the whole API call including rate control waits and retries, `api` from
+    submitting the request to its result, `download` of the result image, and `decode`, `encode`
+    and `write` of the saved JPEG. Stage percentiles are computed over the last `window_size`
+    images of each model, images per hour over the last `rate_window_sec` seconds, and the cost is
+    the number of images times `cost_per_image_usd[model]`.
+
+    The metrics are written to `metrics_path` at most every `export_interval_sec` seconds while
+    images are recorded, and on `export()`, in the Prometheus text format (e.g. for the textfile
+    collector of node_exporter) or as JSON. The file is replaced atomically so a reader never sees
+    a partial export.
+    """
+
+    def __init__(self, metrics_path=None, export_format='prometheus', export_interval_sec=30.0, cost_per_image_usd=None,
+                 model_providers=None, window_size=1000, rate_window_sec=600.0, metric_prefix='sfhq_t2i', clock=time.monotonic):
+        if export_format not in ['prometheus', 'json']:
+            raise ValueError(f"unknown export_format '{export_format}', expected 'prometheus' or 'json'")
+
+        self.metrics_path = metrics_path
+        self.export_format = export_format
+        self.export_interval_sec = export_interval_sec
+        self.cost_per_image_usd = cost_per_image_usd or {}
+        self.model_providers = model_providers or {}
+        self.window_size = window_size
+        self.rate_window_sec = rate_window_sec
+        self.metric_prefix = metric_prefix
+        self.clock = clock  # time source in seconds, replaceable by a simulated clock
+
+        self.model_stats = {}
+        self.last_export_time = clock()
+
+    def _get_model_stats(self, model):
+        if model not in self.model_stats:
+            self.model_stats[model] = {
+                'start_time': self.clock(),
+                'num_images': 0,
+                'num_failures': 0,
+                'recent_image_times': deque(),
+                'recent_stage_durations': {},
+                'stage_sum_sec': {},
+                'stage_count': {},
+            }
+        return self.model_stats[model]
+
+    def start_run(self, model):
+        # starts the images per hour clock of the model, before its first image completes
+        self._get_model_stats(model)
+
+    def record_image(self, model, stage_timings):
+        stats = self._get_model_stats(model)
+        now = self.clock()
+        stats['num_images'] += 1
+        stats['recent_image_times'].append(now)
+        for stage, duration_sec in stage_timings.items():
+            if stage not in stats['recent_stage_durations']:
+                stats['recent_stage_durations'][stage] = deque(maxlen=self.window_size)
+                stats['stage_sum_sec'][stage] = 0.0
+                stats['stage_count'][stage] = 0
+            stats['recent_stage_durations'][stage].append(duration_sec)
+            stats['stage_sum_sec'][stage] += duration_sec
+            stats['stage_count'][stage] += 1
+        self.maybe_export()
+
+    def record_failure(self, model):
+        # a sample that produced no image after all its retries
+        self._get_model_stats(model)['num_failures'] += 1
+        self.maybe_export()
+
+    def get_model_metrics(self, model):
+        stats = self.model_stats[model]
+        now = self.clock()
+        recent_image_times = stats['recent_image_times']
+        while recent_image_times and recent_image_times[0] < now - self.rate_window_sec:
+            recent_image_times.popleft()
+        rate_duration_sec = max(1e-6, min(self.rate_window_sec, now - stats['start_time']))
+        num_samples = stats['num_images'] + stats['num_failures']
+
+        stage_metrics = {}
+        for stage, recent_durations in stats['recent_stage_durations'].items():
+            sorted_durations = sorted(recent_durations)
+            stage_metrics[stage] = {f'p{int(100 * quantile)}': get_quantile(sorted_durations, quantile) for quantile in QUANTILES}
+            stage_metrics[stage]['sum_sec'] = stats['stage_sum_sec'][stage]
+            stage_metrics[stage]['count'] = stats['stage_count'][stage]
+
+        return {
+            'provider': self.model_providers.get(model, 'unknown'),
+            'num_images': stats['num_images'],
+            'num_failures': stats['num_failures'],
+            'error_rate': stats['num_failures'] / num_samples if num_samples > 0 else 0.0,
+            'images_per_hour': 3600 * len(recent_image_times) / rate_duration_sec,
+            'cost_usd': stats['num_images'] * self.cost_per_image_usd.get(model, 0.0),
+            'stages': stage_metrics,
+        }
+
+    def get_metrics(self):
+        return {model: self.get_model_metrics(model) for model in self.model_stats}
+
+    def get_summary(self, model):
+        if model not in self.model_stats:
+            return f"{model}: no images"
+        metrics = self.get_model_metrics(model)
+        stages = ", ".join(f"{stage} {metrics['stages'][stage]['p50']:.2f}/{metrics['stages'][stage]['p95']:.2f}"
+                           for stage in STAGE_NAMES if stage in metrics['stages'])
+        return (f"{model}: {metrics['images_per_hour']:.0f} images per hour, error rate {metrics['error_rate']:.1%}, "
+                f"cost ${metrics['cost_usd']:.2f}, p50/p95 sec: {stages}")
+
+    def format_prometheus(self):
+        metrics = self.get_metrics()
+        prefix = self.metric_prefix
+        lines = []
+
+        def add_metric(name, metric_type, help_text, get_value):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for model, model_metrics in metrics.items():
+                lines.append(f'{prefix}_{name}{{model="{model}",provider="{model_metrics["provider"]}"}} {get_value(model_metrics)}')
+
+        add_metric('images_total', 'counter', "Images generated and saved.", lambda m: m['num_images'])
+        add_metric('failures_total', 'counter', "Samples that produced no image after all retries.", lambda m: m['num_failures'])
+        add_metric('error_rate', 'gauge', "Fraction of the samples that produced no image.", lambda m: m['error_rate'])
+        add_metric('images_per_hour', 'gauge', f"Images per hour over the last {self.rate_window_sec:.0f} seconds.", lambda m: m['images_per_hour'])
+        add_metric('cost_usd_total', 'counter', "Estimated cost of the generated images in USD.", lambda m: m['cost_usd'])
+
+        lines.append(f"# HELP {prefix}_stage_seconds Duration of each stage of an image, quantiles over the last {self.window_size} images.")
+        lines.append(f"# TYPE {prefix}_stage_seconds summary")
+        for model, model_metrics in metrics.items():
+            for stage, stage_metrics in model_metrics['stages'].items():
+                labels = f'model="{model}",provider="{model_metrics["provider"]}",stage="{stage}"'
+                for quantile in QUANTILES:
+                    lines.append(f'{prefix}_stage_seconds{{{labels},quantile="{quantile}"}} {stage_metrics[f"p{int(100 * quantile)}"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{{labels}}} {stage_metrics["sum_sec"]}')
+                lines.append(f'{prefix}_stage_seconds_count{{{labels}}} {stage_metrics["count"]}')
+
+        return "\n".join(lines) + "\n"
+
+    def format_json(self):
+        return json.dumps({'time': time.time(), 'models': self.get_metrics()}, indent=2)
+
+    def export(self):
+        self.last_export_time = self.clock()
+        if self.metrics_path is None:
+            return
+        content = self.format_prometheus() if self.export_format == 'prometheus' else self.format_json()
+        temp_path = self.metrics_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(content)
+        os.replace(temp_path, self.metrics_path)
+
+    def maybe_export(self):
+        if self.clock() - self.last_export_time >= self.export_interval_sec:
+            self.export()
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    # simulated run of two models with 10 concurrent calls, where the API dominates FLUX1_dev and the download dominates DALLE3
+    metrics_path = r"generation_metrics.prom"
+    export_format = 'prometheus'
+    num_samples = 500
+    num_concurrent_calls = 10
+
+    simulated_time_sec = 0.0
+    telemetry = GenerationTelemetry(metrics_path, export_format=export_format, export_interval_sec=60.0,
+                                    cost_per_image_usd={'FLUX1_dev': 0.025, 'DALLE3': 0.04},
+                                    model_providers={'FLUX1_dev': 'fal', 'DALLE3': 'openai'}, clock=lambda: simulated_time_sec)
+    for model, api_sec, download_sec in [('FLUX1_dev', 8.0, 0.3), ('DALLE3', 2.0, 4.0)]:
+        telemetry.start_run(model)
+        for _ in range(num_samples):
+            if random.random() < 0.05:
+                telemetry.record_failure(model)
+                continue
+            stage_timings = {
+                'queue_wait': random.expovariate(10),
+                'api': random.lognormvariate(0, 0.3) * api_sec,
+                'download': random.lognormvariate(0, 0.5) * download_sec,
+                'decode': random.uniform(0.02, 0.04),
+                'encode': random.uniform(0.03, 0.06),
+                'write': random.uniform(0.001, 0.01),
+            }
+            stage_timings['generate'] = stage_timings['api'] + stage_timings['download']
+            simulated_time_sec += sum(stage_timings.values()) / num_concurrent_calls
+            telemetry.record_image(model, stage_timings)
+        print(telemetry.get_summary(model))
+
+    telemetry.export()
+    print(f"\nMetrics saved to '{metrics_path}':\n")
+    print(telemetry.format_prometheus() if export_format == 'prometheus' else telemetry.format_json())
+
+#%%
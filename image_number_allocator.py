@@ -0,0 +1,138 @@
+#%% Imports
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+import contextlib
+import multiprocessing
+
+#%% Allocator
+
+class ImageNumberAllocator:
+    """Hands out unique image numbers per model prefix to any number of generator processes.
+
+    The next free number of every model prefix is kept in a small SQLite database. A process takes
+    leases of `lease_size` consecutive numbers in short write transactions and hands them out
+    locally, so processes on one or several machines that share the database never get the same
+    `{model}_image_{n:07d}.jpg` name, and no process scans the image folder at startup. The first
+    number of a prefix the database does not know yet comes from `get_initial_number(model_prefix)`
+    (e.g. the highest number already in the image folder), called once per dataset. `release()`
+    gives back the unused end of the current leases when no other process took a lease since, other
+    unused numbers are left as gaps. Every lease is recorded with its owner (host and process id).
+
+    The database must be on a filesystem whose file locks work for all the processes (a local disk,
+    or a network share with working locks), and `exclusive()` holds its write lock, e.g. to append
+    to the dataset CSV from several processes.
+    """
+
+    def __init__(self, db_path, lease_size=100, get_initial_number=None, timeout_sec=60.0):
+        self.db_path = db_path
+        self.lease_size = lease_size
+        self.get_initial_number = get_initial_number
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.leases = {}  # model_prefix -> [next_number, stop_number]
+        self.lock = threading.RLock()
+
+        # autocommit mode, the write transactions are explicit BEGIN IMMEDIATE ... COMMIT blocks
+        self.connection = sqlite3.connect(db_path, timeout=timeout_sec, isolation_level=None, check_same_thread=False)
+        with self.exclusive():
+            self.connection.execute("CREATE TABLE IF NOT EXISTS image_number_counters "
+                                    "(model_prefix TEXT PRIMARY KEY, next_number INTEGER NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS image_number_leases "
+                                    "(model_prefix TEXT NOT NULL, first_number INTEGER NOT NULL, stop_number INTEGER NOT NULL, "
+                                    "owner TEXT NOT NULL, lease_time REAL NOT NULL)")
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        # the database write lock, held by at most one process (and one thread) at a time
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def _get_next_number(self, model_prefix):
+        row = self.connection.execute("SELECT next_number FROM image_number_counters WHERE model_prefix = ?", (model_prefix,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _take_lease(self, model_prefix):
+        if self._get_next_number(model_prefix) is None:
+            # outside the write lock, the slow initial count does not block the other processes
+            initial_number = self.get_initial_number(model_prefix) if self.get_initial_number is not None else 0
+            with self.exclusive():
+                self.connection.execute("INSERT OR IGNORE INTO image_number_counters (model_prefix, next_number) VALUES (?, ?)",
+                                        (model_prefix, initial_number + 1))
+
+        with self.exclusive():
+            first_number = self._get_next_number(model_prefix)
+            stop_number = first_number + self.lease_size
+            self.connection.execute("UPDATE image_number_counters SET next_number = ? WHERE model_prefix = ?", (stop_number, model_prefix))
+            self.connection.execute("INSERT INTO image_number_leases (model_prefix, first_number, stop_number, owner, lease_time) "
+                                    "VALUES (?, ?, ?, ?, ?)", (model_prefix, first_number, stop_number, self.owner, time.time()))
+        self.leases[model_prefix] = [first_number, stop_number]
+
+    def allocate(self, model_prefix):
+        with self.lock:
+            lease = self.leases.get(model_prefix)
+            if lease is None or lease[0] >= lease[1]:
+                self._take_lease(model_prefix)
+                lease = self.leases[model_prefix]
+            lease[0] += 1
+            return lease[0] - 1
+
+    def release(self):
+        with self.lock:
+            with self.exclusive():
+                for model_prefix, (next_number, stop_number) in self.leases.items():
+                    if next_number < stop_number:
+                        self.connection.execute("UPDATE image_number_counters SET next_number = ? WHERE model_prefix = ? AND next_number = ?",
+                                                (next_number, model_prefix, stop_number))
+            self.leases = {}
+
+    def close(self):
+        self.release()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+#%% Usage
+
+def allocate_numbers(db_path, model_prefix, num_numbers, lease_size):
+    with ImageNumberAllocator(db_path, lease_size=lease_size) as allocator:
+        return [allocator.allocate(model_prefix) for _ in range(num_numbers)]
+
+if __name__ == "__main__":
+
+    # several processes allocate numbers from the same database at the same time, every number is handed out once
+    db_path = r"image_numbers_demo.sqlite"
+    num_processes = 4
+    num_numbers_per_process = 1000
+    lease_size = 50
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    start_time = time.time()
+    with multiprocessing.Pool(num_processes) as pool:
+        allocated_numbers = pool.starmap(allocate_numbers, [(db_path, 'FLUX1_dev', num_numbers_per_process, lease_size)] * num_processes)
+    duration_sec = time.time() - start_time
+
+    all_numbers = [number for numbers in allocated_numbers for number in numbers]
+    print(f"{num_processes} processes allocated {len(all_numbers)} numbers in {duration_sec:.2f} seconds, "
+          f"{len(set(all_numbers))} unique, from {min(all_numbers)} to {max(all_numbers)}")
+
+    with ImageNumberAllocator(db_path) as allocator:
+        print(f"Next free number: {allocator.allocate('FLUX1_dev')}")
+    os.remove(db_path)
+
+#%%
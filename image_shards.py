@@ -0,0 +1,270 @@
+#%% Imports
+
+import os
+import re
+import io
+import csv
+import json
+import time
+import tarfile
+import threading
+import pandas as pd
+from PIL import Image
+from tqdm import tqdm
+
+#%% Shard index
+
+SHARD_INDEX_COLUMNS = ['image_filename', 'shard_filename', 'offset', 'size', 'metadata_offset', 'metadata_size']
+
+def get_shard_index_path(shard_folder, shard_prefix):
+    return os.path.join(shard_folder, f"{shard_prefix}_index.csv")
+
+def read_shard_index(shard_folder, shard_prefix):
+    # image_filename -> (shard_filename, offset, size, metadata_offset, metadata_size), a last line that was cut off by a
+    # crash is skipped (its sample is still in the shard, but cannot be served without a full index line)
+    index = {}
+    index_path = get_shard_index_path(shard_folder, shard_prefix)
+    if not os.path.exists(index_path):
+        return index
+    with open(index_path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                index[row['image_filename']] = (row['shard_filename'], int(row['offset']), int(row['size']),
+                                                int(row['metadata_offset']), int(row['metadata_size']))
+            except (TypeError, ValueError):
+                print(f"Skipping an incomplete line of the shard index '{index_path}'")
+    return index
+
+#%% Writer and reader
+
+class ShardWriter:
+    """Appends images and their metadata rows to size bounded tar shards, with an index of byte offsets.
+
+    Every sample is stored WebDataset style as two consecutive tar members with the same key, the
+    image filename without its extension: `<key>.jpg` with the JPEG bytes and `<key>.json` with the
+    metadata row. A shard is closed once adding a sample would make it larger than
+    `max_shard_size_bytes`, and shards are named `<shard_prefix>_000000.tar`, `..._000001.tar`, ...
+    so they can be streamed in order as plain sequential reads. The index file
+    (`<shard_prefix>_index.csv`) gets one line per sample with the byte offset and size of its
+    image and metadata in its shard, which ShardReader uses to serve any image without unpacking.
+
+    A sample is written once both its image (`add_image`) and its metadata row (`add_metadata`, or
+    calling the writer, so it can be used as a result sink) were added, or directly with `write`.
+    Reopening a shard folder continues with a new shard after the existing ones and keeps their
+    index, so an interrupted run loses at most the samples that were not written yet.
+    """
+
+    def __init__(self, shard_folder, shard_prefix='SFHQ_T2I_shard', max_shard_size_bytes=1024**3):
+        self.shard_folder = shard_folder
+        self.shard_prefix = shard_prefix
+        self.max_shard_size_bytes = max_shard_size_bytes
+        os.makedirs(shard_folder, exist_ok=True)
+
+        self.index = read_shard_index(shard_folder, shard_prefix)
+        shard_pattern = re.compile(rf"{re.escape(shard_prefix)}_(\d+)\.tar")
+        shard_numbers = [int(match.group(1)) for match in map(shard_pattern.fullmatch, os.listdir(shard_folder)) if match]
+        self.next_shard_number = max(shard_numbers, default=-1) + 1
+
+        index_path = get_shard_index_path(shard_folder, shard_prefix)
+        write_header = not os.path.exists(index_path)
+        ends_with_newline = write_header or os.path.getsize(index_path) == 0
+        if not ends_with_newline:
+            with open(index_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                ends_with_newline = f.read(1) == b'\n'
+        self.index_file = open(index_path, 'a', newline='', encoding='utf-8')
+        self.index_writer = csv.writer(self.index_file)
+        if write_header:
+            self.index_writer.writerow(SHARD_INDEX_COLUMNS)
+        elif not ends_with_newline:
+            self.index_file.write('\n')  # ends a line that was cut off by a crash, so new lines are not appended to it
+        self.index_file.flush()
+
+        self.tar = None
+        self.shard_filename = None
+        self.pending_images = {}
+        self.pending_metadata = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, image_filename):
+        return image_filename in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def image_filenames(self):
+        return list(self.index)
+
+    def add_image(self, image_filename, image_bytes):
+        # thread safe, e.g. from the threads that encode the images
+        with self.lock:
+            if image_filename in self.pending_metadata:
+                self._write_sample(image_filename, image_bytes, self.pending_metadata.pop(image_filename))
+            else:
+                self.pending_images[image_filename] = bytes(image_bytes)
+
+    def add_metadata(self, metadata_row):
+        # thread safe, the row of a sample that was already written is skipped (e.g. when a result sink passes it again)
+        with self.lock:
+            image_filename = metadata_row['image_filename']
+            if image_filename in self.index:
+                return
+            if image_filename in self.pending_images:
+                self._write_sample(image_filename, self.pending_images.pop(image_filename), metadata_row)
+            else:
+                self.pending_metadata[image_filename] = metadata_row
+
+    def __call__(self, metadata_row):
+        self.add_metadata(metadata_row)
+
+    def write(self, image_filename, image_bytes, metadata_row):
+        with self.lock:
+            self._write_sample(image_filename, image_bytes, metadata_row)
+
+    def _add_member(self, member_name, data):
+        # returns the offset of the member data in the shard
+        tar_info = tarfile.TarInfo(member_name)
+        tar_info.size = len(data)
+        tar_info.mtime = int(time.time())
+        tar_info.mode = 0o644
+        self.tar.addfile(tar_info, io.BytesIO(data))
+        return self.tar.offset - tarfile.BLOCKSIZE * ((len(data) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE)
+
+    def _write_sample(self, image_filename, image_bytes, metadata_row):
+        key, extension = os.path.splitext(image_filename)
+        metadata_bytes = json.dumps(metadata_row).encode('utf-8')
+        sample_size = len(image_bytes) + len(metadata_bytes) + 4 * tarfile.BLOCKSIZE
+        if self.tar is not None and self.tar.offset > 0 and self.tar.offset + sample_size > self.max_shard_size_bytes:
+            self._close_shard()
+        if self.tar is None:
+            self.shard_filename = f"{self.shard_prefix}_{self.next_shard_number:06d}.tar"
+            self.next_shard_number += 1
+            self.tar = tarfile.open(os.path.join(self.shard_folder, self.shard_filename), 'w')
+
+        offset = self._add_member(key + extension, image_bytes)
+        metadata_offset = self._add_member(key + '.json', metadata_bytes)
+        self.tar.fileobj.flush()
+
+        # the index line is written after its sample, so every indexed sample can be read back after a crash
+        self.index_writer.writerow([image_filename, self.shard_filename, offset, len(image_bytes), metadata_offset, len(metadata_bytes)])
+        self.index_file.flush()
+        self.index[image_filename] = (self.shard_filename, offset, len(image_bytes), metadata_offset, len(metadata_bytes))
+
+    def _close_shard(self):
+        self.tar.close()
+        with open(os.path.join(self.shard_folder, self.shard_filename), 'rb') as f:
+            os.fsync(f.fileno())
+        self.tar = None
+
+    def close(self):
+        with self.lock:
+            if self.pending_images or self.pending_metadata:
+                print(f"Shards: {len(self.pending_images)} images without metadata and {len(self.pending_metadata)} metadata rows without image were not written")
+            if self.tar is not None:
+                self._close_shard()
+            if not self.index_file.closed:
+                os.fsync(self.index_file.fileno())
+                self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ShardReader:
+    """Random access to the images and metadata rows of the tar shards written by ShardWriter.
+
+    Any image is served by its `image_filename` with a single seek and read in its shard, through
+    the index file, without unpacking the shards. Iterating yields the image filenames in the order
+    they were written, which reads the shards sequentially.
+    """
+
+    def __init__(self, shard_folder, shard_prefix='SFHQ_T2I_shard'):
+        self.shard_folder = shard_folder
+        self.shard_prefix = shard_prefix
+        self.index = read_shard_index(shard_folder, shard_prefix)
+        self.shard_files = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, image_filename):
+        return image_filename in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def _read(self, shard_filename, offset, size):
+        with self.lock:
+            if shard_filename not in self.shard_files:
+                self.shard_files[shard_filename] = open(os.path.join(self.shard_folder, shard_filename), 'rb')
+            shard_file = self.shard_files[shard_filename]
+            shard_file.seek(offset)
+            return shard_file.read(size)
+
+    def read_image_bytes(self, image_filename):
+        shard_filename, offset, size, _, _ = self.index[image_filename]
+        return self._read(shard_filename, offset, size)
+
+    def read_metadata(self, image_filename):
+        shard_filename, _, _, metadata_offset, metadata_size = self.index[image_filename]
+        return json.loads(self._read(shard_filename, metadata_offset, metadata_size))
+
+    def open_image(self, image_filename):
+        return Image.open(io.BytesIO(self.read_image_bytes(image_filename)))
+
+    def close(self):
+        with self.lock:
+            for shard_file in self.shard_files.values():
+                shard_file.close()
+            self.shard_files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+#%% Packing an image folder
+
+def pack_image_folder(image_folder, csv_path, shard_folder, shard_prefix='SFHQ_T2I_shard', max_shard_size_bytes=1024**3):
+    # appends the images of an existing dataset folder, with their rows of the dataset CSV, to tar shards
+    # (images already in the shards are skipped). returns the number of images packed
+    metadata_df = pd.read_csv(csv_path)
+    num_packed = 0
+    with ShardWriter(shard_folder, shard_prefix, max_shard_size_bytes) as shard_writer:
+        for row in tqdm(metadata_df.to_dict('records'), desc="Packing images into shards"):
+            image_path = os.path.join(image_folder, row['image_filename'])
+            if row['image_filename'] in shard_writer or not os.path.exists(image_path):
+                continue
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+            shard_writer.write(row['image_filename'], image_bytes, {key: value for key, value in row.items() if not pd.isna(value)})
+            num_packed += 1
+    return num_packed
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    # packs an existing dataset folder (images + CSV) into tar shards, then reads back a few images by filename
+    output_db_folder = r"datasample_002"
+    image_folder = os.path.join(output_db_folder, "images")
+    csv_path = os.path.join(output_db_folder, "SFHQ_T2I_dataset.csv")
+    shard_folder = os.path.join(output_db_folder, "shards")
+    max_shard_size_bytes = 1024**3
+
+    num_packed = pack_image_folder(image_folder, csv_path, shard_folder, max_shard_size_bytes=max_shard_size_bytes)
+    print(f"Packed {num_packed} images into shards in '{shard_folder}'")
+
+    with ShardReader(shard_folder) as shard_reader:
+        print(f"{len(shard_reader)} images in the shards")
+        for image_filename in list(shard_reader)[:3]:
+            image = shard_reader.open_image(image_filename)
+            metadata = shard_reader.read_metadata(image_filename)
+            print(f"- {image_filename}: {image.size}, {metadata['model_used']}, '{metadata['text_prompt'][:60]}...'")
+
+#%%
@@ -0,0 +1,185 @@
+#%% Imports
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import platform
+import tempfile
+import multiprocessing
+
+# the load tests never send the real API keys, even to the mock server
+for key_name in ['STABILITY_API_KEY', 'OPENAI_API_KEY', 'FAL_KEY']:
+    os.environ[key_name] = 'mock-key'
+
+import fal_client.client
+from openai import OpenAI, AsyncOpenAI
+
+import create_face_dataset as cfd
+from mock_provider_server import run_mock_server_process
+from provider_rate_control import ProviderRateController
+from generation_telemetry import GenerationTelemetry
+
+#%% Mock providers
+
+MODEL_CONFIGS = {
+    'FLUX1_dev': {"image_size": "square_hd", "num_inference_steps": 50},
+    'FLUX1_pro': {"image_size": "square_hd", "num_inference_steps": 50},
+    'FLUX1_schnell': {"image_size": "square_hd", "num_inference_steps": 12},
+    'SDXL': {"engine_id": "stable-diffusion-xl-1024-v1-0", "steps": 70},
+    'DALLE3': {"size": "1024x1024", "quality": "standard"},
+}
+
+def start_mock_server(**server_kwargs):
+    # returns (process, pipe connection, addresses) of a MockProviderServer running in its own process
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_mock_server_process, args=(child_connection,), kwargs=server_kwargs, daemon=True)
+    process.start()
+    return process, parent_connection, parent_connection.recv()
+
+def get_mock_server_stats(connection):
+    connection.send('stats')
+    return connection.recv()
+
+def stop_mock_server(process, connection):
+    connection.send('stop')
+    stats = connection.recv()
+    process.join()
+    return stats
+
+def use_mock_providers(addresses, sdxl_channel_pool_size=2):
+    # points the API clients of create_face_dataset.py at the mock server. fal_client only has a setting for an https host,
+    # so the queue URL it submits to is replaced, the result and status URLs come from the mock server's answers
+    fal_client.client.QUEUE_URL_FORMAT = addresses['fal_queue_url']
+    cfd.openai_client = OpenAI(api_key='mock-key', base_url=addresses['openai_base_url'])
+    cfd.async_openai_client = AsyncOpenAI(api_key='mock-key', base_url=addresses['openai_base_url'])
+    cfd.configure_SDXL_channels(host=addresses['stability_grpc_host'], pool_size=sdxl_channel_pool_size)
+
+#%% Load test
+
+def run_load_test(loop, model, num_samples, image_folder, parallel=True, max_concurrent_calls=10, num_image_workers=None,
+                  rate_control=True, jpeg_quality=90, time_scale=1.0):
+    # generates num_samples images of the model with its create_dataset_* function, returns the throughput, CPU usage and
+    # tail latency of the run. time_scale (that of the mock server) also scales the pause of the rate controller after a
+    # throttling response without a retry-after
+    telemetry = GenerationTelemetry(cost_per_image_usd=cfd.MODEL_COST_PER_IMAGE_USD, model_providers=cfd.MODEL_PROVIDERS)
+    provider = cfd.MODEL_PROVIDERS[model]
+    rate_controller = ProviderRateController(provider, None, max_concurrency=max_concurrent_calls, default_retry_after_sec=5.0 * time_scale) if rate_control else None
+    parallel_kwargs = {'max_concurrent_calls': max_concurrent_calls, 'num_image_workers': num_image_workers, 'rate_controller': rate_controller}
+    model_config = {**MODEL_CONFIGS[model], 'jpeg_quality': jpeg_quality}
+    cfd.circuit_breakers.clear()
+
+    start_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    if model.startswith('FLUX'):
+        if parallel:
+            metadata_df = loop.run_until_complete(cfd.create_dataset_FLUX_parallel(num_samples, model, image_folder, telemetry=telemetry,
+                                                                                   **parallel_kwargs, **model_config))
+        else:
+            metadata_df = cfd.create_dataset_FLUX(num_samples, model, image_folder, telemetry=telemetry, **model_config)
+    elif model == 'SDXL':
+        if parallel:
+            metadata_df = loop.run_until_complete(cfd.create_dataset_SDXL_parallel(num_samples, image_folder, telemetry=telemetry,
+                                                                                   **parallel_kwargs, **model_config))
+        else:
+            metadata_df = cfd.create_dataset_SDXL(num_samples, image_folder, telemetry=telemetry, **model_config)
+    else:
+        if parallel:
+            metadata_df = loop.run_until_complete(cfd.create_dataset_DALLE3_parallel(num_samples, image_folder, telemetry=telemetry,
+                                                                                     **parallel_kwargs, **model_config))
+        else:
+            metadata_df = cfd.create_dataset_DALLE3(num_samples, image_folder, telemetry=telemetry, **model_config)
+    duration_sec = time.perf_counter() - start_time
+    cpu_time_sec = time.process_time() - start_cpu_time
+
+    metrics = telemetry.get_model_metrics(model)
+    return {
+        'model': model,
+        'parallel': parallel,
+        'max_concurrent_calls': max_concurrent_calls if parallel else 1,
+        'num_samples': num_samples,
+        'num_images': len(metadata_df),
+        'duration_sec': duration_sec,
+        'images_per_sec': len(metadata_df) / duration_sec,
+        'cpu_percent': 100 * cpu_time_sec / duration_sec,
+        'cpu_ms_per_image': 1000 * cpu_time_sec / max(len(metadata_df), 1),
+        'stages': metrics['stages'],
+        'final_concurrency_limit': rate_controller.concurrency_limit if rate_controller is not None else None,
+    }
+
+def format_result(result):
+    generate = result['stages'].get('generate', {'p50': float('nan'), 'p95': float('nan'), 'p99': float('nan')})
+    mode = f"async x{result['max_concurrent_calls']}" if result['parallel'] else "sync"
+    return (f"{result['model']:<14} {mode:<10} {result['num_images']:>4}/{result['num_samples']:<4} images  "
+            f"{result['images_per_sec']:7.2f} images/sec  CPU {result['cpu_percent']:5.1f}% ({result['cpu_ms_per_image']:6.1f} ms/image)  "
+            f"generate p50/p95/p99 {generate['p50']:.2f}/{generate['p95']:.2f}/{generate['p99']:.2f} sec")
+
+def run_load_tests(scenarios, server_kwargs=None, sdxl_channel_pool_size=2, results_path=None):
+    # runs every scenario (keyword arguments of run_load_test) against one mock server, prints and returns the results
+    process, connection, addresses = start_mock_server(**(server_kwargs or {}))
+    use_mock_providers(addresses, sdxl_channel_pool_size)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    image_folder = tempfile.mkdtemp(prefix="load_test_images_")
+
+    results = []
+    try:
+        for scenario in scenarios:
+            server_stats_before = get_mock_server_stats(connection)
+            result = run_load_test(loop, image_folder=image_folder, time_scale=(server_kwargs or {}).get('time_scale', 1.0), **scenario)
+            server_stats = get_mock_server_stats(connection)
+            result['server_stats'] = {provider: {name: count - server_stats_before[provider][name] for name, count in provider_stats.items()}
+                                      for provider, provider_stats in server_stats.items()}
+            results.append(result)
+            for filename in os.listdir(image_folder):
+                os.remove(os.path.join(image_folder, filename))
+    finally:
+        loop.run_until_complete(cfd.close_async_http_client())
+        loop.run_until_complete(cfd.close_SDXL_async_channels())
+        loop.close()
+        cfd.close_SDXL_channels()
+        stop_mock_server(process, connection)
+        shutil.rmtree(image_folder, ignore_errors=True)
+
+    print("\nLoad test results:\n")
+    for result in results:
+        print(format_result(result))
+        print(f"{'':<26}mock server: {result['server_stats'][cfd.MODEL_PROVIDERS[result['model']]]}")
+
+    if results_path is not None:
+        with open(results_path, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                       'server_kwargs': server_kwargs, 'results': results}, f, indent=2)
+        print(f"\nResults saved to '{results_path}'")
+    return results
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    # the latencies of the mock providers are scaled down by time_scale, so e.g. 0.05 turns the ~3 sec fal latency into
+    # 0.15 sec and a scenario runs in seconds. the throughput then measures the client (concurrency, retries, image I/O),
+    # multiply the images per sec by time_scale for the rate at the real latencies
+    time_scale = 0.05
+    provider_behavior = {
+        'fal': {'throttle_rate': 0.02, 'error_rate': 0.02},
+        'openai': {'throttle_rate': 0.02, 'error_rate': 0.01},
+        'stability': {'throttle_rate': 0.02, 'error_rate': 0.02},
+    }
+    results_path = r"load_test_results.json"
+    num_samples = 200
+
+    scenarios = [
+        {'model': 'FLUX1_dev', 'num_samples': num_samples, 'parallel': True, 'max_concurrent_calls': 10},
+        {'model': 'FLUX1_dev', 'num_samples': num_samples, 'parallel': True, 'max_concurrent_calls': 50},
+        {'model': 'FLUX1_schnell', 'num_samples': num_samples // 10, 'parallel': False},
+        {'model': 'SDXL', 'num_samples': num_samples, 'parallel': True, 'max_concurrent_calls': 10},
+        {'model': 'DALLE3', 'num_samples': num_samples, 'parallel': True, 'max_concurrent_calls': 10},
+    ]
+
+    server_kwargs = {'provider_behavior': provider_behavior, 'time_scale': time_scale, 'seed': 0}
+    run_load_tests(scenarios, server_kwargs, results_path=results_path)
+
+#%%
@@ -33,6 +33,11 @@ def merge_datasets(source_folders, output_folder):
         
         # Read the CSV file
         df = pd.read_csv(source_csv_path)
+
+        # Copy the vocabularies of the prompt attribute columns (the same for all folders)
+        source_vocabularies_path = os.path.join(source_folder, "prompt_attribute_vocabularies.json")
+        if os.path.exists(source_vocabularies_path):
+            shutil.copy(source_vocabularies_path, os.path.join(output_folder, "prompt_attribute_vocabularies.json"))
         
         # Get all image files in the source folder
         image_files = [f for f in os.listdir(source_image_folder) if f.endswith('.jpg')]
@@ -52,13 +57,9 @@ def merge_datasets(source_folders, output_folder):
                     os.path.join(output_image_folder, new_image_name)
                 )
                 
-                # Update metadata
-                new_metadata = {
-                    'image_filename': new_image_name,
-                    'model_used': model,
-                    'text_prompt': metadata_row['text_prompt'].iloc[0],
-                    'configs': metadata_row['configs'].iloc[0]
-                }
+                # Update metadata (all the columns are kept, e.g. the prompt attribute columns)
+                new_metadata = metadata_row.iloc[0].to_dict()
+                new_metadata['image_filename'] = new_image_name
                 all_metadata.append(new_metadata)
                 
                 # Increment the counter for this model
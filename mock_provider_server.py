@@ -0,0 +1,373 @@
+#%% Imports
+
+import io
+import os
+import json
+import math
+import time
+import uuid
+import random
+import base64
+import threading
+from concurrent import futures
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from PIL import Image
+import grpc
+import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
+import stability_sdk.interfaces.gooseai.generation.generation_pb2_grpc as generation_grpc
+
+#%% Provider behavior
+
+# per provider: the API latency is lognormal around latency_median_sec, a request fails with a throttling response
+# (HTTP 429 / gRPC RESOURCE_EXHAUSTED, asking to retry after retry_after_sec) at throttle_rate, with a server error after
+# part of its latency at error_rate, and as an invalid request (HTTP 422 / gRPC INVALID_ARGUMENT) at invalid_rate.
+# requests_per_minute (None for no limit) also throttles the requests above that rate, like an account rate limit
+DEFAULT_PROVIDER_BEHAVIOR = {
+    'fal': {'latency_median_sec': 3.0, 'latency_sigma': 0.3, 'download_latency_sec': 0.2, 'throttle_rate': 0.02, 'error_rate': 0.02,
+            'invalid_rate': 0.0, 'retry_after_sec': 1.0, 'requests_per_minute': None},
+    'openai': {'latency_median_sec': 12.0, 'latency_sigma': 0.25, 'download_latency_sec': 0.5, 'throttle_rate': 0.02, 'error_rate': 0.01,
+               'invalid_rate': 0.01, 'retry_after_sec': 2.0, 'requests_per_minute': None},
+    'stability': {'latency_median_sec': 5.0, 'latency_sigma': 0.2, 'download_latency_sec': 0.0, 'throttle_rate': 0.02, 'error_rate': 0.02,
+                  'invalid_rate': 0.0, 'retry_after_sec': 1.0, 'requests_per_minute': None},
+}
+
+def make_canned_payloads(num_payloads=4, image_size=(1024, 1024), image_format='JPEG', seed=0, payload_folder=None):
+    # encoded images served as the generated results. smooth random images with a little grain, so their encoded size is
+    # close to that of real results, or the images of payload_folder (e.g. a folder of an existing dataset)
+    payloads = []
+    if payload_folder is not None:
+        for filename in sorted(os.listdir(payload_folder))[:num_payloads]:
+            image = Image.open(os.path.join(payload_folder, filename)).convert('RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, format=image_format, quality=90)
+            payloads.append(buffer.getvalue())
+        return payloads
+
+    rng = np.random.default_rng(seed)
+    for _ in range(num_payloads):
+        low_resolution = Image.fromarray(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8))
+        image_array = np.asarray(low_resolution.resize(image_size, Image.BICUBIC), dtype=np.int16)
+        image_array = np.clip(image_array + rng.integers(-6, 7, image_array.shape), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(image_array).save(buffer, format=image_format, quality=90)
+        payloads.append(buffer.getvalue())
+    return payloads
+
+#%% Server
+
+class MockProviderServer:
+    """Local stand-in for the subset of the fal, OpenAI and Stability APIs used by create_face_dataset.py.
+
+    One threaded HTTP server speaks the fal queue API (submit, status, result, cancel), the OpenAI
+    `/v1/images/generations` endpoint and serves the result image downloads, and a gRPC server
+    speaks the Stability `GenerationService.Generate` call. Every request draws its latency and
+    outcome from the behavior of its provider (see DEFAULT_PROVIDER_BEHAVIOR), from a random
+    generator seeded with `seed`, and is answered with one of the canned payloads: JPEG for fal,
+    PNG for OpenAI and Stability, like the real providers. `time_scale` multiplies all the latencies
+    (e.g. 0.01 to run an hour long scenario in 36 seconds). `get_stats()` counts the requests and
+    their outcomes per provider.
+    """
+
+    def __init__(self, provider_behavior=None, host='127.0.0.1', http_port=0, grpc_port=0, time_scale=1.0, image_size=(1024, 1024),
+                 num_payloads=4, payload_folder=None, seed=0):
+        self.provider_behavior = {provider: {**behavior, **(provider_behavior or {}).get(provider, {})}
+                                  for provider, behavior in DEFAULT_PROVIDER_BEHAVIOR.items()}
+        self.host = host
+        self.http_port = http_port
+        self.grpc_port = grpc_port
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self.jpeg_payloads = make_canned_payloads(num_payloads, image_size, 'JPEG', seed, payload_folder)
+        self.png_payloads = make_canned_payloads(num_payloads, image_size, 'PNG', seed, payload_folder)
+
+        self.fal_jobs = {}
+        self.recent_request_times = {provider: [] for provider in self.provider_behavior}
+        self.stats = {provider: {'requests': 0, 'images': 0, 'throttled': 0, 'errors': 0, 'invalid': 0, 'downloads': 0}
+                      for provider in self.provider_behavior}
+        self.lock = threading.Lock()
+        self.http_server = None
+        self.grpc_server = None
+
+    @property
+    def http_url(self):
+        return f"http://{self.host}:{self.http_port}"
+
+    @property
+    def fal_queue_url(self):
+        return f"{self.http_url}/fal/"
+
+    @property
+    def openai_base_url(self):
+        return f"{self.http_url}/v1"
+
+    @property
+    def stability_grpc_host(self):
+        return f"{self.host}:{self.grpc_port}"
+
+    def get_addresses(self):
+        return {'fal_queue_url': self.fal_queue_url, 'openai_base_url': self.openai_base_url, 'stability_grpc_host': self.stability_grpc_host}
+
+    def get_stats(self):
+        with self.lock:
+            return {provider: dict(provider_stats) for provider, provider_stats in self.stats.items()}
+
+    def sample_outcome(self, provider):
+        # (outcome, latency_sec) of a new request, outcome is 'ok', 'throttled', 'error' or 'invalid'
+        behavior = self.provider_behavior[provider]
+        with self.lock:
+            now = time.monotonic()
+            self.stats[provider]['requests'] += 1
+            latency_sec = self.time_scale * behavior['latency_median_sec'] * math.exp(behavior['latency_sigma'] * self.rng.gauss(0, 1))
+
+            recent_request_times = self.recent_request_times[provider]
+            if behavior['requests_per_minute'] is not None:
+                recent_request_times[:] = [request_time for request_time in recent_request_times if request_time > now - 60]
+            over_limit = behavior['requests_per_minute'] is not None and len(recent_request_times) >= behavior['requests_per_minute']
+
+            draw = self.rng.random()
+            if over_limit or draw < behavior['throttle_rate']:
+                outcome = 'throttled'
+            elif draw < behavior['throttle_rate'] + behavior['invalid_rate']:
+                outcome = 'invalid'
+            elif draw < behavior['throttle_rate'] + behavior['invalid_rate'] + behavior['error_rate']:
+                outcome = 'error'
+                latency_sec *= self.rng.random()
+            else:
+                outcome = 'ok'
+            if outcome != 'throttled':
+                recent_request_times.append(now)
+            self.stats[provider][{'ok': 'images', 'throttled': 'throttled', 'error': 'errors', 'invalid': 'invalid'}[outcome]] += 1
+            return outcome, latency_sec
+
+    def get_payload(self, payload_format):
+        payloads = self.jpeg_payloads if payload_format == 'jpg' else self.png_payloads
+        with self.lock:
+            return payloads[self.rng.randrange(len(payloads))]
+
+    def start(self):
+        self.http_server = ThreadingHTTPServer((self.host, self.http_port), make_http_handler(self))
+        self.http_server.daemon_threads = True
+        self.http_port = self.http_server.server_address[1]
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+        # create_face_dataset.py opens a TLS channel to hosts on a port ending in 443, so such ports are skipped
+        while True:
+            self.grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=256))
+            generation_grpc.add_GenerationServiceServicer_to_server(MockGenerationServicer(self), self.grpc_server)
+            grpc_port = self.grpc_server.add_insecure_port(f"{self.host}:{self.grpc_port}")
+            if self.grpc_port != 0 or not str(grpc_port).endswith('443'):
+                break
+        self.grpc_port = grpc_port
+        self.grpc_server.start()
+        return self
+
+    def stop(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+        if self.grpc_server is not None:
+            self.grpc_server.stop(grace=None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+#%% Stability gRPC
+
+class MockGenerationServicer(generation_grpc.GenerationServiceServicer):
+    """The Stability `Generate` call, streams one PNG image artifact.
+
+    Throttled calls carry a `retry-after` key in their trailing metadata, scaled by the time scale.
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def Generate(self, request, context):
+        outcome, latency_sec = self.server.sample_outcome('stability')
+        if outcome == 'throttled':
+            retry_after_sec = self.server.time_scale * self.server.provider_behavior['stability']['retry_after_sec']
+            context.set_trailing_metadata((('retry-after', f"{retry_after_sec:.3f}"),))
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "rate limit exceeded")
+        if outcome == 'invalid':
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "invalid prompts detected")
+        time.sleep(latency_sec)
+        if outcome == 'error':
+            context.abort(grpc.StatusCode.INTERNAL, "mock server error")
+        seed = request.image.seed[0] if request.image.seed else 0
+        yield generation.Answer(artifacts=[generation.Artifact(type=generation.ARTIFACT_IMAGE, mime="image/png", seed=seed,
+                                                               binary=self.server.get_payload('png'))])
+
+#%% HTTP (fal queue, OpenAI images and downloads)
+
+def make_http_handler(server):
+
+    class MockProviderHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive connections, like the real APIs
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status_code, body, content_type='application/json', headers=None):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode('utf-8')
+            self.send_response(status_code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_json(self):
+            content_length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(content_length) or b'{}')
+
+        def send_throttled(self, provider, body):
+            retry_after_sec = server.time_scale * server.provider_behavior[provider]['retry_after_sec']
+            self.send_body(429, body, headers={'Retry-After': f"{retry_after_sec:.3f}"})
+
+        def do_POST(self):
+            path = urlsplit(self.path).path
+            arguments = self.read_json()
+            if path == '/v1/images/generations':
+                self.generate_openai_image(arguments)
+            elif path.startswith('/fal/'):
+                self.submit_fal_request(path[len('/fal/'):], arguments)
+            else:
+                self.send_body(404, {'detail': f"unknown path {path}"})
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path.startswith('/files/'):
+                self.download_file(path[len('/files/'):])
+            elif path.startswith('/fal/requests/') and path.endswith('/status'):
+                self.get_fal_status(path.split('/')[3])
+            elif path.startswith('/fal/requests/'):
+                self.get_fal_result(path.split('/')[3])
+            elif path == '/stats':
+                self.send_body(200, server.get_stats())
+            else:
+                self.send_body(404, {'detail': f"unknown path {path}"})
+
+        def do_PUT(self):
+            path = urlsplit(self.path).path
+            if path.startswith('/fal/requests/') and path.endswith('/cancel'):
+                with server.lock:
+                    server.fal_jobs.pop(path.split('/')[3], None)
+                self.send_body(202, {'status': 'CANCELLATION_REQUESTED'})
+            else:
+                self.send_body(404, {'detail': f"unknown path {path}"})
+
+        def download_file(self, filename):
+            time.sleep(server.time_scale * server.provider_behavior[filename.split('_')[0]]['download_latency_sec'])
+            payload_format = filename.rsplit('.', 1)[-1]
+            with server.lock:
+                server.stats[filename.split('_')[0]]['downloads'] += 1
+            self.send_body(200, server.get_payload(payload_format), content_type='image/jpeg' if payload_format == 'jpg' else 'image/png')
+
+        def generate_openai_image(self, arguments):
+            outcome, latency_sec = server.sample_outcome('openai')
+            if outcome == 'throttled':
+                self.send_throttled('openai', {'error': {'message': "Rate limit reached", 'type': 'requests', 'code': 'rate_limit_exceeded'}})
+                return
+            if outcome == 'invalid':
+                self.send_body(400, {'error': {'message': "Your request was rejected by the safety system", 'type': 'invalid_request_error',
+                                               'code': 'content_policy_violation'}})
+                return
+            time.sleep(latency_sec)
+            if outcome == 'error':
+                self.send_body(500, {'error': {'message': "The server had an error processing your request", 'type': 'server_error'}})
+                return
+
+            image_data = {'revised_prompt': arguments.get('prompt', '')}
+            if arguments.get('response_format') == 'b64_json':
+                image_data['b64_json'] = base64.b64encode(server.get_payload('png')).decode('ascii')
+            else:
+                image_data['url'] = f"{server.http_url}/files/openai_{uuid.uuid4().hex}.png"
+            self.send_body(200, {'created': int(time.time()), 'data': [image_data]})
+
+        def submit_fal_request(self, application, arguments):
+            # throttling and invalid requests are answered at submit time, server errors when the result is fetched
+            outcome, latency_sec = server.sample_outcome('fal')
+            if outcome == 'throttled':
+                self.send_throttled('fal', {'detail': "Too many requests"})
+                return
+            if outcome == 'invalid':
+                self.send_body(422, {'detail': [{'loc': ['body', 'prompt'], 'msg': "invalid prompt", 'type': 'value_error'}]})
+                return
+
+            request_id = str(uuid.uuid4())
+            with server.lock:
+                server.fal_jobs[request_id] = {'ready_time': time.monotonic() + latency_sec, 'outcome': outcome, 'arguments': arguments}
+            base_url = f"{server.fal_queue_url}requests/{request_id}"
+            self.send_body(200, {'request_id': request_id, 'response_url': base_url, 'status_url': f"{base_url}/status",
+                                 'cancel_url': f"{base_url}/cancel", 'queue_position': 0})
+
+        def get_fal_status(self, request_id):
+            with server.lock:
+                job = server.fal_jobs.get(request_id)
+            if job is None:
+                self.send_body(404, {'detail': "Request not found"})
+            elif time.monotonic() < job['ready_time']:
+                self.send_body(202, {'status': 'IN_PROGRESS', 'logs': None})
+            else:
+                self.send_body(200, {'status': 'COMPLETED', 'logs': None, 'metrics': {}})
+
+        def get_fal_result(self, request_id):
+            with server.lock:
+                job = server.fal_jobs.pop(request_id, None)
+            if job is None:
+                self.send_body(404, {'detail': "Request not found"})
+                return
+            if job['outcome'] == 'error':
+                self.send_body(500, {'detail': "Internal server error"})
+                return
+
+            if job['arguments'].get('sync_mode'):
+                image_url = "data:image/jpeg;base64," + base64.b64encode(server.get_payload('jpg')).decode('ascii')
+            else:
+                image_url = f"{server.http_url}/files/fal_{request_id}.jpg"
+            self.send_body(200, {'images': [{'url': image_url, 'content_type': 'image/jpeg'}], 'seed': job['arguments'].get('seed'),
+                                 'prompt': job['arguments'].get('prompt'), 'has_nsfw_concepts': [False], 'timings': {}})
+
+    return MockProviderHandler
+
+#%% Separate process
+
+def run_mock_server_process(connection, **server_kwargs):
+    # runs a MockProviderServer in its own process (so it does not share the CPU time and the GIL of the measured client),
+    # sends its addresses over the pipe connection, and its stats when it receives 'stop'
+    with MockProviderServer(**server_kwargs) as server:
+        connection.send(server.get_addresses())
+        while connection.recv() != 'stop':
+            connection.send(server.get_stats())
+        connection.send(server.get_stats())
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    # standalone mock server, e.g. to point a generation run or other tools at it by hand
+    http_port = 8700
+    grpc_port = 8701
+    time_scale = 1.0
+    provider_behavior = {'fal': {'throttle_rate': 0.05}}
+
+    with MockProviderServer(provider_behavior, http_port=http_port, grpc_port=grpc_port, time_scale=time_scale) as server:
+        print("Mock provider server running:")
+        for name, address in server.get_addresses().items():
+            print(f"- {name}: {address}")
+        print(f"- stats: {server.http_url}/stats")
+        try:
+            while True:
+                time.sleep(60)
+                print(server.get_stats())
+        except KeyboardInterrupt:
+            pass
+
+#%%
@@ -0,0 +1,265 @@
+#%% Imports
+
+import re
+import json
+import math
+
+#%% Model figures
+
+# recorded throughput and cost per model (see the comments of the __main__ part of create_face_dataset.py): images per hour
+# with `concurrency` calls in flight, the cost per image is MODEL_COST_PER_IMAGE_USD of create_face_dataset.py (not imported,
+# importing it needs the API keys)
+RECORDED_MODEL_FIGURES = {
+    'FLUX1_dev': {'provider': 'fal', 'images_per_hour': 1150, 'concurrency': 10, 'cost_per_image_usd': 0.025},
+    'FLUX1_pro': {'provider': 'fal', 'images_per_hour': 1100, 'concurrency': 10, 'cost_per_image_usd': 0.05},
+    'FLUX1_schnell': {'provider': 'fal', 'images_per_hour': 2000, 'concurrency': 1, 'cost_per_image_usd': 0.003},
+    'SDXL': {'provider': 'stability', 'images_per_hour': 550, 'concurrency': 1, 'cost_per_image_usd': 0.0036},
+    'DALLE3': {'provider': 'openai', 'images_per_hour': 233, 'concurrency': 1, 'cost_per_image_usd': 0.04},
+}
+
+# the samples variable of each model in the __main__ part of create_face_dataset.py
+MODEL_SAMPLES_VARIABLES = {
+    'FLUX1_dev': 'flux1_dev_samples',
+    'FLUX1_pro': 'flux1_pro_samples',
+    'FLUX1_schnell': 'flux1_schnell_samples',
+    'SDXL': 'sdxl_samples',
+    'DALLE3': 'dalle3_samples',
+}
+
+# models that the __main__ part of create_face_dataset.py only runs through their sync create_dataset_* function, one call
+# at a time whatever max_concurrent_calls is
+SYNC_ONLY_MODELS = ['FLUX1_schnell']
+
+def get_recorded_model_figures():
+    # model -> provider, seconds per call (Little's law: calls in flight / throughput), cost per image and error rate
+    return {model: {'provider': figures['provider'], 'latency_sec': 3600 * figures['concurrency'] / figures['images_per_hour'],
+                    'cost_per_image_usd': figures['cost_per_image_usd'], 'error_rate': 0.0, 'source': 'recorded'}
+            for model, figures in RECORDED_MODEL_FIGURES.items()}
+
+def read_prometheus_metrics(metrics_path, metric_prefix='sfhq_t2i'):
+    # (metric name without the prefix, labels dict) -> value, for the text format written by GenerationTelemetry
+    metrics = {}
+    line_pattern = re.compile(rf"{re.escape(metric_prefix)}_(\w+)\{{(.*)\}} (\S+)")
+    with open(metrics_path, 'r') as f:
+        for line in f:
+            match = line_pattern.fullmatch(line.strip())
+            if match:
+                labels = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2)))
+                metrics[(match.group(1), tuple(sorted(labels.items())))] = float(match.group(3))
+    return metrics
+
+def load_live_model_figures(metrics_path):
+    # the same figures measured by a generation run, from its metrics export (see generation_telemetry.py), as JSON or in
+    # the Prometheus text format. the time per call is the mean `generate` stage, which includes the retries and rate
+    # control waits, so it already accounts for the throttling and errors seen in the run
+    if metrics_path.endswith('.json'):
+        with open(metrics_path, 'r') as f:
+            model_metrics = json.load(f)['models']
+    else:
+        prometheus_metrics = read_prometheus_metrics(metrics_path)
+        model_metrics = {}
+        for (name, labels), value in prometheus_metrics.items():
+            labels = dict(labels)
+            metrics = model_metrics.setdefault(labels['model'], {'provider': labels['provider'], 'stages': {}})
+            if name in ['images_total', 'failures_total', 'cost_usd_total', 'error_rate']:
+                metrics[{'images_total': 'num_images', 'failures_total': 'num_failures', 'cost_usd_total': 'cost_usd'}.get(name, name)] = value
+            elif name in ['stage_seconds_sum', 'stage_seconds_count']:
+                metrics['stages'].setdefault(labels['stage'], {})['sum_sec' if name.endswith('sum') else 'count'] = value
+
+    model_figures = {}
+    for model, metrics in model_metrics.items():
+        generate_stage = metrics['stages'].get('generate', {})
+        if metrics.get('num_images', 0) == 0 or generate_stage.get('count', 0) == 0:
+            continue
+        model_figures[model] = {
+            'provider': metrics['provider'],
+            'latency_sec': generate_stage['sum_sec'] / generate_stage['count'],
+            'cost_per_image_usd': metrics['cost_usd'] / metrics['num_images'],
+            'error_rate': metrics.get('error_rate', 0.0),
+            'source': metrics_path,
+        }
+    return model_figures
+
+#%% Planner
+
+def get_provider_limits(provider, deadline_sec, provider_max_concurrency, provider_requests_per_minute):
+    # (call seconds, number of calls) the provider can serve before the deadline, None when unlimited
+    max_concurrency = provider_max_concurrency.get(provider)
+    requests_per_minute = provider_requests_per_minute.get(provider)
+    return (max_concurrency * deadline_sec if max_concurrency is not None else None,
+            requests_per_minute * deadline_sec / 60 if requests_per_minute is not None else None)
+
+def plan_campaign(model_figures, budget_usd, deadline_hours, target_mix=None, quality_weights=None, provider_max_concurrency=None,
+                  provider_requests_per_minute=None, concurrency_headroom=1.2):
+    # number of images of each model that fits the dollar budget and finishes by the deadline, with every model running in
+    # its own worker (see worker_name in create_face_dataset.py) and the models of a provider sharing its concurrency and
+    # rate limits. with a target_mix (model -> fraction of the images) the mix is kept and the total number of images is
+    # maximized. with quality_weights (model -> value of one image) the total value is maximized, greedily by value per
+    # dollar (the best allocation when the budget is the binding limit). every failed sample (error_rate) costs a call
+    # but no money, concurrency_headroom leaves room for the slower calls of the latency tail, and the SYNC_ONLY_MODELS
+    # get a single call in flight
+    if (target_mix is None) == (quality_weights is None):
+        raise ValueError("give either a target_mix or quality_weights")
+    provider_max_concurrency = provider_max_concurrency or {}
+    provider_requests_per_minute = provider_requests_per_minute or {}
+    deadline_sec = 3600 * deadline_hours
+    models = [model for model in (target_mix or quality_weights) if (target_mix or quality_weights)[model] > 0]
+    missing_models = [model for model in models if model not in model_figures]
+    if missing_models:
+        raise ValueError(f"no throughput and cost figures for {missing_models}")
+
+    def get_samples_per_image(model):
+        return 1 / max(1e-6, 1 - model_figures[model]['error_rate'])
+
+    def get_call_sec_per_image(model):
+        return get_samples_per_image(model) * model_figures[model]['latency_sec'] * concurrency_headroom
+
+    def get_sync_max_images(model):
+        # the images a single call in flight produces before the deadline
+        return deadline_sec / get_call_sec_per_image(model)
+
+    providers = sorted({model_figures[model]['provider'] for model in models})
+    provider_limits = {provider: get_provider_limits(provider, deadline_sec, provider_max_concurrency, provider_requests_per_minute)
+                       for provider in providers}
+
+    num_images = {}
+    if target_mix is not None:
+        total_fraction = sum(target_mix[model] for model in models)
+        fractions = {model: target_mix[model] / total_fraction for model in models}
+        # the largest total number of images under each limit, the plan takes the smallest
+        max_total_images = {'budget': budget_usd / sum(fractions[model] * model_figures[model]['cost_per_image_usd'] for model in models)}
+        for provider, (max_call_sec, max_calls) in provider_limits.items():
+            provider_models = [model for model in models if model_figures[model]['provider'] == provider]
+            if max_call_sec is not None:
+                max_total_images[f"{provider} concurrency"] = max_call_sec / sum(fractions[model] * get_call_sec_per_image(model) for model in provider_models)
+            if max_calls is not None:
+                max_total_images[f"{provider} rate limit"] = max_calls / sum(fractions[model] * get_samples_per_image(model) for model in provider_models)
+        for model in models:
+            if model in SYNC_ONLY_MODELS:
+                max_total_images[f"{model} sync path"] = get_sync_max_images(model) / fractions[model]
+        limited_by = min(max_total_images, key=max_total_images.get)
+        num_images = {model: int(fractions[model] * max_total_images[limited_by]) for model in models}
+    else:
+        remaining_budget_usd = budget_usd
+        remaining_limits = {provider: list(limits) for provider, limits in provider_limits.items()}
+        limited_by = 'quality weights'
+        for model in sorted(models, key=lambda model: quality_weights[model] / model_figures[model]['cost_per_image_usd'], reverse=True):
+            provider = model_figures[model]['provider']
+            max_call_sec, max_calls = remaining_limits[provider]
+            max_model_images = {'budget': remaining_budget_usd / model_figures[model]['cost_per_image_usd']}
+            if max_call_sec is not None:
+                max_model_images[f"{provider} concurrency"] = max_call_sec / get_call_sec_per_image(model)
+            if max_calls is not None:
+                max_model_images[f"{provider} rate limit"] = max_calls / get_samples_per_image(model)
+            if model in SYNC_ONLY_MODELS:
+                max_model_images[f"{model} sync path"] = get_sync_max_images(model)
+            num_images[model] = int(min(max_model_images.values()))
+            if num_images[model] > 0:
+                limited_by = min(max_model_images, key=max_model_images.get)
+
+            remaining_budget_usd -= num_images[model] * model_figures[model]['cost_per_image_usd']
+            if max_call_sec is not None:
+                remaining_limits[provider][0] -= num_images[model] * get_call_sec_per_image(model)
+            if max_calls is not None:
+                remaining_limits[provider][1] -= num_images[model] * get_samples_per_image(model)
+
+    model_plans = {}
+    for model in models:
+        figures = model_figures[model]
+        num_samples = math.ceil(num_images[model] * get_samples_per_image(model))
+        concurrency = max(1, math.ceil(num_images[model] * get_call_sec_per_image(model) / deadline_sec)) if num_images[model] > 0 else 0
+        model_plans[model] = {
+            'provider': figures['provider'],
+            'num_images': num_images[model],
+            'num_samples': num_samples,
+            'cost_usd': num_images[model] * figures['cost_per_image_usd'],
+            'concurrency': min(concurrency, 1) if model in SYNC_ONLY_MODELS else concurrency,
+            'images_per_hour': num_images[model] / deadline_hours,
+            'requests_per_minute': num_samples / (60 * deadline_hours),
+            'latency_sec': figures['latency_sec'],
+            'figures_source': figures['source'],
+        }
+
+    return {
+        'budget_usd': budget_usd,
+        'deadline_hours': deadline_hours,
+        'objective': 'target_mix' if target_mix is not None else 'quality_weights',
+        'limited_by': limited_by,
+        'total_images': sum(model_plan['num_images'] for model_plan in model_plans.values()),
+        'total_cost_usd': sum(model_plan['cost_usd'] for model_plan in model_plans.values()),
+        'total_value': sum(quality_weights[model] * num_images[model] for model in models) if quality_weights is not None else None,
+        'provider_requests_per_minute': provider_requests_per_minute,
+        'models': model_plans,
+    }
+
+def format_plan(plan):
+    lines = [f"Plan for ${plan['budget_usd']:.2f} within {plan['deadline_hours']:.1f} hours ({plan['objective']}, limited by {plan['limited_by']}):",
+             f"{'model':<14} {'provider':<10} {'images':>8} {'samples':>8} {'cost':>10} {'concurrency':>12} {'images/hour':>12} {'sec/call':>9}"]
+    for model, model_plan in plan['models'].items():
+        lines.append(f"{model:<14} {model_plan['provider']:<10} {model_plan['num_images']:>8} {model_plan['num_samples']:>8} "
+                     f"{'$' + format(model_plan['cost_usd'], '.2f'):>10} {model_plan['concurrency']:>12} "
+                     f"{model_plan['images_per_hour']:>12.0f} {model_plan['latency_sec']:>9.1f}")
+    lines.append(f"{'total':<25} {plan['total_images']:>8} {'':>8} {'$' + format(plan['total_cost_usd'], '.2f'):>10}")
+    return "\n".join(lines)
+
+def format_worker_settings(plan):
+    # the settings of the __main__ part of create_face_dataset.py for the worker of each model: its samples, all other
+    # samples at 0, and its share of the requests per minute limit of its provider (split by the planned request rates)
+    lines = []
+    for model, model_plan in plan['models'].items():
+        if model_plan['num_samples'] == 0:
+            continue
+        provider = model_plan['provider']
+        provider_request_rate = sum(other_plan['requests_per_minute'] for other_plan in plan['models'].values() if other_plan['provider'] == provider)
+        requests_per_minute = {provider: None for provider in ['fal', 'stability', 'openai']}
+        if plan['provider_requests_per_minute'].get(provider) is not None:
+            requests_per_minute[provider] = round(plan['provider_requests_per_minute'][provider] * model_plan['requests_per_minute'] / provider_request_rate, 2)
+
+        lines.append(f"# worker {model}: {model_plan['num_samples']} samples, {model_plan['requests_per_minute']:.1f} requests per minute")
+        lines.append(f"worker_name = '{model}'")
+        for other_model, samples_variable in MODEL_SAMPLES_VARIABLES.items():
+            lines.append(f"{samples_variable} = {model_plan['num_samples'] if other_model == model else 0}")
+        lines.append(f"max_concurrent_calls = {model_plan['concurrency']}")
+        lines.append(f"provider_requests_per_minute = {requests_per_minute}")
+        lines.append("")
+    return "\n".join(lines)
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    # campaign constraints
+    budget_usd = 200.0
+    deadline_hours = 8.0
+
+    # either a target mix of the images (fractions, normalized) or the value of one image of each model
+    target_mix = {'FLUX1_dev': 0.4, 'FLUX1_pro': 0.2, 'SDXL': 0.2, 'DALLE3': 0.2}
+    quality_weights = None  # e.g. {'FLUX1_dev': 1.0, 'FLUX1_pro': 1.5, 'FLUX1_schnell': 0.3, 'SDXL': 0.4, 'DALLE3': 1.2}
+
+    # metrics exported by an earlier generation run (generation_metrics.prom or .json), its figures replace the recorded
+    # ones for the models it measured, None to plan from the recorded figures only
+    metrics_path = None
+
+    # limits of your accounts, shared by the models of a provider (None for no limit)
+    provider_max_concurrency = {'fal': 20, 'stability': 10, 'openai': 10}
+    provider_requests_per_minute = {'fal': None, 'stability': 150, 'openai': 7}
+    concurrency_headroom = 1.2
+
+    plan_path = r"generation_campaign_plan.json"
+
+    model_figures = get_recorded_model_figures()
+    if metrics_path is not None:
+        model_figures.update(load_live_model_figures(metrics_path))
+
+    plan = plan_campaign(model_figures, budget_usd, deadline_hours, target_mix=target_mix, quality_weights=quality_weights,
+                         provider_max_concurrency=provider_max_concurrency, provider_requests_per_minute=provider_requests_per_minute,
+                         concurrency_headroom=concurrency_headroom)
+    print(format_plan(plan))
+    print("\ncreate_face_dataset.py settings, one worker per model:\n")
+    print(format_worker_settings(plan))
+
+    with open(plan_path, 'w') as f:
+        json.dump(plan, f, indent=2)
+    print(f"Plan saved to '{plan_path}'")
+
+#%%
@@ -0,0 +1,584 @@
+#%% Imports
+
+import os
+import re
+import json
+import math
+import time
+import numpy as np
+import pandas as pd
+from collections import Counter, defaultdict
+from multiprocessing import Pool
+
+from face_prompt_utils import FacePromptSampler, get_element_kind_inclusion_probs, get_uniform_probs, mix_probs
+
+#%% Helper functions
+
+def _entropy(probs):
+    # in nats
+    return -sum(prob * math.log(prob) for prob in probs if prob > 0)
+
+def _repeat_seen_slots(alpha, num_seen_slots, num_slots):
+    # alpha[t]: probability that the first t slot draws (without replacement, out of num_slots) hit exactly the element
+    # kinds seen so far, in their order of first appearance. Returns gamma[t], the same probability when the draws that
+    # follow the first appearance of the last kind may also repeat any of the num_seen_slots slots of the seen kinds
+    gamma = [alpha[0]]
+    for t in range(1, len(alpha)):
+        gamma.append(alpha[t] + gamma[t - 1] * (num_seen_slots - t + 1) / (num_slots - t + 1))
+    return gamma
+
+def _add_new_kind(gamma, multiplicity, num_slots):
+    # next draw is the first slot of a new kind, that occupies `multiplicity` of the slots
+    return [0.0] + [gamma[t] * multiplicity / (num_slots - t) if t < num_slots else 0.0 for t in range(len(gamma) - 1)]
+
+#%% Exact prompt space model
+
+class PromptSpaceModel:
+    """Exact probability model of the prompts of `FacePromptSampler.generate_face_prompt`.
+
+    The generator is a tree of independent categorical draws: the demographic latents (age
+    group probabilities included), the ordered subset of element kinds (a draw without
+    replacement from the element slots, so repeated kinds are more likely), and the text of
+    every element (with the `stereotype_prob` mixtures). This model walks the same tree with
+    the same vocabularies, so marginals, entropy and prompt probabilities are computed
+    exactly, without sampling. The conditioning arguments are those of `generate_face_prompt`.
+
+    Prompts generated with a token budget (`max_prompt_tokens`) are not covered, the budget
+    drops elements depending on their text.
+    """
+
+    def __init__(self, ethnicity_group=None, sex_group=None, age_group=None, lighting_category=None, num_elements_to_add=None):
+        sampler = FacePromptSampler
+        self.conditions = {'ethnicity_group': ethnicity_group, 'sex_group': sex_group, 'age_group': age_group,
+                           'lighting_category': lighting_category, 'num_elements_to_add': num_elements_to_add}
+        for name, options in [('ethnicity_group', sampler.ethnicity_groups), ('sex_group', sampler.sex_groups),
+                              ('age_group', sampler.age_groups), ('lighting_category', sampler.lighting_categories)]:
+            if self.conditions[name] is not None and self.conditions[name] not in options:
+                raise ValueError(f"unknown {name} '{self.conditions[name]}'")
+
+        # demographic latents
+        self.ethnicity_group_probs = get_uniform_probs(sampler.ethnicity_groups) if ethnicity_group is None else {ethnicity_group: 1.0}
+        self.sex_group_probs = get_uniform_probs(sampler.sex_groups) if sex_group is None else {sex_group: 1.0}
+        if age_group is None:
+            cumulative_probs = (0.0,) + sampler.age_group_cumulative_probs
+            self.age_group_probs = {group: cumulative_probs[i + 1] - cumulative_probs[i] for i, group in enumerate(sampler.age_groups)}
+        else:
+            self.age_group_probs = {age_group: 1.0}
+        self.num_elements_to_add_probs = get_uniform_probs(range(4, 10)) if num_elements_to_add is None else {num_elements_to_add: 1.0}
+
+        # base prompt
+        self.prompt_start_probs = get_uniform_probs(sampler.prompt_starts)
+        assert not any(re.search(r'\d', prompt_start) for prompt_start in self.prompt_start_probs)
+        self.base_prompt_pattern = re.compile(r'(.+?) (\d+) (year|month) old (.+)')
+        self.expression_probs = get_uniform_probs(sampler.expressions)
+        self.location_probs = get_uniform_probs(sampler.locations_settings_backgrounds)
+        self.max_location_pieces = max(location.count(', ') for location in self.location_probs) + 1
+        self.ethnicity_text_probs = {}
+        for group in self.ethnicity_group_probs:
+            self.ethnicity_text_probs[group] = mix_probs({group: 1.0}, get_uniform_probs(sampler.ethnicities[group]), 0.5)
+        self.ethnicity_text_groups = defaultdict(dict)
+        for group, text_probs in self.ethnicity_text_probs.items():
+            for text, prob in text_probs.items():
+                self.ethnicity_text_groups[text][group] = prob
+
+        # "{age} {year|month} old {ethnicity} {age sex phrase}"
+        self.age_sex_phrases = defaultdict(list)
+        for sex_group in self.sex_group_probs:
+            for age_group in self.age_group_probs:
+                for phrase, prob in self._get_age_sex_phrase_probs(sex_group, age_group).items():
+                    self.age_sex_phrases[phrase].append((sex_group, age_group, prob))
+
+        # element kinds: the slot list of every (sex group, age group) and the distribution of the number of slot draws
+        self.kind_indices = {kind: index for index, kind in enumerate(sampler.element_kinds)}
+        self.element_slots = {(sex_group, age_group): sampler._get_element_slots(sex_group, age_group)
+                              for sex_group in self.sex_group_probs for age_group in self.age_group_probs}
+        self.num_draws_probs = {}
+        for element_slots in set(self.element_slots.values()):
+            num_draws_probs = defaultdict(float)
+            for num_elements, prob in self.num_elements_to_add_probs.items():
+                num_draws_probs[min(num_elements, len(element_slots))] += prob
+            self.num_draws_probs[element_slots] = dict(num_draws_probs)
+
+        # element text tables, built on first use (the text of these kinds depends on the ethnicity group or on the sex group)
+        self.group_element_kinds = ('hair', 'eyes', 'skin')
+        self.sex_element_kinds = ('clothing', 'headwear', 'jewelry')
+        self.modifier_slot_probs = [prob for prob, options in sampler.modifier_options]
+        self.modifier_option_probs = [get_uniform_probs([option[:-2] for option in options]) for prob, options in sampler.modifier_options]
+        self.modifier_piece_slots = defaultdict(list)
+        for slot, option_probs in enumerate(self.modifier_option_probs):
+            for option, prob in option_probs.items():
+                self.modifier_piece_slots[option].append((slot, self.modifier_slot_probs[slot] * prob))
+        self.modifier_skip_probs = [1.0]
+        for prob in self.modifier_slot_probs:
+            self.modifier_skip_probs.append(self.modifier_skip_probs[-1] * (1 - prob))
+        self._age_probs_cache = {}
+        self._element_probs_cache = {}
+        self._element_attribute_probs_cache = {}
+        self._element_texts_cache = {}
+        self._kind_sequence_cache = {}
+        self._kind_sequence_stats_cache = {}
+        self._score_cache = {}
+
+    # distributions of the prompt parts
+
+    def _get_age_sex_phrase_probs(self, sex_group, age_group):
+        sampler = FacePromptSampler
+        if age_group in sampler.adult_sex_words:
+            phrase_probs = defaultdict(float)
+            for word, prob in get_uniform_probs(sampler.adult_sex_words[age_group]['male' if sex_group == 'male' else 'female']).items():
+                phrase_probs[word] += 0.75 * prob
+                phrase_probs[f'{sampler.adult_age_qualifiers[age_group]} {word}'] += 0.25 * prob
+            return dict(phrase_probs)
+
+        sex = 'boy' if sex_group == 'male' else 'girl'
+        return {{'baby': f'baby {sex}', 'toddler': f'toddler {sex}', 'child': sex, 'teenager': f'teenage {sex}'}[age_group]: 1.0}
+
+    def get_age_probs(self, age_group):
+        # (unit, {age: probability}) of the age written in the prompt
+        if age_group not in self._age_probs_cache:
+            low, high = FacePromptSampler.age_ranges[age_group]
+            self._age_probs_cache[age_group] = 'month' if age_group == 'baby' else 'year', {age: 1 / (high - low + 1) for age in range(low, high + 1)}
+        return self._age_probs_cache[age_group]
+
+    def get_element_probs(self, element_kind, ethnicity_group=None, sex_group=None):
+        """{text: probability} of an element of kind `element_kind` (all kinds but 'modifiers')."""
+
+        key = (element_kind, ethnicity_group if element_kind in FacePromptSampler.ethnicity_dependent_element_kinds else None,
+               sex_group if element_kind in FacePromptSampler.sex_dependent_element_kinds else None)
+        if key not in self._element_probs_cache:
+            self._element_probs_cache[key] = FacePromptSampler.get_element_text_probs(element_kind, ethnicity_group, sex_group,
+                                                                                      self.conditions['lighting_category'])
+        return self._element_probs_cache[key]
+
+    def get_element_attribute_probs(self, element_kind, ethnicity_group=None):
+        # [{value: probability}] of every attribute of an element (see FacePromptSampler.element_kind_attribute_names)
+        key = (element_kind, ethnicity_group)
+        if key not in self._element_attribute_probs_cache:
+            attribute_probs = [defaultdict(float) for _ in FacePromptSampler.element_kind_attribute_names[element_kind]]
+            outcome_probs = FacePromptSampler.get_element_outcome_probs(element_kind, ethnicity_group, None, self.conditions['lighting_category'])
+            for (text, attribute_values), prob in outcome_probs.items():
+                for value_probs, value in zip(attribute_probs, attribute_values):
+                    value_probs[value] += prob
+            self._element_attribute_probs_cache[key] = [dict(value_probs) for value_probs in attribute_probs]
+        return self._element_attribute_probs_cache[key]
+
+    def get_modifier_entropy(self):
+        # treats the options of different modifier slots as different strings (a few option strings repeat across slots)
+        return sum(_entropy([prob, 1 - prob]) + prob * _entropy(option_probs.values())
+                   for prob, option_probs in zip(self.modifier_slot_probs, self.modifier_option_probs))
+
+    # element kind sequences
+
+    def get_kind_sequence_prob(self, element_slots, kind_multiplicities):
+        """Probability that the selected element kinds are exactly a sequence of kinds with these slot
+        multiplicities (in order of appearance in the prompt), for the slot list `element_slots`."""
+
+        key = (element_slots, tuple(kind_multiplicities))
+        if key not in self._kind_sequence_cache:
+            num_slots = len(element_slots)
+            num_draws_probs = self.num_draws_probs[element_slots]
+            alpha = [1.0] + [0.0] * max(num_draws_probs)
+            num_seen_slots = 0
+            for multiplicity in kind_multiplicities:
+                alpha = _add_new_kind(_repeat_seen_slots(alpha, num_seen_slots, num_slots), multiplicity, num_slots)
+                num_seen_slots += multiplicity
+            gamma = _repeat_seen_slots(alpha, num_seen_slots, num_slots)
+            self._kind_sequence_cache[key] = sum(prob * gamma[num_draws] for num_draws, prob in num_draws_probs.items())
+        return self._kind_sequence_cache[key]
+
+    def get_kind_sequence_stats(self, element_slots):
+        """Entropy (nats) of the ordered element kinds and the distribution of their number, for the slot list `element_slots`.
+
+        Sequences with the same pattern of slot multiplicities are equally likely, so only the patterns are enumerated.
+        """
+
+        if element_slots in self._kind_sequence_stats_cache:
+            return self._kind_sequence_stats_cache[element_slots]
+
+        num_slots = len(element_slots)
+        num_draws_probs = self.num_draws_probs[element_slots]
+        max_num_draws = max(num_draws_probs)
+        num_kinds_by_multiplicity = Counter(Counter(element_slots).values())
+        multiplicities = sorted(num_kinds_by_multiplicity)
+
+        entropy = 0.0
+        num_elements_probs = defaultdict(float)
+        # depth first over multiplicity patterns: (alpha, number of seen slots, number of kinds left per multiplicity,
+        # pattern length, number of kind sequences with that pattern)
+        stack = [([1.0] + [0.0] * max_num_draws, 0, tuple(num_kinds_by_multiplicity[m] for m in multiplicities), 0, 1)]
+        while stack:
+            alpha, num_seen_slots, num_kinds_left, length, num_sequences = stack.pop()
+            gamma = _repeat_seen_slots(alpha, num_seen_slots, num_slots)
+            sequence_prob = sum(prob * gamma[num_draws] for num_draws, prob in num_draws_probs.items())
+            if sequence_prob > 0:
+                entropy -= num_sequences * sequence_prob * math.log(sequence_prob)
+                num_elements_probs[length] += num_sequences * sequence_prob
+            if length == max_num_draws:
+                continue
+            for i, multiplicity in enumerate(multiplicities):
+                if num_kinds_left[i] > 0:
+                    stack.append((_add_new_kind(gamma, multiplicity, num_slots), num_seen_slots + multiplicity,
+                                  num_kinds_left[:i] + (num_kinds_left[i] - 1,) + num_kinds_left[i + 1:], length + 1,
+                                  num_sequences * num_kinds_left[i]))
+
+        self._kind_sequence_stats_cache[element_slots] = (entropy, dict(sorted(num_elements_probs.items())))
+        return self._kind_sequence_stats_cache[element_slots]
+
+    def get_kind_inclusion_probs(self, sex_group, age_group):
+        inclusion_probs = defaultdict(float)
+        for num_elements, prob in self.num_elements_to_add_probs.items():
+            for kind, kind_prob in get_element_kind_inclusion_probs(sex_group, age_group, num_elements).items():
+                inclusion_probs[kind] += prob * kind_prob
+        return dict(inclusion_probs)
+
+    # marginals and entropy
+
+    def iter_demographic_latents(self):
+        # (ethnicity group, sex group, age group, probability)
+        for ethnicity_group, group_prob in self.ethnicity_group_probs.items():
+            for sex_group, sex_prob in self.sex_group_probs.items():
+                for age_group, age_prob in self.age_group_probs.items():
+                    yield ethnicity_group, sex_group, age_group, group_prob * sex_prob * age_prob
+
+    def get_marginals(self):
+        """Exact marginal probability of every value of every prompt attribute (see `FacePromptSampler.prompt_attribute_vocabularies`).
+
+        Returns {attribute name: {value: probability}} with decoded values, where None stands for an attribute
+        that is not part of the prompt. 'element_kinds' holds the inclusion probability of every element kind
+        (these do not sum to one).
+        """
+
+        sampler = FacePromptSampler
+        marginals = {name: defaultdict(float) for name in sampler.prompt_attribute_names}
+        inclusion_probs_cache = {}
+        for ethnicity_group, sex_group, age_group, prob in self.iter_demographic_latents():
+            marginals['ethnicity_group'][ethnicity_group] += prob
+            marginals['sex_group'][sex_group] += prob
+            marginals['age_group'][age_group] += prob
+            marginals['ethnicity'][None] += 0.5 * prob
+            for ethnicity, ethnicity_prob in get_uniform_probs(sampler.ethnicities[ethnicity_group]).items():
+                marginals['ethnicity'][ethnicity] += 0.5 * prob * ethnicity_prob
+            for age, age_prob in self.get_age_probs(age_group)[1].items():
+                marginals['age'][age] += prob * age_prob
+
+            element_slots = self.element_slots[(sex_group, age_group)]
+            for num_elements, num_elements_prob in self.get_kind_sequence_stats(element_slots)[1].items():
+                marginals['num_elements'][num_elements] += prob * num_elements_prob
+            if (sex_group, age_group) not in inclusion_probs_cache:
+                inclusion_probs_cache[(sex_group, age_group)] = self.get_kind_inclusion_probs(sex_group, age_group)
+            inclusion_probs = inclusion_probs_cache[(sex_group, age_group)]
+            for kind, inclusion_prob in inclusion_probs.items():
+                marginals['element_kinds'][kind] += prob * inclusion_prob
+
+            for kind in sampler.element_kind_attribute_names:
+                attribute_probs_list = self.get_element_attribute_probs(kind, ethnicity_group)
+                inclusion_prob = inclusion_probs.get(kind, 0.0)
+                for name, attribute_probs in zip(sampler.element_kind_attribute_names[kind], attribute_probs_list):
+                    marginals[name][None] += prob * (1 - inclusion_prob)
+                    for value, value_prob in attribute_probs.items():
+                        marginals[name][value] += prob * inclusion_prob * value_prob
+
+        return {name: dict(sorted(values.items(), key=lambda item: -item[1])) for name, values in marginals.items()}
+
+    def get_marginals_dataframe(self):
+        # one row per (attribute, value), for coverage tables
+        return pd.DataFrame([{'attribute': name, 'value': value, 'probability': prob}
+                             for name, values in self.get_marginals().items() for value, prob in values.items()])
+
+    def get_entropy(self):
+        """Entropy of the prompt distribution, in nats (divide by log(2) for bits).
+
+        Returns a dict with 'entropy' and 'entropy_lower_bound' and the exact components. 'entropy' is
+        the joint entropy of the prompt and of the latents that change the element distributions (ethnicity
+        group and element slot list). It equals the entropy of the prompt text whenever these latents can be
+        read from the prompt; a few ethnicity names are shared by several groups, so the prompt entropy lies
+        in [entropy_lower_bound, entropy], with a gap of at most 'latent_ambiguity'. Both assume that the
+        elements of a prompt can be split back in a single way.
+        """
+
+        components = {
+            'prompt_start': _entropy(self.prompt_start_probs.values()),
+            'expression': _entropy(self.expression_probs.values()),
+            'location': _entropy(self.location_probs.values()),
+        }
+
+        # ethnicity group and ethnicity text
+        ethnicity_text_marginal = defaultdict(float)
+        group_and_text_entropy = 0.0
+        for ethnicity_group, group_prob in self.ethnicity_group_probs.items():
+            group_and_text_entropy += group_prob * (_entropy(self.ethnicity_text_probs[ethnicity_group].values()) - math.log(group_prob))
+            for text, prob in self.ethnicity_text_probs[ethnicity_group].items():
+                ethnicity_text_marginal[text] += group_prob * prob
+        components['ethnicity'] = group_and_text_entropy
+        group_ambiguity = group_and_text_entropy - _entropy(ethnicity_text_marginal.values())
+
+        # age and sex words (independent of the ethnicity group), and the element slot list they imply
+        age_sex_probs = defaultdict(float)
+        age_sex_slots_probs = defaultdict(float)
+        for sex_group, sex_prob in self.sex_group_probs.items():
+            for age_group, age_group_prob in self.age_group_probs.items():
+                unit, age_probs = self.get_age_probs(age_group)
+                element_slots = self.element_slots[(sex_group, age_group)]
+                for phrase, phrase_prob in self._get_age_sex_phrase_probs(sex_group, age_group).items():
+                    for age, age_prob in age_probs.items():
+                        prob = sex_prob * age_group_prob * phrase_prob * age_prob
+                        age_sex_probs[(age, unit, phrase)] += prob
+                        age_sex_slots_probs[(age, unit, phrase, sex_group, element_slots)] += prob
+        components['age_sex'] = _entropy(age_sex_probs.values())
+        slots_ambiguity = _entropy(age_sex_slots_probs.values()) - components['age_sex']
+        components['age_sex'] += slots_ambiguity
+
+        # elements: ordered kinds, then the text of every kind
+        sex_slots_probs = defaultdict(float)
+        for (age, unit, phrase, sex_group, element_slots), prob in age_sex_slots_probs.items():
+            sex_slots_probs[(sex_group, element_slots)] += prob
+        components['element_kinds'] = 0.0
+        components['element_texts'] = 0.0
+        modifier_entropy = self.get_modifier_entropy()
+        for (sex_group, element_slots), prob in sex_slots_probs.items():
+            components['element_kinds'] += prob * self.get_kind_sequence_stats(element_slots)[0]
+            age_group = next(age_group for (s, age_group), slots in self.element_slots.items() if s == sex_group and slots == element_slots)
+            for kind, inclusion_prob in self.get_kind_inclusion_probs(sex_group, age_group).items():
+                for ethnicity_group, group_prob in self.ethnicity_group_probs.items():
+                    kind_entropy = modifier_entropy if kind == 'modifiers' else _entropy(self.get_element_probs(kind, ethnicity_group, sex_group).values())
+                    components['element_texts'] += prob * inclusion_prob * group_prob * kind_entropy
+
+        entropy = sum(components.values())
+        latent_ambiguity = group_ambiguity + slots_ambiguity
+        return {'entropy': entropy, 'entropy_lower_bound': entropy - latent_ambiguity, 'latent_ambiguity': latent_ambiguity,
+                'components': components}
+
+    # likelihood scoring
+
+    def _get_element_texts(self, ethnicity_group, sex_group, element_slots):
+        # the text tables of the element kinds that can be part of a prompt (all but 'modifiers'), split by what they depend on
+        other_kinds = tuple(kind for kind in FacePromptSampler.element_kinds
+                            if kind not in self.group_element_kinds + self.sex_element_kinds + ('modifiers',))
+        return [self._get_text_table(self.group_element_kinds, element_slots, ethnicity_group=ethnicity_group),
+                self._get_text_table(self.sex_element_kinds, element_slots, sex_group=sex_group),
+                self._get_text_table(other_kinds, element_slots)]
+
+    def _get_text_table(self, element_kinds, element_slots, ethnicity_group=None, sex_group=None):
+        # ({text: [(kind bit, slot multiplicity, probability)]}, {first ", " separated piece of a text: largest number of pieces
+        # of the texts that start with it}) over the kinds of element_kinds that have slots in element_slots
+        multiplicities = tuple(element_slots.count(self.kind_indices[kind]) for kind in element_kinds)
+        key = (element_kinds, multiplicities, ethnicity_group, sex_group)
+        if key not in self._element_texts_cache:
+            texts = defaultdict(list)
+            for kind, multiplicity in zip(element_kinds, multiplicities):
+                if multiplicity > 0:
+                    for text, prob in self.get_element_probs(kind, ethnicity_group, sex_group).items():
+                        texts[text].append((1 << self.kind_indices[kind], multiplicity, prob))
+            max_num_pieces = {}
+            for text in texts:
+                first_piece = text.split(', ', 1)[0]
+                max_num_pieces[first_piece] = max(max_num_pieces.get(first_piece, 0), text.count(', ') + 1)
+            self._element_texts_cache[key] = dict(texts), max_num_pieces
+        return self._element_texts_cache[key]
+
+    def _iter_modifier_spans(self, pieces, start):
+        # (end, probability) of every modifier string made of pieces[start:end]
+        num_slots = len(self.modifier_slot_probs)
+        skip_probs = self.modifier_skip_probs
+        if pieces[start] == '':
+            yield start + 1, skip_probs[num_slots]
+            return
+
+        # next free slot -> probability of the options parsed so far
+        parse_probs = {0: 1.0}
+        for end in range(start, len(pieces)):
+            next_parse_probs = defaultdict(float)
+            for next_slot, prob in parse_probs.items():
+                for slot, option_prob in self.modifier_piece_slots.get(pieces[end], ()):
+                    if slot >= next_slot:
+                        next_parse_probs[slot + 1] += prob * skip_probs[slot] / skip_probs[next_slot] * option_prob
+            parse_probs = next_parse_probs
+            if not parse_probs:
+                return
+            yield end + 1, sum(prob * skip_probs[num_slots] / skip_probs[next_slot] for next_slot, prob in parse_probs.items())
+
+    def _get_elements_prob(self, pieces, ethnicity_group, sex_group, element_slots):
+        # probability that the elements added between the expression and the location read `', '.join(pieces)`,
+        # summed over all the ways to split the pieces into elements of different kinds
+        text_tables = self._get_element_texts(ethnicity_group, sex_group, element_slots)
+        modifiers_bit = 1 << self.kind_indices['modifiers']
+        modifiers_multiplicity = element_slots.count(self.kind_indices['modifiers'])
+
+        # states[position]: {(bit mask of the kinds used, their slot multiplicities in order): product of the element text probabilities}
+        states = [defaultdict(float) for _ in range(len(pieces) + 1)]
+        states[0][(0, ())] = 1.0
+        for start in range(len(pieces)):
+            if not states[start]:
+                continue
+            spans = []
+            for texts, max_num_pieces in text_tables:
+                for end in range(start + 1, min(start + max_num_pieces.get(pieces[start], 0), len(pieces)) + 1):
+                    for kind_bit, multiplicity, prob in texts.get(', '.join(pieces[start:end]), ()):
+                        spans.append((end, kind_bit, multiplicity, prob))
+            if modifiers_multiplicity and (pieces[start] in self.modifier_piece_slots or pieces[start] == ''):
+                for end, prob in self._iter_modifier_spans(pieces, start):
+                    spans.append((end, modifiers_bit, modifiers_multiplicity, prob))
+
+            for (used_kinds, kind_multiplicities), state_prob in states[start].items():
+                for end, kind_bit, multiplicity, prob in spans:
+                    if not used_kinds & kind_bit:
+                        states[end][(used_kinds | kind_bit, kind_multiplicities + (multiplicity,))] += state_prob * prob
+
+        # the order of the kinds only matters through their multiplicities
+        return sum(state_prob * self.get_kind_sequence_prob(element_slots, kind_multiplicities)
+                   for (used_kinds, kind_multiplicities), state_prob in states[len(pieces)].items())
+
+    def _get_base_prompt_latents(self, base_prompt):
+        # {(ethnicity group, sex group, element slots): probability of base_prompt and these latents}
+        latent_probs = defaultdict(float)
+        match = self.base_prompt_pattern.fullmatch(base_prompt)
+        if match is None or match.group(1) not in self.prompt_start_probs:
+            return latent_probs
+
+        start_prob = self.prompt_start_probs[match.group(1)]
+        age, unit, words = int(match.group(2)), match.group(3), match.group(4).split(' ')
+        for split_index in range(1, len(words)):
+            ethnicity_group_probs = self.ethnicity_text_groups.get(' '.join(words[:split_index]))
+            phrase_latents = self.age_sex_phrases.get(' '.join(words[split_index:]))
+            if not ethnicity_group_probs or not phrase_latents:
+                continue
+            for sex_group, age_group, phrase_prob in phrase_latents:
+                age_unit, age_probs = self.get_age_probs(age_group)
+                if age_unit != unit or age not in age_probs:
+                    continue
+                prob = start_prob * self.sex_group_probs[sex_group] * self.age_group_probs[age_group] * phrase_prob * age_probs[age]
+                for ethnicity_group, text_prob in ethnicity_group_probs.items():
+                    key = (ethnicity_group, sex_group, self.element_slots[(sex_group, age_group)])
+                    latent_probs[key] += prob * self.ethnicity_group_probs[ethnicity_group] * text_prob
+        return latent_probs
+
+    def score_prompt(self, prompt):
+        """Natural log of the probability that the generator returns exactly `prompt` (-inf if it never does)."""
+
+        if prompt in self._score_cache:
+            return self._score_cache[prompt]
+
+        base_prompt, separator, elements_text = prompt.partition(',  ')
+        pieces = elements_text.split(', ')
+        total_prob = 0.0
+        if separator and pieces[0] in self.expression_probs:
+            latent_probs = self._get_base_prompt_latents(base_prompt)
+            for num_location_pieces in range(1, min(self.max_location_pieces, len(pieces) - 1) + 1):
+                location_prob = self.location_probs.get(', '.join(pieces[-num_location_pieces:]), 0.0)
+                if location_prob == 0.0:
+                    continue
+                for (ethnicity_group, sex_group, element_slots), prob in latent_probs.items():
+                    total_prob += prob * location_prob * self._get_elements_prob(pieces[1:-num_location_pieces], ethnicity_group,
+                                                                                 sex_group, element_slots)
+            total_prob *= self.expression_probs[pieces[0]]
+
+        log_prob = math.log(total_prob) if total_prob > 0 else -math.inf
+        if len(self._score_cache) < 1_000_000:
+            self._score_cache[prompt] = log_prob
+        return log_prob
+
+    def score_prompts(self, prompts, num_workers=1, chunk_size=5000):
+        # log probabilities of a list of prompts, as a float array (-inf for prompts the generator cannot produce).
+        # num_workers > 1 (or None, one per CPU) scores chunks of the prompts in parallel, every worker builds its own tables
+        if num_workers == 1:
+            return np.array([self.score_prompt(prompt) for prompt in prompts], dtype=np.float64)
+
+        prompt_chunks = [prompts[start:start + chunk_size] for start in range(0, len(prompts), chunk_size)]
+        with Pool(num_workers, initializer=_init_scoring_worker, initargs=(self.conditions,)) as pool:
+            log_probs = list(pool.imap(_score_prompts_chunk, prompt_chunks))
+        return np.concatenate(log_probs or [np.zeros(0)])
+
+#%% Parallel scoring
+
+_worker_prompt_space_model = None
+
+def _init_scoring_worker(conditions_dict):
+    global _worker_prompt_space_model
+    _worker_prompt_space_model = PromptSpaceModel(**conditions_dict)
+
+def _score_prompts_chunk(prompts):
+    return _worker_prompt_space_model.score_prompts(prompts)
+
+#%% Dataset helpers
+
+def get_generator_prompts(df):
+    # the prompts as returned by the generator: DALLE3 rows hold the revised prompt in 'text_prompt' and the original one in the configs
+    prompts = df['text_prompt'].tolist()
+    if 'configs' in df.columns:
+        for i, configs in enumerate(df['configs'].tolist()):
+            if isinstance(configs, str) and '"orig_prompt"' in configs:
+                prompts[i] = json.loads(configs)['orig_prompt']
+    return prompts
+
+def get_importance_weights(log_probs_target, log_probs_source):
+    # self normalized importance weights (mean 1) that reweight prompts drawn from the source model to the target model
+    log_weights = np.asarray(log_probs_target, dtype=np.float64) - np.asarray(log_probs_source, dtype=np.float64)
+    log_weights[~np.isfinite(log_weights)] = -np.inf
+    weights = np.exp(log_weights - np.max(log_weights))
+    return weights * len(weights) / weights.sum()
+
+def get_attribute_coverage(model, df, dataset_folder):
+    # expected vs. observed frequency of every attribute value, for datasets created with the prompt attribute columns
+    with open(os.path.join(dataset_folder, 'prompt_attribute_vocabularies.json'), 'r') as f:
+        vocabularies = json.load(f)
+
+    coverage_df = model.get_marginals_dataframe()
+    observed_probs = []
+    for name, value in zip(coverage_df['attribute'], coverage_df['value']):
+        if name not in df.columns:
+            observed_probs.append(np.nan)
+        elif name == 'element_kinds':
+            observed_probs.append(((df[name].values >> vocabularies[name].index(value)) & 1).mean())
+        elif name in vocabularies:
+            observed_probs.append((df[name].values == (-1 if value is None else vocabularies[name].index(value))).mean())
+        else:
+            observed_probs.append((df[name].values == value).mean())
+    coverage_df['observed_probability'] = observed_probs
+    coverage_df['expected_count'] = coverage_df['probability'] * len(df)
+    coverage_df['observed_count'] = coverage_df['observed_probability'] * len(df)
+    return coverage_df
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    dataset_folder = r"SFHQ_T2I_dataset"
+    conditions_dict = {}  # e.g. {'age_group': 'elderly'}
+    num_workers = None  # one worker per CPU
+
+    start_time = time.time()
+    prompt_space_model = PromptSpaceModel(**conditions_dict)
+    entropy = prompt_space_model.get_entropy()
+    marginals = prompt_space_model.get_marginals()
+    print(f"Exact prompt space statistics computed in {time.time() - start_time:.1f} seconds")
+
+    print(f"\nPrompt entropy: {entropy['entropy'] / math.log(2):.2f} bits "
+          f"(lower bound {entropy['entropy_lower_bound'] / math.log(2):.2f} bits)")
+    for name, component in entropy['components'].items():
+        print(f"{name:>20}: {component / math.log(2):6.2f} bits")
+
+    print()
+    for name in ['age_group', 'num_elements', 'element_kinds', 'lighting_category']:
+        print(f"{name}: " + ', '.join(f"{value}: {prob:.4f}" for value, prob in marginals[name].items()))
+
+    csv_path = os.path.join(dataset_folder, "SFHQ_T2I_dataset.csv")
+    if os.path.exists(csv_path):
+        df = pd.read_csv(csv_path)
+
+        start_time = time.time()
+        log_probs = prompt_space_model.score_prompts(get_generator_prompts(df), num_workers=num_workers)
+        print(f"\nScored {len(df)} prompts in {time.time() - start_time:.1f} seconds")
+
+        is_possible = np.isfinite(log_probs)
+        print(f"Prompts the generator can produce: {is_possible.mean():.2%}")
+        print(f"Mean negative log likelihood: {-log_probs[is_possible].mean() / math.log(2):.2f} bits per prompt")
+
+        # e.g. reweight the dataset as if only female prompts were generated
+        log_probs_female = PromptSpaceModel(**{**conditions_dict, 'sex_group': 'female'}).score_prompts(get_generator_prompts(df), num_workers=num_workers)
+        weights = get_importance_weights(log_probs_female, log_probs)
+        print(f"Effective sample size of the female reweighting: {weights.sum() ** 2 / (weights ** 2).sum():.0f}")
+
+        if 'age_group' in df.columns:
+            print(get_attribute_coverage(prompt_space_model, df, dataset_folder))
+
+#%%
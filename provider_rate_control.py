@@ -0,0 +1,456 @@
+#%% Imports
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+import email.utils
+
+#%% Throttling responses
+
+def get_retry_after_sec(exception):
+    # Retry-After (or retry-after-ms, sent by OpenAI) of the HTTP response attached to an API error, or the same key in the
+    # trailing metadata of a gRPC error, None when there is none. openai, fal_client and httpx errors all carry the httpx
+    # response in `exception.response`
+    headers = getattr(getattr(exception, 'response', None), 'headers', None)
+    trailing_metadata = getattr(exception, 'trailing_metadata', None)
+    if not headers and callable(trailing_metadata):
+        try:
+            headers = {key: value for key, value in trailing_metadata() or ()}
+        except Exception:
+            headers = None
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get('retry-after')
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def get_error_status_code(exception):
+    status_code = getattr(exception, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(exception, 'response', None), 'status_code', None)
+    return status_code
+
+def get_grpc_code_name(exception):
+    # the status code name of a gRPC error (e.g. 'UNAVAILABLE'), None for other errors
+    grpc_code = getattr(exception, 'code', None)
+    if callable(grpc_code):
+        try:
+            return getattr(grpc_code(), 'name', None)
+        except Exception:
+            pass
+    return None
+
+def is_throttling_error(exception):
+    # HTTP 429, gRPC RESOURCE_EXHAUSTED (the Stability API), or any error response that asks to retry later
+    if get_error_status_code(exception) == 429 or get_grpc_code_name(exception) == 'RESOURCE_EXHAUSTED':
+        return True
+    return get_retry_after_sec(exception) is not None
+
+# invalid requests (e.g. a prompt rejected by the content policy, a bad API key or model name), retrying cannot help
+PERMANENT_HTTP_STATUS_CODES = {400, 401, 403, 404, 405, 413, 415, 422}
+PERMANENT_GRPC_CODE_NAMES = {'INVALID_ARGUMENT', 'PERMISSION_DENIED', 'UNAUTHENTICATED', 'NOT_FOUND', 'FAILED_PRECONDITION',
+                             'OUT_OF_RANGE', 'UNIMPLEMENTED'}
+
+def classify_error(exception):
+    # 'throttled' (retried after the pause the provider asks for), 'permanent' (not retried), or 'transient' for server
+    # errors, timeouts, broken connections and any other error (retried with exponential backoff)
+    if is_throttling_error(exception):
+        return 'throttled'
+    if get_error_status_code(exception) in PERMANENT_HTTP_STATUS_CODES or get_grpc_code_name(exception) in PERMANENT_GRPC_CODE_NAMES:
+        return 'permanent'
+    return 'transient'
+
+def get_backoff_sec(num_failures, base_sec=1.0, max_sec=60.0):
+    # exponential backoff with full jitter, so the retries of many concurrent calls do not arrive in waves
+    return random.uniform(0, min(max_sec, base_sec * 2 ** (num_failures - 1)))
+
+#%% Adaptive rate controller
+
+class ProviderRateController:
+    """Token bucket rate limit and adaptive (AIMD) concurrency limit of the requests sent to one provider.
+
+    `await acquire()` waits until a request may start: the token bucket has a token (at most
+    `requests_per_minute` requests per minute, bursts of up to `burst_size`), fewer than
+    `concurrency_limit` requests are in progress, and the provider did not ask to pause.
+    `await release(start_time, ...)` reports how the request ended. While the error rate and the
+    latency stay healthy the concurrency limit grows by about one per round of completed requests
+    (additive increase). A throttling response (HTTP 429, gRPC RESOURCE_EXHAUSTED or a Retry-After
+    header) cuts it by `decrease_factor`, empties the bucket and pauses new requests for the
+    Retry-After time (multiplicative decrease). A high error rate cuts it gently. Requests that were
+    already in progress when the limit was cut do not cut it again, so a burst of throttling
+    responses counts as a single congestion signal.
+    """
+
+    def __init__(self, name, requests_per_minute=None, max_concurrency=10, min_concurrency=1, initial_concurrency=None,
+                 burst_size=None, decrease_factor=0.5, error_decrease_factor=0.9, max_error_rate=0.2, latency_tolerance=2.0,
+                 default_retry_after_sec=5.0):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+        self.error_decrease_factor = error_decrease_factor
+        self.max_error_rate = max_error_rate
+        self.latency_tolerance = latency_tolerance
+        self.default_retry_after_sec = default_retry_after_sec
+
+        # one second worth of requests by default, so a low limit (e.g. a few images per minute) does not start with a burst
+        self.burst_size = burst_size if burst_size is not None else max(1.0, (requests_per_minute or 0) / 60)
+        self.tokens = self.burst_size
+        self.last_refill_time = time.monotonic()
+
+        if initial_concurrency is None:
+            initial_concurrency = max(min_concurrency, max_concurrency // 2)
+        self.concurrency_limit = float(initial_concurrency)
+        self.num_in_progress = 0
+        self.paused_until = 0.0
+        self.last_decrease_time = -float('inf')
+
+        self.error_rate = 0.0
+        self.latency_sec = None
+        self.min_latency_sec = None
+
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_throttled = 0
+
+        self.condition = asyncio.Condition()
+
+    def _refill_tokens(self, now):
+        if self.requests_per_minute is not None:
+            self.tokens = min(self.burst_size, self.tokens + (now - self.last_refill_time) * self.requests_per_minute / 60)
+        self.last_refill_time = now
+
+    def _get_wait_sec(self, now):
+        # 0 when a request may start now, None to wait for a release, else the time until one may start
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.num_in_progress >= int(self.concurrency_limit):
+            return None
+        if self.requests_per_minute is not None and self.tokens < 1:
+            return (1 - self.tokens) * 60 / self.requests_per_minute
+        return 0
+
+    async def acquire(self):
+        # returns the start time of the request, to pass to release()
+        async with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill_tokens(now)
+                wait_sec = self._get_wait_sec(now)
+                if wait_sec == 0:
+                    if self.requests_per_minute is not None:
+                        self.tokens -= 1
+                    self.num_in_progress += 1
+                    return now
+                try:
+                    await asyncio.wait_for(self.condition.wait(), wait_sec)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _decrease_concurrency(self, start_time, factor, now):
+        if start_time >= self.last_decrease_time:
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit * factor)
+            self.last_decrease_time = now
+
+    async def release(self, start_time, throttled=False, error=False, retry_after_sec=None):
+        async with self.condition:
+            now = time.monotonic()
+            self.num_in_progress -= 1
+            self.num_requests += 1
+            self.num_errors += error or throttled
+            self.num_throttled += throttled
+
+            if throttled:
+                self.paused_until = max(self.paused_until, now + (retry_after_sec if retry_after_sec is not None else self.default_retry_after_sec))
+                self.tokens = 0
+                self._decrease_concurrency(start_time, self.decrease_factor, now)
+            else:
+                self.error_rate = 0.9 * self.error_rate + 0.1 * error
+                if not error:
+                    latency_sec = now - start_time
+                    self.latency_sec = latency_sec if self.latency_sec is None else 0.8 * self.latency_sec + 0.2 * latency_sec
+                    self.min_latency_sec = self.latency_sec if self.min_latency_sec is None else min(self.min_latency_sec, self.latency_sec)
+
+                if self.error_rate > self.max_error_rate:
+                    self._decrease_concurrency(start_time, self.error_decrease_factor, now)
+                elif not error and self.latency_sec <= self.latency_tolerance * self.min_latency_sec:
+                    self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+
+            self.condition.notify_all()
+
+    def get_summary(self):
+        latency = f"{self.latency_sec:.2f} sec" if self.latency_sec is not None else "-"
+        return (f"{self.name}: concurrency limit {self.concurrency_limit:.1f}, {self.num_requests} requests, "
+                f"{self.num_throttled} throttled, {self.num_errors - self.num_throttled} other errors, latency {latency}")
+
+#%% Circuit breaker
+
+class CircuitBreaker:
+    """Holds back the calls to a provider during an outage instead of failing them one by one.
+
+    While closed, calls go through. After `failure_threshold` consecutive transient failures the
+    breaker opens: `get_wait_sec()` makes new calls wait `reset_timeout_sec`, then lets a single
+    trial call through (half open). A success closes the breaker, a failure opens it again with
+    twice the timeout, up to `max_reset_timeout_sec`. The calls wait rather than fail fast, so an
+    outage pauses a run instead of sending all its samples to the dead letter file. Throttling
+    responses are left to the rate controller and invalid requests count neither as failures nor
+    as successes, they only hand the half open trial to the next call (`release_trial()`).
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout_sec=30.0, max_reset_timeout_sec=600.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.initial_reset_timeout_sec = reset_timeout_sec
+        self.reset_timeout_sec = reset_timeout_sec
+        self.max_reset_timeout_sec = max_reset_timeout_sec
+
+        self.state = 'closed'
+        self.num_consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_start_time = None
+        self.num_opened = 0
+        self.lock = threading.Lock()
+
+    def get_wait_sec(self):
+        # 0 when a call may start now (the trial call when half open), else the time to wait before asking again
+        with self.lock:
+            now = time.monotonic()
+            if self.state == 'closed':
+                return 0
+            if self.state == 'open':
+                if now < self.open_until:
+                    return self.open_until - now
+                self.state = 'half_open'
+                self.trial_start_time = None
+            # a trial call that never reported back (e.g. cancelled) is replaced after a timeout
+            if self.trial_start_time is None or now - self.trial_start_time > self.reset_timeout_sec:
+                self.trial_start_time = now
+                return 0
+            return min(1.0, self.reset_timeout_sec)
+
+    def record_success(self):
+        with self.lock:
+            if self.state != 'closed':
+                print(f"Circuit breaker {self.name}: closed")
+            self.state = 'closed'
+            self.num_consecutive_failures = 0
+            self.reset_timeout_sec = self.initial_reset_timeout_sec
+
+    def release_trial(self):
+        # a throttled or invalid trial call says nothing about the outage, the next call becomes the trial right away
+        with self.lock:
+            if self.state == 'half_open':
+                self.trial_start_time = None
+
+    def record_failure(self):
+        with self.lock:
+            self.num_consecutive_failures += 1
+            if self.state == 'half_open':
+                self.reset_timeout_sec = min(self.max_reset_timeout_sec, 2 * self.reset_timeout_sec)
+            elif self.state == 'open' or self.num_consecutive_failures < self.failure_threshold:
+                return
+            self.state = 'open'
+            self.open_until = time.monotonic() + self.reset_timeout_sec
+            self.num_opened += 1
+            print(f"Circuit breaker {self.name}: opened for {self.reset_timeout_sec:.0f} seconds after {self.num_consecutive_failures} consecutive failures")
+
+#%% Dead letters
+
+class DeadLetterFile:
+    """Append only JSON lines file of the calls that failed after all their retries.
+
+    Every record holds the caller's description of the sample (e.g. the model, prompt and prompt
+    attributes), the error class (see classify_error), the error message and the number of
+    attempts, so the samples can be replayed later (see read_dead_letters) instead of being lost.
+    """
+
+    def __init__(self, dead_letter_path):
+        self.dead_letter_path = dead_letter_path
+        self.num_records = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        with self.lock:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+            self.num_records += 1
+
+def read_dead_letters(dead_letter_path):
+    # a last line that was cut off by a crash is skipped
+    records = []
+    if not os.path.exists(dead_letter_path):
+        return records
+    with open(dead_letter_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Skipping an incomplete line of the dead letter file '{dead_letter_path}'")
+    return records
+
+def add_dead_letter(dead_letter, dead_letter_record, exception, num_attempts):
+    print(f"Giving up after {num_attempts} attempts ({classify_error(exception)} error: {exception})")
+    if dead_letter is not None:
+        dead_letter({**(dead_letter_record or {}), 'error_class': classify_error(exception), 'error': str(exception)[:1000],
+                     'num_attempts': num_attempts, 'time': time.time()})
+
+#%% Retries
+
+def get_retry_wait_sec(exception, num_failures, num_throttled, max_retries, max_throttled_retries, backoff_base_sec, backoff_max_sec):
+    # the time to wait before the next attempt after a failed one, None when the call should give up
+    error_class = classify_error(exception)
+    if error_class == 'permanent':
+        return None
+    if error_class == 'throttled':
+        if num_throttled > max_throttled_retries:
+            return None
+        retry_after_sec = get_retry_after_sec(exception)
+        return retry_after_sec if retry_after_sec is not None else get_backoff_sec(num_throttled, backoff_base_sec, backoff_max_sec)
+    if num_failures >= max_retries:
+        return None
+    return get_backoff_sec(num_failures, backoff_base_sec, backoff_max_sec)
+
+def call_with_retries(func, max_retries=5, max_throttled_retries=8, circuit_breaker=None, dead_letter=None, dead_letter_record=None,
+                      backoff_base_sec=1.0, backoff_max_sec=60.0, **kwargs):
+    # calls func(**kwargs) with up to max_retries attempts on transient errors (exponential backoff with jitter) and
+    # max_throttled_retries on throttling responses (after their Retry-After time), invalid requests are not retried.
+    # the calls wait while the circuit_breaker (a CircuitBreaker, None for none) is open. when all attempts fail, the
+    # dead_letter_record and the error are passed to dead_letter (e.g. a DeadLetterFile) and None is returned
+    num_failures = 0
+    num_throttled = 0
+    while True:
+        while circuit_breaker is not None and (wait_sec := circuit_breaker.get_wait_sec()) > 0:
+            time.sleep(wait_sec)
+        try:
+            result = func(**kwargs)
+        except Exception as e:
+            error_class = classify_error(e)
+            num_failures += error_class != 'throttled'
+            num_throttled += error_class == 'throttled'
+            if circuit_breaker is not None:
+                if error_class == 'transient':
+                    circuit_breaker.record_failure()
+                else:
+                    circuit_breaker.release_trial()
+
+            wait_sec = get_retry_wait_sec(e, num_failures, num_throttled, max_retries, max_throttled_retries, backoff_base_sec, backoff_max_sec)
+            if wait_sec is None:
+                add_dead_letter(dead_letter, dead_letter_record, e, num_failures + num_throttled)
+                return None
+            print(f"{error_class.capitalize()} error: {e}. Retrying in {wait_sec:.2f} seconds...")
+            time.sleep(wait_sec)
+        else:
+            if circuit_breaker is not None:
+                circuit_breaker.record_success()
+            return result
+
+async def call_with_rate_control(rate_controller, async_func, max_retries=5, max_throttled_retries=8, circuit_breaker=None, dead_letter=None,
+                                 dead_letter_record=None, backoff_base_sec=1.0, backoff_max_sec=60.0, **kwargs):
+    # same as call_with_retries for an async_func, under the rate controller (None for no control): throttling responses
+    # wait for the controller, which pauses the provider for their Retry-After time, instead of a backoff of their own
+    num_failures = 0
+    num_throttled = 0
+    while True:
+        while circuit_breaker is not None and (wait_sec := circuit_breaker.get_wait_sec()) > 0:
+            await asyncio.sleep(wait_sec)
+        start_time = await rate_controller.acquire() if rate_controller is not None else None
+        exception = None
+        completed = False
+        try:
+            result = await async_func(**kwargs)
+            completed = True
+        except Exception as e:
+            exception = e
+        finally:
+            # also runs when the call is cancelled (CancelledError is not an Exception), which would otherwise hold its
+            # slot of the controller for good
+            if rate_controller is not None:
+                if exception is not None:
+                    await rate_controller.release(start_time, throttled=classify_error(exception) == 'throttled', error=True,
+                                                  retry_after_sec=get_retry_after_sec(exception))
+                else:
+                    await rate_controller.release(start_time, error=not completed)
+
+        if exception is None:
+            if circuit_breaker is not None:
+                circuit_breaker.record_success()
+            return result
+
+        error_class = classify_error(exception)
+        num_failures += error_class != 'throttled'
+        num_throttled += error_class == 'throttled'
+        if circuit_breaker is not None:
+            if error_class == 'transient':
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.release_trial()
+
+        wait_sec = get_retry_wait_sec(exception, num_failures, num_throttled, max_retries, max_throttled_retries, backoff_base_sec, backoff_max_sec)
+        if wait_sec is None:
+            add_dead_letter(dead_letter, dead_letter_record, exception, num_failures + num_throttled)
+            return None
+        if error_class == 'throttled' and rate_controller is not None:
+            print(f"Throttled: {exception}")
+            continue
+        print(f"{error_class.capitalize()} error: {exception}. Retrying in {wait_sec:.2f} seconds...")
+        await asyncio.sleep(wait_sec)
+
+#%% Usage
+
+if __name__ == "__main__":
+
+    # simulated provider that allows 600 requests per minute and answers in about 0.5 seconds,
+    # the controller should settle near 10 requests per second, i.e. a concurrency of about 5
+    provider_requests_per_minute = 600
+    controller_requests_per_minute = None  # unknown to the controller, it has to find the limit from the 429 responses
+    num_requests = 200
+
+    class SimulatedThrottlingError(Exception):
+        def __init__(self):
+            super().__init__("429 Too Many Requests")
+            self.status_code = 429
+
+    recent_request_times = []
+
+    async def simulated_request():
+        # the provider throttles requests above its limit over a sliding 1 second window
+        now = time.monotonic()
+        recent_request_times[:] = [request_time for request_time in recent_request_times if request_time > now - 1]
+        if len(recent_request_times) >= provider_requests_per_minute / 60:
+            raise SimulatedThrottlingError()
+        recent_request_times.append(now)
+        await asyncio.sleep(random.uniform(0.4, 0.6))
+        return True
+
+    async def run_simulation():
+        controller = ProviderRateController('simulated', controller_requests_per_minute, max_concurrency=10, default_retry_after_sec=1.0)
+        start_time = time.time()
+        results = await asyncio.gather(*[call_with_rate_control(controller, simulated_request) for _ in range(num_requests)])
+        duration_sec = time.time() - start_time
+        print(controller.get_summary())
+        print(f"{sum(result is not None for result in results)} of {num_requests} requests succeeded, "
+              f"{60 * num_requests / duration_sec:.0f} requests per minute (limit {provider_requests_per_minute})")
+
+    asyncio.run(run_simulation())
+
+#%%